@@ -0,0 +1,45 @@
+#Times QuestionSet.clone against copying the same set through the ORM, the way re-entering
+#every question through create_question would.
+#usage: python benchmarks/clone.py [database url]
+import sys
+import time
+
+from dataset import DEFAULT_URL, connect, drop, populate
+from qa.models import QuestionSet
+
+QUESTIONS = 10000
+
+def orm_copy(question_set, topic_id, description, db):
+    new_question_set = QuestionSet(topic_id=topic_id, description=description)
+    db.add(new_question_set)
+    db.flush()
+    for question in question_set.get_questions(db):
+        values = {
+            key: value for key, value in question.__dict__.items()
+            if not key.startswith('_') and key not in ('id', 'question_set_id', 'question_set', 'type')
+        }
+        db.add(type(question)(question_set_id=new_question_set.id, **values))
+    db.commit()
+
+def timed(name, fn):
+    start = time.perf_counter()
+    fn()
+    print('{:<30} {:.0f} ms'.format(name, (time.perf_counter() - start) * 1000))
+
+def main(argv=sys.argv):
+    engine, Session = connect(argv[1] if len(argv) > 1 else DEFAULT_URL)
+    try:
+        populate(engine, users=1, topics=2, sets=1, questions=QUESTIONS)
+        print('questions per set: {}'.format(QUESTIONS))
+        db = Session()
+        question_set = db.query(QuestionSet).filter(QuestionSet.id == 1).one()
+        timed('ORM copy', lambda: orm_copy(question_set, 2, 'ORM copy', db))
+        db.expunge_all()
+        question_set = db.query(QuestionSet).filter(QuestionSet.id == 1).one()
+        timed('QuestionSet.clone', lambda: question_set.clone(2, 'Clone', db))
+        db.close()
+    finally:
+        drop(engine)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#Times grading many submissions of one question set with qa.grading against calling each
+#question's is_correct per answer.  Needs no database.
+#usage: python benchmarks/grading.py [submissions] [questions]
+import random
+import sys
+import time
+
+from qa.grading import AnswerKey
+from qa.models import Accuracy, MathQuestion, MultipleChoiceQuestion, TrueFalseQuestion
+
+def make_questions(count):
+    questions = []
+    for i in range(count):
+        if i % 3 == 0:
+            questions.append(MultipleChoiceQuestion(id=i, correct_answer=i % 4))
+        elif i % 3 == 1:
+            questions.append(TrueFalseQuestion(id=i, correct_answer=i % 2 == 0))
+        else:
+            questions.append(MathQuestion(id=i, correct_answer=i, accuracy=Accuracy.percentage, accuracy_degree=5, units='m', units_given=False))
+    return questions
+
+def make_submissions(questions, count, rng):
+    submissions = []
+    for _ in range(count):
+        answers = []
+        for question in questions:
+            if isinstance(question, MathQuestion):
+                answers.append({'answer': question.correct_answer * rng.uniform(0.9, 1.1), 'units': rng.choice(['m', 'M', 's'])})
+            else:
+                answers.append({'answer': rng.randrange(4 if isinstance(question, MultipleChoiceQuestion) else 2)})
+        submissions.append(answers)
+    return submissions
+
+def timed(name, fn):
+    start = time.perf_counter()
+    result = fn()
+    print('{:<30} {:.0f} ms'.format(name, (time.perf_counter() - start) * 1000))
+    return result
+
+def main(argv=sys.argv):
+    submission_count = int(argv[1]) if len(argv) > 1 else 5000
+    question_count = int(argv[2]) if len(argv) > 2 else 60
+    questions = make_questions(question_count)
+    submissions = make_submissions(questions, submission_count, random.Random(0))
+    keys = [question.answer_key() for question in questions]
+    print('submissions: {} questions: {}'.format(submission_count, question_count))
+
+    scores = timed('is_correct per answer', lambda: [
+        sum(question.is_correct(key, answer) for question, key, answer in zip(questions, keys, answers))
+        for answers in submissions
+    ])
+    answer_key = timed('compile AnswerKey', lambda: AnswerKey(questions, keys))
+    values, units = timed('answer_matrix', lambda: answer_key.answer_matrix(submissions))
+    grades = timed('AnswerKey.grade', lambda: answer_key.grade(values, units))
+    assert grades.scores.tolist() == scores
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#Compares the ownership queries used by the qa.security decorators before and after they
+#stopped joining users and learned to load a single question subtype.
+#usage: python benchmarks/ownership.py [database url]
+import random
+import sys
+
+from dataset import DEFAULT_URL, connect, drop, populate, time_ms
+from qa.models import Question, QuestionSet, QuestionType, Topic, User
+
+def old_question_set_is_contributor(user_id, question_set_id, db):
+    return db.query(QuestionSet).\
+        join(Topic).\
+        join(User).\
+        filter(QuestionSet.id == question_set_id, User.id == user_id).one_or_none()
+
+def old_question_is_contributor(user_id, question_set_id, question_id, db):
+    return db.query(Question.LOAD_COMPLETE_POLYMORPHIC_RELATION).\
+        join(QuestionSet).\
+        join(Topic).\
+        join(User).\
+        filter(Question.id == question_id, QuestionSet.id == question_set_id, User.id == user_id).one_or_none()
+
+def main(argv=sys.argv):
+    engine, Session = connect(argv[1] if len(argv) > 1 else DEFAULT_URL)
+    try:
+        counts = populate(engine, users=50, topics=20, sets=10, questions=20)
+        print('users: {} topics: {} sets: {} questions: {}'.format(*counts))
+        db = Session()
+        rows = db.query(Question.id, Question.question_set_id, Question.type, Topic.user_id).\
+            join(QuestionSet, Question.question_set_id == QuestionSet.id).join(Topic, QuestionSet.topic_id == Topic.id).all()
+        random.seed(0)
+        samples = random.sample(rows, 200)
+        it = iter(samples * 1000)
+
+        def timed(name, fn):
+            db.expunge_all()
+            print('{:<45} {:.3f} ms'.format(name, time_ms(lambda: (db.expunge_all(), fn(*next(it))))))
+
+        timed('question set, joining users (old)', lambda q, s, t, u: old_question_set_is_contributor(u, s, db))
+        timed('question set, topics.user_id', lambda q, s, t, u: QuestionSet.user_is_contributor(u, s, db))
+        timed('question, joining users (old)', lambda q, s, t, u: old_question_is_contributor(u, s, q, db))
+        timed('question, topics.user_id', lambda q, s, t, u: Question.user_is_contributor(u, s, q, db))
+        timed('question, topics.user_id and known type', lambda q, s, t, u: Question.user_is_contributor(u, s, q, db, t.name))
+        db.close()
+    finally:
+        drop(engine)
+
+if __name__ == '__main__':
+    main()
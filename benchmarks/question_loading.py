@@ -0,0 +1,81 @@
+#Times reading whole question sets with each QuestionLoading strategy, on sets that mix
+#every question type and on sets of a single type.  "all fields" also reads each
+#question's answer key, which base loading has to fetch per question and payload loading
+#already has from questions.payload.  Payload loading needs payload storage, which makes
+#every write to a type table update its questions rows too, so the cost of inserting
+#questions with insert_many is timed with payload storage off and on as well: payload
+#storage trades slower writes for reads of one table.
+#usage: python benchmarks/question_loading.py [database url] [questions per set] [questions per insert]
+import random
+import sys
+
+from dataset import DEFAULT_URL, connect, drop, populate, time_ms
+from qa import payloads
+from qa.db import count_queries
+from qa.models import MultipleChoiceQuestion, QuestionLoading, QuestionSet, QuestionType, TrueFalseQuestion
+
+DATASETS = [
+    ('mixed', (QuestionType.mcq, QuestionType.tf, QuestionType.math)),
+    ('mcq only', (QuestionType.mcq,)),
+]
+
+def read(question_set, loading, db, all_fields=False):
+    questions = question_set.get_questions(db, loading)
+    if all_fields:
+        for question in questions:
+            question.answer_key()
+    return questions
+
+#Inserts the rows at the end of the set and rolls them back again.
+def write(Q_class, question_set_id, rows, db):
+    Q_class.insert_many(question_set_id, 10 ** 6, rows, db)
+    db.rollback()
+
+def main(argv=sys.argv):
+    url = argv[1] if len(argv) > 1 else DEFAULT_URL
+    questions = int(argv[2]) if len(argv) > 2 else 100
+    inserted = int(argv[3]) if len(argv) > 3 else 2000
+    writes = [
+        (MultipleChoiceQuestion, [
+            {'description': 'Inserted {}'.format(i), 'choice_one': 'a', 'choice_two': 'b', 'choice_three': 'c', 'choice_four': 'd', 'correct_answer': i % 4}
+            for i in range(inserted)
+        ]),
+        (TrueFalseQuestion, [{'description': 'Inserted {}'.format(i), 'correct_answer': i % 2 == 0} for i in range(inserted)]),
+    ]
+    for name, question_types in DATASETS:
+        engine, Session = connect(url)
+        try:
+            populate(engine, users=10, topics=5, sets=5, questions=questions, question_types=question_types)
+            db = Session()
+            question_set_id = db.query(QuestionSet.id).order_by(QuestionSet.id).first()[0]
+            db.rollback()
+            print('{}, {} questions per insert_many'.format(name, inserted))
+            for label, enabled in [('payload storage off', False), ('payload storage on', True)]:
+                if enabled:
+                    payloads.enable(engine)
+                for Q_class, rows in writes:
+                    ms = time_ms(lambda: write(Q_class, question_set_id, rows, db), number=10)
+                    print('    {:<48} {:>8.2f} ms'.format('{}, {}'.format(Q_class.__tablename__, label), ms))
+            question_sets = db.query(QuestionSet).all()
+            random.seed(0)
+            samples = iter(random.choices(question_sets, k=10000))
+            print('{}, {} questions per set'.format(name, questions))
+            for label, loading, all_fields in [
+                ('join', QuestionLoading.join, False),
+                ('selectin', QuestionLoading.selectin, False),
+                ('base', QuestionLoading.base, False),
+                ('base, all fields', QuestionLoading.base, True),
+                ('payload', QuestionLoading.payload, False),
+                ('payload, all fields', QuestionLoading.payload, True),
+            ]:
+                with count_queries(db) as counter:
+                    db.expunge_all()
+                    read(question_sets[0], loading, db, all_fields)
+                ms = time_ms(lambda: (db.expunge_all(), read(next(samples), loading, db, all_fields)), number=20 if all_fields else 100)
+                print('    {:<20} {:>8.2f} ms {:>5} queries'.format(label, ms, counter.count))
+            db.close()
+        finally:
+            drop(engine)
+
+if __name__ == '__main__':
+    main()
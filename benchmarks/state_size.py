@@ -0,0 +1,52 @@
+#Compares the pickled size of the answer flow state for a large question set before and
+#after QuestionSetState stopped holding ORM instances.  Needs no database.
+#usage: python benchmarks/state_size.py [number of questions]
+import pickle
+import sys
+
+from qa.models import MultipleChoiceQuestion, QuestionType
+from qa.views import QuestionSetState
+
+def make_questions(count):
+    return [
+        MultipleChoiceQuestion(
+            id=i,
+            type=QuestionType.mcq,
+            question_order=i,
+            question_set_id=1,
+            description='<p>Question number {} of the benchmark set?</p>'.format(i),
+            choice_one='One',
+            choice_two='Two',
+            choice_three='Three',
+            choice_four='Four',
+            correct_answer=i % 4,
+        ) for i in range(count)
+    ]
+
+#The layout QuestionSetState used to pickle: the question instances and answer dicts.
+def old_state_size(questions):
+    state = {
+        'set_name': 'Benchmark',
+        'question_set_id': 1,
+        'question_list': questions,
+        'answers': [{'answer': i % 4} for i in range(len(questions))],
+        'current_question': len(questions),
+    }
+    return len(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+def new_state_size(questions):
+    state = QuestionSetState(questions, 1, 'Benchmark')
+    for i in range(len(questions)):
+        state.record_answer({'answer': i % 4})
+        state.get_next_question()
+    return len(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+def main(argv=sys.argv):
+    count = int(argv[1]) if len(argv) > 1 else 500
+    questions = make_questions(count)
+    print('questions: {}'.format(count))
+    print('ORM state: {:.1f} KB'.format(old_state_size(questions) / 1024))
+    print('compact state: {:.1f} KB'.format(new_state_size(questions) / 1024))
+
+if __name__ == '__main__':
+    main()
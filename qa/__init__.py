@@ -1,40 +1,74 @@
 import deform
 from pyramid.config import Configurator
-from pyramid.session import UnencryptedCookieSessionFactoryConfig
-from sqlalchemy import engine_from_config
+from pyramid.tweens import EXCVIEW
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
-from .models import Base
+from . import passwords, payloads, schema
+from .attempts import attempt_writer_from_settings
+from .cache import snapshot_cache
+from .db import engine_from_settings
+from .models import QuestionLoading
+from .security import authorization_cache
+from .sessions import session_factory_from_settings
 
 def main(global_config, **settings):
-    session_factory = UnencryptedCookieSessionFactoryConfig('secret')
+    sqlalchemy_engine = engine_from_settings(settings)
+    #Tables are created by qa_migrate, not on every worker boot.
+    schema.check(sqlalchemy_engine)
+
+    session_factory, session_store = session_factory_from_settings(settings, sqlalchemy_engine)
     config = Configurator(settings=settings,session_factory = session_factory)
     config.include('pyramid_chameleon')
     deform.renderer.configure_zpt_renderer()
     config.add_static_view('static_deform', 'deform:static')
 
-    sqlalchemy_engine = engine_from_config(settings, prefix='sqlalchemy.', poolclass=NullPool)
-    # Base.metadata.drop_all(sqlalchemy_engine)
-    Base.metadata.create_all(sqlalchemy_engine)
+    #Kept on the registry so the pool counters (qa.db.pool_status) and session
+    #store stats can be read.
+    config.registry.db_engine = sqlalchemy_engine
+    config.registry.session_store = session_store
+    snapshot_cache.max_bytes = int(settings.get('qa.snapshot_cache.max_bytes', snapshot_cache.max_bytes))
+    snapshot_cache.loading = QuestionLoading[settings.get('qa.question_loading', snapshot_cache.loading.name)]
+    #Snapshots are detached from the session, so they need every field loaded up front.
+    if snapshot_cache.loading == QuestionLoading.base:
+        raise ValueError('qa.question_loading must be join, selectin or payload.')
+    if snapshot_cache.loading == QuestionLoading.payload and not payloads.is_enabled(sqlalchemy_engine):
+        raise ValueError('qa.question_loading = payload needs payload storage, run qa_payloads with the ini file and enable.')
+    authorization_cache.ttl = float(settings.get('qa.auth_cache.ttl', authorization_cache.ttl))
+    authorization_cache.max_entries = int(settings.get('qa.auth_cache.max_entries', authorization_cache.max_entries))
+    passwords.configure_from_settings(settings)
     Session = sessionmaker(bind=sqlalchemy_engine)
+    #For work that outlives the request's session, like streaming exports.
+    config.registry.db_sessionmaker = Session
+    #Saves finished attempts in the background, see qa.attempts.
+    config.registry.attempt_writer = attempt_writer_from_settings(settings, sqlalchemy_engine)
 
     def add_db(request):
         return Session()
 
     config.add_request_method(add_db, 'db', reify=True)
+    config.add_tween('qa.db.db_session_tween_factory', over=EXCVIEW)
     config.add_route('register','/register')
     config.add_route('login','/login')
     config.add_route('logout','/logout')
     config.add_route('profile','/profile')
+    config.add_route('profile_topics', '/profile/topics')
+    config.add_route('search', '/search')
+    config.add_route('topic_question_sets', '/topic/{topic_id}/sets')
     config.add_route('edit_topic', '/topic/{topic_id}/edit')
     config.add_route('delete_topic', '/topic/{topic_id}/delete')
+    config.add_route('export_topic', '/topic/{topic_id}/export')
     config.add_route('view_question_set', '/set/{question_set_id}/view')
+    config.add_route('question_set_questions', '/set/{question_set_id}/questions')
+    config.add_route('move_question', '/set/{question_set_id}/move')
     config.add_route('edit_question_set', '/set/{question_set_id}/edit')
     config.add_route('answer_question_set', '/set/{question_set_id}/answer')
     config.add_route('delete_question_set', '/set/{question_set_id}/delete')
+    config.add_route('export_question_set', '/set/{question_set_id}/export')
+    config.add_route('question_set_stats', '/set/{question_set_id}/stats')
+    config.add_route('clone_question_set', '/set/{question_set_id}/clone')
     config.add_route('report', '/report')
     config.add_route('question_creation_form', '/question_creation_form')
     config.add_route('create_question', '/set/{question_set_id}/create_question')
+    config.add_route('import_questions', '/set/{question_set_id}/import')
     config.add_route('edit_question', '/set/{question_set_id}/question/{question_id}/edit')
     config.add_route('delete_question', '/set/{question_set_id}/question/{question_id}/delete')
     config.scan('.views')
@@ -0,0 +1,205 @@
+import atexit
+import datetime
+import logging
+import queue
+import threading
+
+from sqlalchemy import func, select
+
+from .stats import add_attempts
+from .models import Attempt, AttemptAnswer, Question
+
+log = logging.getLogger(__name__)
+
+#Finished attempts are saved behind the request instead of in it.  The report view hands
+#an AttemptRecord to the AttemptWriter, which queues it in process, and a background thread
+#writes whatever has queued up in batches, a multi-row INSERT per table per batch.  The
+#queue is bounded: when the database falls behind, submitting waits up to put_timeout for
+#room and then writes the attempt in the caller's thread, so requests slow down instead of
+#memory growing or attempts being dropped.  Queued attempts are written at exit.  Each
+#batch also adds its answers to the per question counters, see qa.stats.
+
+#Attempt answer rows per INSERT statement.
+ANSWER_ROWS_PER_INSERT = 1000
+
+class AttemptRecord:
+    __slots__ = ('user_id', 'question_set_id', 'question_set_version', 'finished', 'answers')
+
+    #answers are (question id, answer value, units or None, correct) in question order.
+    def __init__(self, user_id, question_set_id, question_set_version, answers, finished=None):
+        self.user_id = user_id
+        self.question_set_id = question_set_id
+        self.question_set_version = question_set_version
+        self.answers = answers
+        self.finished = finished or datetime.datetime.now(datetime.timezone.utc)
+
+    def score(self):
+        return sum(1 for _, _, _, correct in self.answers if correct)
+
+class AttemptWriter:
+    def __init__(self, engine, max_queued=10000, batch_size=500, put_timeout=0.1):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(max_queued)
+        self._lock = threading.Lock()
+        #Signalled when the last submit in progress has queued its attempt.
+        self._submitted = threading.Condition(self._lock)
+        self._submitting = 0
+        self._thread = None
+        self._closed = False
+        self.written = 0
+        self.batches = 0
+        #Attempts written in the submitting thread because the queue was full.
+        self.overflows = 0
+        #Attempts that couldn't be written, for example because their set was deleted.
+        self.failures = 0
+
+    #The thread is started by the first submit, not when the writer is made, so that a
+    #worker process forked after the application is loaded starts its own.
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                if self._thread is None:
+                    atexit.register(self.close)
+                self._thread = threading.Thread(target=self._run, name='qa-attempt-writer', daemon=True)
+                self._thread.start()
+
+    #Submits in progress are counted so that close waits for their attempts to be queued
+    #before stopping the thread, rather than leaving them behind in the queue.
+    def submit(self, record):
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._submitting += 1
+        if closed:
+            self.write([record])
+            return
+        try:
+            self._start()
+            self._queue.put(record, timeout=self.put_timeout)
+        except queue.Full as _:
+            with self._lock:
+                self.overflows += 1
+            self.write([record])
+        finally:
+            with self._lock:
+                self._submitting -= 1
+                if not self._submitting:
+                    self._submitted.notify_all()
+
+    #Waits until every attempt submitted so far has been written.
+    def flush(self):
+        if self._thread is not None:
+            self._queue.join()
+
+    #Writes the queued attempts and stops the thread.  Attempts submitted afterwards are
+    #written as they're submitted.
+    def close(self):
+        with self._lock:
+            self._closed = True
+            while self._submitting:
+                self._submitted.wait()
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty as _:
+                    break
+            stop = None in batch
+            records = [record for record in batch if record is not None]
+            try:
+                if records:
+                    self.write(records)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    #Writes the records in one transaction, or one at a time if that fails so that only
+    #the records the database rejects are lost.
+    def write(self, records):
+        try:
+            self._insert(records)
+        except Exception as _:
+            if len(records) == 1:
+                log.exception('Could not save attempt.')
+                with self._lock:
+                    self.failures += 1
+                return
+            for record in records:
+                self.write([record])
+            return
+        with self._lock:
+            self.written += len(records)
+            self.batches += 1
+
+    def _insert(self, records):
+        attempts = Attempt.__table__
+        answers = AttemptAnswer.__table__
+        questions = Question.__table__
+        with self.engine.begin() as connection:
+            #Ids are drawn up front so the answers can reference them without depending on
+            #the order RETURNING gives them back in.
+            ids = [attempt_id for attempt_id, in connection.execute(
+                select([func.nextval(func.pg_get_serial_sequence(attempts.name, attempts.c.id.name))]).\
+                    select_from(func.generate_series(1, len(records)))
+            )]
+            connection.execute(attempts.insert().values([
+                {
+                    attempts.c.id.name: attempt_id,
+                    attempts.c.user_id.name: record.user_id,
+                    attempts.c.question_set_id.name: record.question_set_id,
+                    attempts.c.question_set_version.name: record.question_set_version,
+                    attempts.c.score.name: record.score(),
+                    attempts.c.question_count.name: len(record.answers),
+                    attempts.c.finished.name: record.finished,
+                }
+                for attempt_id, record in zip(ids, records)
+            ]))
+            #A question deleted while its attempt was queued is stored as NULL, as though it
+            #had been deleted after the attempt was saved, rather than failing the attempt.
+            rows = [
+                {
+                    answers.c.attempt_id.name: attempt_id,
+                    answers.c.question_index.name: i,
+                    answers.c.question_id.name: select([questions.c.id]).where(questions.c.id == question_id).as_scalar(),
+                    answers.c.answer.name: answer,
+                    answers.c.units.name: units,
+                    answers.c.correct.name: correct,
+                }
+                for attempt_id, record in zip(ids, records)
+                for i, (question_id, answer, units, correct) in enumerate(record.answers)
+            ]
+            for start in range(0, len(rows), ANSWER_ROWS_PER_INSERT):
+                connection.execute(answers.insert().values(rows[start:start + ANSWER_ROWS_PER_INSERT]))
+            add_attempts(connection, ids)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'max_queued': self._queue.maxsize,
+                'written': self.written,
+                'batches': self.batches,
+                'overflows': self.overflows,
+                'failures': self.failures,
+            }
+
+#Builds the writer from the settings qa.attempts.max_queued, qa.attempts.batch_size and
+#qa.attempts.put_timeout.
+def attempt_writer_from_settings(settings, engine):
+    return AttemptWriter(
+        engine,
+        max_queued=int(settings.get('qa.attempts.max_queued', 10000)),
+        batch_size=int(settings.get('qa.attempts.batch_size', 500)),
+        put_timeout=float(settings.get('qa.attempts.put_timeout', 0.1)),
+    )
@@ -0,0 +1,164 @@
+import csv
+import io
+import json
+import os
+
+import colander
+from sqlalchemy.exc import DBAPIError
+
+from . import forms
+from .models import Question, QuestionSet, QuestionType
+
+#Loading questions in bulk from JSON Lines or CSV files, one question per line (or row).
+#Each question is validated with the same schema as the creation forms and questions
+#that fail are reported by line number instead of failing the import.  The file is read
+#as a stream and valid questions are inserted CHUNK_SIZE at a time with
+#Question.insert_many, so an import of thousands of questions takes a few statements
+#per chunk instead of a few per question.
+
+CHUNK_SIZE = 500
+
+DUPLICATE_DESCRIPTION_ERROR = 'Questions must be unique per set.'
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        #(line number, message) for each line that wasn't imported, in line order.
+        self.errors = []
+
+    def as_dict(self):
+        return {
+            'imported': self.imported,
+            'errors': [{'line': line_number, 'error': message} for line_number, message in sorted(self.errors)],
+        }
+
+#Readers take a text stream and yield (line number, values) where values is a dictionary
+#of field names (the question's column names) to values, or a ValueError if the line
+#couldn't be parsed.  Empty values become colander.null so optional fields can be left out.
+def clean_values(values):
+    return {key: colander.null if value is None or value == '' else value for key, value in values.items()}
+
+def read_jsonl(stream):
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            values = json.loads(line)
+        except ValueError as _:
+            yield line_number, ValueError('Line is not valid JSON.')
+            continue
+        if not isinstance(values, dict):
+            yield line_number, ValueError('Line is not a JSON object.')
+            continue
+        yield line_number, clean_values(values)
+
+#The first row holds the field names.
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    for values in reader:
+        yield reader.line_num, clean_values(values)
+
+READERS = {
+    'jsonl': read_jsonl,
+    'csv': read_csv,
+}
+
+#Returns the reader for an uploaded binary file.  The format is jsonl or csv, by default
+#taken from the file name's extension.
+def read_upload(binary_file, filename, file_format=None):
+    file_format = file_format or os.path.splitext(filename or '')[1].lstrip('.').lower()
+    try:
+        reader = READERS[file_format]
+    except KeyError as _:
+        raise ValueError('Unknown import format {}.'.format(file_format))
+    return reader(io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline=''))
+
+def error_message(e):
+    if isinstance(e, colander.Invalid):
+        return '; '.join(
+            '{}: {}'.format(name, message) if name else message
+            for name, message in sorted(e.asdict().items())
+        )
+    return str(e)
+
+def db_error_message(e, Q_class):
+    try:
+        Question.handle_db_exception(e, Q_class)
+    except ValueError as error:
+        return str(error)
+    except Exception as _:
+        pass
+    return 'Unknown Error.'
+
+#Imports the rows a reader yields as questions of question_type (a QuestionType name) at the
+#end of the set.  Commits and returns an ImportResult.
+def import_questions(question_set_id, question_type, rows, db, chunk_size=CHUNK_SIZE):
+    Q_class = QuestionType.get_question_class(question_type)
+    schema = forms.get_question_item_schema(question_type)
+    result = ImportResult()
+
+    descriptions = set()
+    chunk = []
+    for line_number, values in rows:
+        try:
+            if isinstance(values, ValueError):
+                raise values
+            appstruct = schema.deserialize(values)
+        except (colander.Invalid, ValueError) as e:
+            result.errors.append((line_number, error_message(e)))
+            continue
+        #Normalized as description_digest is, so descriptions the set would reject are caught here.
+        #btrim only removes spaces.
+        description = appstruct[Question.description.name].strip(' ').lower()
+        if description in descriptions:
+            result.errors.append((line_number, DUPLICATE_DESCRIPTION_ERROR))
+            continue
+        descriptions.add(description)
+        chunk.append((line_number, appstruct))
+        if len(chunk) == chunk_size:
+            insert_chunk(Q_class, question_set_id, chunk, result, db)
+            chunk = []
+    if chunk:
+        insert_chunk(Q_class, question_set_id, chunk, result, db)
+
+    if result.imported:
+        QuestionSet.bump_version(question_set_id, db)
+    db.commit()
+    return result
+
+#Inserts a chunk of validated questions at the end of the set, skipping those whose
+#description the set already has.  Order numbers are reserved per chunk, see
+#QuestionSet.allocate_question_orders.
+def insert_chunk(Q_class, question_set_id, chunk, result, db):
+    existing = Question.existing_descriptions(
+        question_set_id, [appstruct[Question.description.name] for _, appstruct in chunk], db
+    )
+    rows = []
+    for line_number, appstruct in chunk:
+        if appstruct[Question.description.name] in existing:
+            result.errors.append((line_number, DUPLICATE_DESCRIPTION_ERROR))
+        else:
+            rows.append((line_number, appstruct))
+    if not rows:
+        return
+
+    try:
+        with db.begin_nested():
+            first_order = QuestionSet.allocate_question_orders(question_set_id, len(rows), db)
+            Q_class.insert_many(question_set_id, first_order, [appstruct for _, appstruct in rows], db)
+        result.imported += len(rows)
+        return
+    except DBAPIError as _:
+        pass
+
+    #A constraint the validation doesn't check failed, for example a question with the same
+    #description was added since the check above, or a value didn't fit its column.  Insert
+    #the chunk's questions one at a time to find out which.
+    for line_number, appstruct in rows:
+        try:
+            with db.begin_nested():
+                first_order = QuestionSet.allocate_question_orders(question_set_id, 1, db)
+                Q_class.insert_many(question_set_id, first_order, [appstruct], db)
+            result.imported += 1
+        except DBAPIError as e:
+            result.errors.append((line_number, db_error_message(e, Q_class)))
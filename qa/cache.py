@@ -0,0 +1,108 @@
+import collections
+import pickle
+import threading
+
+from .models import QuestionLoading
+
+#Immutable, in process copies of question sets, shared by every request answering or
+#reporting on a set so those don't have to run the polymorphic question query each time.
+#Snapshots are keyed by set id and QuestionSet.version, which is bumped whenever a set's
+#questions are created, edited, reordered or deleted, so a changed set is never served
+#from an old snapshot even if the change was made by another process.
+
+#The questions are detached from their session and must only be read.
+class QuestionSetSnapshot:
+    __slots__ = ('question_set_id', 'version', 'questions', 'questions_by_id', 'answer_key', 'size')
+
+    def __init__(self, question_set_id, version, questions):
+        self.question_set_id = question_set_id
+        self.version = version
+        self.questions = tuple(questions)
+        self.questions_by_id = {question.id: question for question in self.questions}
+        #Precompiled per question, in order.  See Question.answer_key.
+        self.answer_key = tuple(question.answer_key() for question in self.questions)
+        #Approximate memory used, for the cache's size limit.
+        self.size = len(pickle.dumps(self.questions, pickle.HIGHEST_PROTOCOL))
+
+    def is_correct(self, index, answer):
+        return self.questions[index].is_correct(self.answer_key[index], answer)
+
+#A least recently used cache of snapshots bounded by their total size.  Only the newest
+#version seen of each set is kept.
+class SnapshotCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, loading=QuestionLoading.join):
+        self.max_bytes = max_bytes
+        #How the questions of a set missing from the cache are read, see QuestionLoading.
+        self.loading = loading
+        self._snapshots = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remove(self, question_set_id):
+        snapshot = self._snapshots.pop(question_set_id)
+        self.bytes -= snapshot.size
+
+    def get(self, question_set_id, version):
+        with self._lock:
+            snapshot = self._snapshots.get(question_set_id)
+            if snapshot is None or snapshot.version != version:
+                if snapshot is not None and snapshot.version < version:
+                    self._remove(question_set_id)
+                self.misses += 1
+                return None
+            self._snapshots.move_to_end(question_set_id)
+            self.hits += 1
+            return snapshot
+
+    def put(self, snapshot):
+        with self._lock:
+            current = self._snapshots.get(snapshot.question_set_id)
+            if current is not None:
+                if current.version > snapshot.version:
+                    return
+                self._remove(snapshot.question_set_id)
+            if snapshot.size > self.max_bytes:
+                return
+            self._snapshots[snapshot.question_set_id] = snapshot
+            self.bytes += snapshot.size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._snapshots)))
+                self.evictions += 1
+
+    def invalidate(self, question_set_id):
+        with self._lock:
+            if question_set_id in self._snapshots:
+                self._remove(question_set_id)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._snapshots),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+snapshot_cache = SnapshotCache()
+
+#Returns the snapshot of a question set (a QuestionSet instance, which carries the version),
+#building and caching it if it isn't cached.
+def get_snapshot(question_set, db, cache=snapshot_cache):
+    snapshot = cache.get(question_set.id, question_set.version)
+    if snapshot is None:
+        questions = question_set.get_questions(db, cache.loading)
+        for question in questions:
+            db.expunge(question)
+        snapshot = QuestionSetSnapshot(question_set.id, question_set.version, questions)
+        cache.put(snapshot)
+    return snapshot
@@ -0,0 +1,162 @@
+import contextlib
+import threading
+import time
+
+from pyramid.settings import asbool
+from sqlalchemy import engine_from_config, event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+#Setting which switches the engine from opening a connection per checkout (NullPool)
+#to keeping a pool of connections.  The pool itself is sized by the usual sqlalchemy.*
+#settings: pool_size, max_overflow, pool_timeout, pool_recycle and pool_pre_ping.
+POOLED_SETTING = 'qa.db_pooled'
+
+#Counters used to size the pool.  Shared by every pool the engine recreates so
+#the numbers survive an engine.dispose().
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_time = 0.0
+        self.max_checkout_time = 0.0
+        #Checkouts that found every connection (including overflow) in use and had to wait.
+        self.exhausted = 0
+        #Checkouts that waited the whole pool_timeout and failed.
+        self.timeouts = 0
+
+    def record_checkout(self, elapsed, exhausted):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_time += elapsed
+            self.max_checkout_time = max(self.max_checkout_time, elapsed)
+            if exhausted:
+                self.exhausted += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.exhausted += 1
+            self.timeouts += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'checkout_time': self.checkout_time,
+                'mean_checkout_time': self.checkout_time / self.checkouts if self.checkouts else 0.0,
+                'max_checkout_time': self.max_checkout_time,
+                'exhausted': self.exhausted,
+                'timeouts': self.timeouts,
+            }
+
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _is_exhausted(self):
+        return self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+
+    def _timed_checkout(self, checkout):
+        exhausted = self._is_exhausted()
+        start = time.perf_counter()
+        try:
+            connection = checkout()
+        except TimeoutError:
+            self.stats.record_timeout()
+            raise
+        self.stats.record_checkout(time.perf_counter() - start, exhausted)
+        return connection
+
+    #The engine checks out through unique_connection, Connection.connect through connect.
+    def connect(self):
+        return self._timed_checkout(super().connect)
+
+    def unique_connection(self):
+        return self._timed_checkout(super().unique_connection)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def status_dict(self):
+        status = self.stats.as_dict()
+        status.update({
+            'size': self.size(),
+            'checked_in': self.checkedin(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow(),
+        })
+        return status
+
+#Builds the application engine from the ini settings.  Without qa.db_pooled the
+#engine keeps the old behaviour of a fresh connection per checkout.
+def engine_from_settings(settings, prefix='sqlalchemy.'):
+    if not asbool(settings.get(POOLED_SETTING, False)):
+        return engine_from_config(settings, prefix=prefix, poolclass=NullPool)
+
+    #sqlalchemy coerces the other pool arguments itself, but not pool_pre_ping,
+    #which would otherwise treat the string 'false' as true.
+    settings = dict(settings)
+    pre_ping = prefix + 'pool_pre_ping'
+    if pre_ping in settings:
+        settings[pre_ping] = asbool(settings[pre_ping])
+    return engine_from_config(settings, prefix=prefix, poolclass=InstrumentedQueuePool)
+
+#Tween which ends the request's database session before the response goes back to the
+#server.  request.db is reified, so a request that never touches it never opens a
+#session and is skipped here.  Otherwise the transaction is committed, or rolled back
+#if the view raised or returned an error response, and the session is closed which
+#returns its connection to the pool before the response body is sent.  Each request
+#gets its own session so connections in use track concurrent requests, not request volume.
+def db_session_tween_factory(handler, registry):
+    def db_session_tween(request):
+        try:
+            response = handler(request)
+        except Exception:
+            end_db_session(request, commit=False)
+            raise
+        commit = getattr(request, 'exception', None) is None and response.status_int < 400
+        end_db_session(request, commit=commit)
+        return response
+    return db_session_tween
+
+def end_db_session(request, commit):
+    db = request.__dict__.get('db')
+    if db is None:
+        return
+    try:
+        if commit:
+            db.commit()
+        else:
+            db.rollback()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+#Returns the pool counters for an engine, or None if the engine isn't pooled.
+def pool_status(engine):
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        return engine.pool.status_dict()
+    return None
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+#Counts the statements a session sends to the database inside the with block, for catching
+#N+1 query regressions.  Only the session's own connection is watched.
+@contextlib.contextmanager
+def count_queries(db):
+    counter = QueryCounter()
+    connection = db.connection()
+    def before_cursor_execute(*args):
+        counter.count += 1
+    event.listen(connection, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(connection, 'before_cursor_execute', before_cursor_execute)
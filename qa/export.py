@@ -0,0 +1,148 @@
+import argparse
+import csv
+import enum
+import io
+import itertools
+import json
+import sys
+
+from pyramid.paster import get_appsettings, setup_logging
+from sqlalchemy.orm import sessionmaker
+
+from .db import engine_from_settings
+from .models import Question, QuestionSet, Topic
+
+#Exporting a topic or question set with every question's fields, as JSON Lines or CSV.
+#Rows are read through a server side cursor BATCH_SIZE at a time and written out as they
+#arrive, so memory use doesn't grow with the size of the export and the first bytes are
+#sent as soon as the first batch is read.  Exported questions use the same field names as
+#imports (qa.bulk_import), plus the topic, question set, type and order of each question.
+
+BATCH_SIZE = 1000
+
+CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+BASE_FIELDS = ['topic', 'question_set', Question.type.name, Question.question_order.name, Question.description.name]
+
+def own_columns(table):
+    return [column for column in table.c if column.name != table.c.id.name]
+
+#Every field a question of any type can have, in CSV column order.
+def export_fields():
+    fields = list(BASE_FIELDS)
+    for _, table in Question.type_tables():
+        fields.extend(column.name for column in own_columns(table) if column.name not in fields)
+    return fields
+
+def column_label(table, column):
+    return '{}_{}'.format(table.name, column.name)
+
+#The questions of a topic or question set, each row with the columns of every question type
+#(outer joined) of which only the question's own type's are set.  Rows are fetched
+#BATCH_SIZE at a time from a server side cursor.
+def export_query(db, topic_id=None, question_set_id=None):
+    columns = [
+        Topic.title.label('topic'),
+        QuestionSet.description.label('question_set'),
+        Question.type,
+        Question.question_order,
+        Question.description,
+    ]
+    tables = Question.type_tables()
+    for _, table in tables:
+        columns.extend(column.label(column_label(table, column)) for column in own_columns(table))
+    query = db.query(*columns).\
+        select_from(Question).\
+        join(QuestionSet, Question.question_set_id == QuestionSet.id).\
+        join(Topic, QuestionSet.topic_id == Topic.id)
+    for _, table in tables:
+        query = query.outerjoin(table, table.c.id == Question.id)
+    if topic_id is not None:
+        query = query.filter(QuestionSet.topic_id == topic_id)
+    if question_set_id is not None:
+        query = query.filter(Question.question_set_id == question_set_id)
+    return query.order_by(Question.question_set_id, Question.question_order).yield_per(BATCH_SIZE)
+
+#Returns a row of export_query as a dictionary of the question's fields.  Enums are written
+#by name.
+def question_values(row, tables_by_type):
+    values = {
+        'topic': row.topic,
+        'question_set': row.question_set,
+        Question.type.name: row.type.name,
+        Question.question_order.name: row.question_order,
+        Question.description.name: row.description,
+    }
+    table = tables_by_type.get(row.type)
+    if table is not None:
+        for column in own_columns(table):
+            value = getattr(row, column_label(table, column))
+            values[column.name] = value.name if isinstance(value, enum.Enum) else value
+    return values
+
+def write_jsonl(batch):
+    return ''.join(json.dumps(values) + '\n' for values in batch)
+
+class CSVBatchWriter:
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.DictWriter(self.buffer, export_fields())
+
+    def header(self):
+        self.writer.writeheader()
+        return self.flush()
+
+    def __call__(self, batch):
+        self.writer.writerows(batch)
+        return self.flush()
+
+    def flush(self):
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+#Returns a generator of the encoded export, for use as a response's app_iter.  It opens its
+#own session from Session (a sessionmaker) since it runs after the request's session has
+#been closed, and closes it when it's exhausted or closed.  Raises ValueError for an unknown
+#file_format before anything is read.
+def export(Session, file_format, topic_id=None, question_set_id=None):
+    if file_format not in CONTENT_TYPES:
+        raise ValueError('Unknown export format {}.'.format(file_format))
+    return _export(Session, file_format, topic_id, question_set_id)
+
+def _export(Session, file_format, topic_id, question_set_id):
+    if file_format == 'csv':
+        write = CSVBatchWriter()
+        yield write.header().encode('utf-8')
+    else:
+        write = write_jsonl
+    tables_by_type = dict(Question.type_tables())
+    db = Session()
+    try:
+        rows = export_query(db, topic_id, question_set_id)
+        values = (question_values(row, tables_by_type) for row in rows)
+        while True:
+            batch = list(itertools.islice(values, BATCH_SIZE))
+            if not batch:
+                break
+            yield write(batch).encode('utf-8')
+    finally:
+        db.close()
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description='Write a topic or question set to stdout.')
+    parser.add_argument('config_uri')
+    parser.add_argument('resource', choices=('topic', 'set'))
+    parser.add_argument('id', type=int)
+    parser.add_argument('--format', choices=sorted(CONTENT_TYPES), default='jsonl')
+    args = parser.parse_args(argv[1:])
+    setup_logging(args.config_uri)
+    engine = engine_from_settings(get_appsettings(args.config_uri))
+    filters = {'topic_id' if args.resource == 'topic' else 'question_set_id': args.id}
+    for data in export(sessionmaker(bind=engine), args.format, **filters):
+        sys.stdout.buffer.write(data)
+    sys.stdout.buffer.flush()
@@ -20,6 +20,18 @@ def get_question_edit_schema(question_type):
     else:
         raise ValueError('Question Type Could Not Be Determined')
 
+#The schema of a single question of the given type (a QuestionType name), with the same checks
+#the creation forms make on each question.  Used to validate imported questions.
+def get_question_item_schema(question_type):
+    if question_type == models.QuestionType.mcq.name:
+        return MultipleChoiceQuestion(validator=MultipleChoiceQuestion.validation)
+    elif question_type == models.QuestionType.tf.name:
+        return TrueFalseQuestion()
+    elif question_type == models.QuestionType.math.name:
+        return MathQuestion(validator=MathQuestion.validation)
+    else:
+        raise ValueError('Question Type Could Not Be Determined')
+
 def get_question_creation_schema(post):
     try:
         question_type = post[models.Question.type.name]
@@ -128,8 +140,11 @@ class ReorderResourceForm:
     name_template = 'reorderable[{}]'
     csrf_token = 'csrf_token'
 
+    #ids are the resources being reordered and the submitted order must hold exactly those.
+    #Pass None when only a page of a list is shown, any ids are then accepted and have to be
+    #checked by the caller.
     def __init__(self, request, ids, button_name='Submit'):
-        if not ids:
+        if ids is not None and not ids:
             raise ValueError('Empty id list.')
         self.csrf_token = request.session.get_csrf_token()
         self.ids = ids
@@ -137,7 +152,7 @@ class ReorderResourceForm:
 
     def render_fields(self):
         x = self.__class__
-        input_fields = [x.input_template.format(x.id_template.format(index), x.name_template.format(index), resource_id) for index, resource_id in enumerate(self.ids)]
+        input_fields = [x.input_template.format(x.id_template.format(index), x.name_template.format(index), resource_id) for index, resource_id in enumerate(self.ids or [])]
         input_fields.append('<input type="hidden" name="{}" value="{}">'.format(self.__class__.csrf_token, self.csrf_token))
         return ''.join(input_fields)
 
@@ -154,10 +169,19 @@ class ReorderResourceForm:
             pass
         except ValueError as _:
             raise ValueError()
-        if set(submitted_ids) != set(self.ids):
+        if self.ids is None:
+            if not submitted_ids or len(set(submitted_ids)) != len(submitted_ids):
+                raise ValueError()
+        elif set(submitted_ids) != set(self.ids):
             raise ValueError()
         return submitted_ids
 
+#Moving one question before or after another, see QuestionSet.move.
+class MoveQuestionSchema(CSRFSchema):
+    question_id = colander.SchemaNode(colander.Int())
+    target_id = colander.SchemaNode(colander.Int())
+    position = colander.SchemaNode(colander.String(), validator=colander.OneOf(('before', 'after')))
+
 class Topic(colander.Schema):
     __MAX_TOPIC_LENGTH = 50
     title = colander.SchemaNode(
@@ -214,9 +238,42 @@ class QuestionSetsSchema(CSRFSchema):
         widget=deform.widget.SequenceWidget(orderable=True)
     )
 
+#Copying a question set, possibly into another of the user's topics.  Bound with the same
+#topic choices as QuestionSetsSchema.
+class QuestionSetCloneSchema(CSRFSchema):
+    __MAX_DESCRIPTION_LENGTH = 100
+
+    topics = colander.SchemaNode(
+        colander.Int(),
+        name=models.QuestionSet.topic_id.name,
+        widget=QuestionSetsSchema.set_select_choices,
+        validator=QuestionSetsSchema.set_select_validator,
+        title='Copy to topic',
+    )
+    question_set_description = colander.SchemaNode(
+        colander.String(),
+        name=models.QuestionSet.description.name,
+        widget=deform.widget.TextInputWidget(),
+        validator=colander.Length(max=__MAX_DESCRIPTION_LENGTH),
+        title='Description of the copy',
+    )
+
 class MultipleChoiceQuestion(colander.Schema):
     __MAX_ANSWER_lENGTH = 50
 
+    #Checked by the unique_multiple_choices constraint too, but imports have to catch it
+    #before the rows are inserted.
+    @classmethod
+    def validation(cls, form, value):
+        choice_names = [
+            models.MultipleChoiceQuestion.choice_one.name,
+            models.MultipleChoiceQuestion.choice_two.name,
+            models.MultipleChoiceQuestion.choice_three.name,
+            models.MultipleChoiceQuestion.choice_four.name,
+        ]
+        if len(set(value[name] for name in choice_names)) != len(choice_names):
+            raise colander.Invalid(form, 'All answer choices must be unique.')
+
     choices = ((0,'A'),(1,'B'),(2,'C'),(3,'D'))
     description = colander.SchemaNode(
         colander.String(),
@@ -342,6 +399,7 @@ class TrueFalseAnswer(CSRFSchema):
     )
 
 class MathQuestion(colander.Schema):
+    __MAX_UNITS_LENGTH = 10
     @classmethod
     def both_unit_fields_or_neither(cls, form, value):
         u = value['units']
@@ -385,6 +443,7 @@ class MathQuestion(colander.Schema):
         name = models.MathQuestion.units.name,
         widget = deform.widget.TextInputWidget(css_class='units-input'),
         description = '(Optional) Enter the units the answer must be in.',
+        validator = colander.Length(max=__MAX_UNITS_LENGTH),
         missing = None,
     )
     units_given = colander.SchemaNode(
@@ -0,0 +1,105 @@
+import numpy as np
+
+from .models import QuestionType
+
+#Grading many submissions of the same question set at once, for example a class's
+#homework.  The set's questions are compiled once into an AnswerKey of NumPy arrays and
+#a matrix of answers, a row per submission and a column per question, is graded in a
+#single vectorized pass instead of calling each question's is_correct per answer.
+#
+#Every question's key is the range [low, high] of accepted values: the correct choice's
+#index for multiple choice, 0 or 1 for true/false and the bounds from the question's
+#Accuracy for math (see MathQuestion.answer_key).  Unanswered questions are NaN and are
+#never correct.  Units are compared as integer codes rather than strings: 0 where no units
+#were given, 1 + the index of the lower case units in AnswerKey.unit_names otherwise, or
+#UNKNOWN_UNITS for units that none of the set's questions have.
+
+UNKNOWN_UNITS = -1
+
+class AnswerKey:
+    #questions are the set's questions in order, answer_keys their precompiled keys as
+    #in QuestionSetSnapshot.answer_key, computed here if not given.
+    def __init__(self, questions, answer_keys=None):
+        if answer_keys is None:
+            answer_keys = [question.answer_key() for question in questions]
+        count = len(questions)
+        self.question_ids = np.array([question.id for question in questions], dtype=np.int64)
+        self.low = np.empty(count)
+        self.high = np.empty(count)
+        types = np.array([question.type.value for question in questions], dtype=np.uint8)
+        #True/false answers are compared as 0 or 1.
+        self.boolean = types == QuestionType.tf.value
+        math = types == QuestionType.math.value
+        units = [None] * count
+        for i, (question, key) in enumerate(zip(questions, answer_keys)):
+            if math[i]:
+                self.low[i], self.high[i], units[i] = key
+            else:
+                self.low[i] = self.high[i] = float(key)
+        self.unit_names = sorted(set(name for name in units if name))
+        self._unit_codes = {name: i + 1 for i, name in enumerate(self.unit_names)}
+        #The code of each question's units, 0 if it has none.
+        self.units = np.array([self._unit_codes.get(name, 0) for name in units], dtype=np.int16)
+
+    def from_snapshot(snapshot):
+        return AnswerKey(snapshot.questions, snapshot.answer_key)
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    def unit_code(self, units):
+        if units is None:
+            return 0
+        return self._unit_codes.get(units.lower(), UNKNOWN_UNITS)
+
+    #Converts a matrix of units (strings, or None where none were given) to the codes grade takes.
+    def encode_units(self, units):
+        return np.array([[self.unit_code(name) for name in row] for row in units], dtype=np.int16).reshape(np.shape(units))
+
+    #Packs submissions, each a list of answer dictionaries as the questions' answer schemas
+    #produce them (None for an unanswered question), into the values and unit code matrices
+    #grade takes.
+    def answer_matrix(self, submissions):
+        nan = float('nan')
+        values = []
+        units = []
+        for row, answers in enumerate(submissions):
+            if len(answers) != len(self):
+                raise ValueError('Submission {} has {} answers for {} questions.'.format(row, len(answers), len(self)))
+            values.append([nan if answer is None else answer['answer'] for answer in answers])
+            units.append([0 if answer is None else self.unit_code(answer.get('units')) for answer in answers])
+        shape = (len(submissions), len(self))
+        return np.array(values, dtype=float).reshape(shape), np.array(units, dtype=np.int16).reshape(shape)
+
+    #Grades an N x Q matrix of answer values, optionally with a matrix of the codes of the
+    #units given (see answer_matrix and encode_units).  As with MathQuestion.is_correct, units
+    #that are given have to match the question's, ignoring case.  Returns a Grades.
+    def grade(self, values, units=None):
+        values = np.asarray(values, dtype=float)
+        if values.ndim != 2 or values.shape[1] != len(self):
+            raise ValueError('Expected an answer matrix with {} columns.'.format(len(self)))
+        answered = ~np.isnan(values)
+        values = np.where(self.boolean & answered, values != 0, values)
+        correct = answered & (values >= self.low) & (values <= self.high)
+        if units is not None:
+            units = np.asarray(units)
+            if units.shape != values.shape:
+                raise ValueError('The units matrix must be the same shape as the answers.')
+            correct &= (units == 0) | (units == self.units)
+        return Grades(self.question_ids, correct)
+
+class Grades:
+    def __init__(self, question_ids, correct):
+        self.question_ids = question_ids
+        #N x Q booleans, whether each submission answered each question correctly.
+        self.correct = correct
+        #Number of questions each submission got right.
+        self.scores = correct.sum(axis=1)
+        #Number of submissions that got each question right.
+        self.question_scores = correct.sum(axis=0)
+
+    #Fraction of submissions that got each question right.
+    def question_rates(self):
+        if not len(self.correct):
+            return np.zeros(len(self.question_ids))
+        return self.question_scores / len(self.correct)
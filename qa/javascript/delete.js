@@ -1,8 +1,9 @@
 /*
     Delete resources via ajax.
+    Delegated so resources added by loading more of a list can be deleted too.
 */
 $(document).ready(function(){
-    $('.delete-form').submit(function(event) {
+    $(document).on('submit', '.delete-form', function(event) {
         var form = this;
         event.preventDefault();
         var formData = $(this).serialize();
@@ -0,0 +1,26 @@
+/*
+    Load the next page of a paginated list.
+    The link's href returns the page's items followed by the link to the page after it,
+    if there is one.  The items are added to the end of the link's data-target and the
+    link is replaced by the new one.
+*/
+$(document).ready(function(){
+    $(document).on('click', '.load-more', function(event){
+        event.preventDefault();
+        var link = this;
+        $.ajax({
+            type: 'GET',
+            url: $(link).attr('href'),
+        }).done(function(data){
+            var page = $($.parseHTML(data));
+            $($(link).attr('data-target')).append(page.not('.load-more'));
+            $(link).replaceWith(page.filter('.load-more'));
+        }).fail(function(xhr, statusText, errorThrown){
+            if (xhr.status == '401') {
+                window.location = xhr.responseText;
+            } else {
+                alert('Something went wrong.  Refresh the page and try again.');
+            }
+        });
+    });
+});
@@ -21,7 +21,7 @@ function setHideAndShowEvents(){
 }
 
 function collapsibleListHandler(){
-    $('.list-group-item').on('click', function() {
+    $(document).on('click', '.list-group-item', function() {
         $('.glyphicon', this)
           .toggleClass('glyphicon-chevron-right')
           .toggleClass('glyphicon-chevron-down');
@@ -1,53 +1,51 @@
 $(document).ready(function () {
-    $(function () {
-        $('ol.sortable').sortable();
-    });
     /*
     Reorder a set's questions through ajax.
-    The order is set by the user dragging questions to their desired order. The
-    submit function modifies the input values to reflect the new order before
-    submitting the ajax request.
+    Each time the user drops a question, the move is posted as the question's id and the
+    question it was dropped before, or after if it was dropped at the end of the list.
+    Only the moved question is sent, however many questions are loaded on the page.
     */
-    $('#reorder').submit(function (event){
-        event.preventDefault();
-        var resourceIdPrefix = 'reorderable-';
-        var inputReorderableIdNamePrefix = 'reorderable_';
-        var resourceList = $('[id^=' + resourceIdPrefix + ']');
-        var inputList = $('[id^=' + inputReorderableIdNamePrefix + ']');
+    var resourceIdPrefix = 'reorderable-';
 
-        if(resourceList.length == 0){
-            alert('There are no questions to sort.');
-            $(this).find(':submit').hide();
-            return;
-        } else if (resourceList.length < inputList.length){
-            //Get rid of extra input tags, if questions are deleted.
-            for(var i = inputList.length - 1; i > resourceList.length - 1; i--)
-                $(inputList[i]).remove();
-            inputList.splice(resourceList.length, inputList.length - resourceList.length);
-        }
-        //Assign new values to input tags based on question order
-        for(var i = 0; i < inputList.length; i++){
-            var resourceId = $(resourceList[i]).attr('id').replace(resourceIdPrefix, '');
-            $(inputList[i]).attr('value', resourceId);
-        }
-        var formData = $(this).serialize();
-        $.ajax({
-            type: 'POST',
-            url: $(this).attr('action'),
-            data: formData + '&ajax=true',
-        }).done(function(){
-            $('.qr-success').show();
-            $('.qr-success').fadeOut(10000);
-            $('.qr-failure').hide();
-        }).fail(function(xhr, statusText, errorThrown){
-            if (xhr.status == '401'){
-                window.location = xhr.responseText;
-            } else {
-                $('.qr-success').hide();
-                $('.qr-failure').show();
-                $('.qr-failure').fadeOut(10000);
+    function resourceId(item){
+        return $(item).attr('id').replace(resourceIdPrefix, '');
+    }
+
+    function showStatus(success){
+        $('.qr-success').toggle(success);
+        $('.qr-failure').toggle(!success);
+        $(success ? '.qr-success' : '.qr-failure').fadeOut(10000);
+    }
+
+    $('ol.sortable').sortable({
+        onDrop: function ($item, container, _super, event){
+            _super($item, container);
+            var form = $('#move-question');
+            var next = $item.next('[id^=' + resourceIdPrefix + ']');
+            var previous = $item.prev('[id^=' + resourceIdPrefix + ']');
+            var target = next.length ? next : previous;
+            if(target.length == 0){
+                return;
             }
-        });
+            var formData = form.serialize() + '&' + $.param({
+                question_id: resourceId($item),
+                target_id: resourceId(target),
+                position: next.length ? 'before' : 'after',
+                ajax: true,
+            });
+            $.ajax({
+                type: 'POST',
+                url: form.attr('action'),
+                data: formData,
+            }).done(function(){
+                showStatus(true);
+            }).fail(function(xhr, statusText, errorThrown){
+                if (xhr.status == '401'){
+                    window.location = xhr.responseText;
+                } else {
+                    showStatus(false);
+                }
+            });
+        }
     });
-
 });
@@ -1,18 +1,23 @@
 import enum
 
-from passlib.hash import pbkdf2_sha256
 from psycopg2 import errorcodes
 from sqlalchemy import (
-    Column, Integer, String, Boolean, Enum, Float, ForeignKey,
+    Column, Integer, String, Boolean, Enum, Float, ForeignKey, DateTime, LargeBinary,
     event,
-    CheckConstraint, UniqueConstraint,
-    func,
+    CheckConstraint, Index, UniqueConstraint,
+    column, func, literal, select, table, text, tuple_,
+    DDL, and_, cast, exists,
 )
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TSVECTOR
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, with_polymorphic
+from sqlalchemy.orm import deferred, object_session, relationship, selectin_polymorphic, undefer, with_polymorphic
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 
+from .db import count_queries
+from .passwords import password_hasher
+
 #There are imports at the method level of classes that have corresponding forms.
 #This is to resolve an issue with cyclic imports between the forms and models modules.
 #The reason for cyclic imports is so that the form fields can use database column names
@@ -20,6 +25,27 @@ from sqlalchemy.orm.exc import NoResultFound
 #TODO Solve cyclic import issue.
 Base = declarative_base()
 
+#Descriptions are rich text of any length, so they're kept unique through an index on the
+#md5 of the trimmed, lower case text rather than on the text itself: the index entries stay
+#the same size however long the descriptions are and never exceed the btree row limit.
+def description_digest(description):
+    return func.md5(func.lower(func.btrim(description)))
+
+#How the columns of each question type's own table are read when questions of any type
+#are queried, chosen per call.  join reads every type's table in one query with a LEFT
+#OUTER JOIN of all of them, which grows wider with each question type.  selectin reads the
+#questions and then one query per type present, only joining that type's table.  base reads
+#only the questions table; the type's columns are then loaded per question when first used,
+#so it suits reads that only need the description, order and type.  payload reads only
+#the questions table too, but fills in the type's columns from its copy in
+#questions.payload (see qa.payloads), reading the type tables only for questions that
+#don't have one, such as every question while payload storage is off.
+class QuestionLoading(enum.Enum):
+    join = 1
+    selectin = 2
+    base = 3
+    payload = 4
+
 class User(Base):
     #sql variables
     __tablename__ = 'users'
@@ -30,9 +56,10 @@ class User(Base):
 
     topics =  relationship('Topic', back_populates='user', passive_deletes='all')
 
-    def create(values, db):
+    #Passwords are hashed by the hasher's process pool, see qa.passwords.
+    def create(values, db, hasher=password_hasher):
         try:
-            password_hash = pbkdf2_sha256.hash(values[User.password.name])
+            password_hash = hasher.hash(values[User.password.name])
             user = User(username=values[User.username.name], password=password_hash)
             db.add(user)
             db.commit()
@@ -42,17 +69,32 @@ class User(Base):
             if e.orig.pgcode == errorcodes.UNIQUE_VIOLATION:
                 raise ValueError('Username is taken.')
 
-    def login(values, db):
+    #A password hash made with other parameters than the hasher's is replaced with a new one.
+    #Raises ValueError if the hasher is too busy.
+    def login(values, db, hasher=password_hasher):
         user =  db.query(User).filter(User.username==values[User.username.name]).first()
-        if user and pbkdf2_sha256.verify(values[User.password.name], user.password):
-            return user
-        else:
+        if not user:
             return None
+        matches, new_hash = hasher.verify(values[User.password.name], user.password)
+        if not matches:
+            return None
+        if new_hash:
+            user.password = new_hash
+            db.commit()
+        return user
 
     #Gets the User object associated with the user_id.  Assumes user exists.
     def get_user(user_id, db):
         return db.query(User).filter(User.id==user_id).first()
 
+#Session data for qa.sessions.PostgresSessionStore, keyed by the id in the session cookie.
+class SessionRecord(Base):
+    __tablename__ = 'sessions'
+
+    id = Column(String(64), primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    expires = Column(DateTime(timezone=True), nullable=False, index=True)
+
 class Topic(Base):
     __tablename__='topics'
 
@@ -61,21 +103,45 @@ class Topic(Base):
     user_id = Column(Integer, ForeignKey('users.id', ondelete='cascade'), nullable=False)
 
     user = relationship('User', back_populates='topics')
-    question_sets = relationship('QuestionSet', back_populates='topic', passive_deletes='all')
+    question_sets = relationship('QuestionSet', back_populates='topic', passive_deletes='all', order_by='QuestionSet.id')
 
     __table_args__ = (
         UniqueConstraint('title','user_id', name='unique_topic_per_user'),
+        #For paging through a user's topics in (title, id) order.
+        Index('ix_topics_user_id_title_id', 'user_id', 'title', 'id'),
     )
 
     def user_is_owner(user_id, topic_id, db):
         try:
             topic = db.query(Topic).\
-                join(User).\
                 filter(Topic.id == topic_id, Topic.user_id == user_id).one()
             return topic
         except NoResultFound as _:
             return False
 
+    #Returns up to limit of the user's topics ordered by (title, id), starting after the
+    #(title, id) key after or from the first topic if it's None.
+    def get_topics_after(user_id, after, limit, db):
+        topics = db.query(Topic).filter(Topic.user_id == user_id)
+        if after is not None:
+            topics = topics.filter(tuple_(Topic.title, Topic.id) > tuple_(*after))
+        return topics.order_by(Topic.title, Topic.id).limit(limit).all()
+
+    #Returns a page of the user's topics (see get_topics_after), the first sets_limit question
+    #sets of each of those topics as a dictionary of topic id to list of sets, and the number
+    #of queries that took.
+    def get_profile_page(user_id, after, limit, sets_limit, db):
+        with count_queries(db) as counter:
+            topics = Topic.get_topics_after(user_id, after, limit, db)
+            question_sets = QuestionSet.get_first_sets([topic.id for topic in topics], sets_limit, db)
+        return topics, question_sets, counter.count
+
+    #Returns (id, title) of all of the user's topics, for select boxes.
+    def get_choices(user_id, db):
+        return db.query(Topic.id, Topic.title).\
+            filter(Topic.user_id == user_id).\
+            order_by(Topic.title, Topic.id).all()
+
     def create(user_id, values, db):
         try:
             new_topics = [Topic(user_id=user_id, title=value[Topic.title.name]) for value in values[Topic.__table__.name]]
@@ -113,24 +179,56 @@ class QuestionSet(Base):
     id = Column(Integer, primary_key=True)
     description = Column(String, nullable=False)
     topic_id = Column(Integer, ForeignKey('topics.id', ondelete='cascade'), nullable=False)
+    #Bumped whenever the set's questions change.  Cached snapshots of the set (qa.cache) are keyed by it.
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+    #The order number of the next question added at the end of the set.  See allocate_question_orders.
+    next_question_order = Column(Integer, nullable=False, default=0, server_default='0')
 
     topic = relationship('Topic', back_populates='question_sets')
     questions = relationship('Question', back_populates='question_set', passive_deletes='all', order_by='Question.question_order')
 
     __table_args__ = (
-        UniqueConstraint('topic_id', 'description', name='unique_description_per_topic'),
+        Index('unique_description_per_topic', topic_id, description_digest(description), unique=True),
     )
 
+    #Ownership is checked against topics.user_id, no need to join users.
     def user_is_contributor(user_id, question_set_id, db):
         try:
             question_set = db.query(QuestionSet).\
                 join(Topic).\
-                join(User).\
-                filter(QuestionSet.id == question_set_id, User.id == user_id).one()
+                filter(QuestionSet.id == question_set_id, Topic.user_id == user_id).one()
             return question_set
         except NoResultFound as _:
             return False
 
+    #Returns up to limit of the topic's question sets ordered by (description, id), starting
+    #after the (description, id) key after or from the first set if it's None.
+    def get_sets_after(topic_id, after, limit, db):
+        question_sets = db.query(QuestionSet).filter(QuestionSet.topic_id == topic_id)
+        if after is not None:
+            question_sets = question_sets.filter(tuple_(QuestionSet.description, QuestionSet.id) > tuple_(*after))
+        return question_sets.order_by(QuestionSet.description, QuestionSet.id).limit(limit).all()
+
+    #Returns the first limit question sets of each topic, in the same order as get_sets_after,
+    #as a dictionary of topic id to list of sets.  Done in a single query for all the topics.
+    def get_first_sets(topic_ids, limit, db):
+        question_sets = {topic_id: [] for topic_id in topic_ids}
+        if not topic_ids:
+            return question_sets
+        row_number = func.row_number().over(
+            partition_by=QuestionSet.topic_id,
+            order_by=(QuestionSet.description, QuestionSet.id),
+        ).label('row_number')
+        ranked = db.query(QuestionSet.id, row_number).\
+            filter(QuestionSet.topic_id.in_(topic_ids)).subquery()
+        rows = db.query(QuestionSet).\
+            join(ranked, ranked.c.id == QuestionSet.id).\
+            filter(ranked.c.row_number <= limit).\
+            order_by(QuestionSet.topic_id, QuestionSet.description, QuestionSet.id)
+        for question_set in rows:
+            question_sets[question_set.topic_id].append(question_set)
+        return question_sets
+
     def create(values, db):
         try:
             new_question_sets = [QuestionSet(topic_id=values[QuestionSet.topic_id.name],description=value[QuestionSet.description.name]) for value in values[QuestionSet.__table__.name]]
@@ -154,6 +252,23 @@ class QuestionSet(Base):
             if e.orig.pgcode == errorcodes.UNIQUE_VIOLATION:
                 raise ValueError('A question set with that description exists already.')
 
+    #Copies the set and all of its questions into the topic under a new description, without
+    #loading the questions, see Question.copy_set.  Returns the new set.
+    def clone(self, topic_id, description, db):
+        try:
+            new_question_set = QuestionSet(topic_id=topic_id, description=description)
+            db.add(new_question_set)
+            db.flush()
+            Question.copy_set(self.id, new_question_set.id, db)
+            QuestionSet.reset_next_question_order(new_question_set.id, db)
+            db.commit()
+            return new_question_set
+        except IntegrityError as e:
+            db.rollback()
+            if e.orig.pgcode == errorcodes.UNIQUE_VIOLATION:
+                raise ValueError('A question set with that description exists already.')
+            raise
+
     def edit_schema(self):
         from .forms import CSRFSchema, QuestionSet, merge_schemas
 
@@ -162,21 +277,139 @@ class QuestionSet(Base):
         merge_schemas(csrf_schema, question_set_schema)
         return csrf_schema
 
+    #Reorders some or all of the set's questions.  new_order holds question ids in their new
+    #order and the questions take the order numbers they already had between them, so a page
+    #of the set can be reordered without touching the questions that weren't shown.
+    #Only questions whose order number changes are written, all in one statement, and
+    #nothing is written or committed if none do.  Returns the number of questions moved.
     def reorder(self, new_order, db):
-        order = [{'id':i, 'question_order': index} for index, i in enumerate(new_order)]
-        db.execute('SET CONSTRAINTS unique_order_per_set DEFERRED;')
-        db.bulk_update_mappings(Question, order)
+        current = dict(
+            db.query(Question.id, Question.question_order).\
+                filter(Question.question_set_id == self.id, Question.id.in_(new_order)).\
+                with_for_update().all()
+        )
+        if not new_order or len(current) != len(new_order):
+            raise ValueError('Questions are not all in the set.')
+        slots = sorted(current.values())
+        moved = [(i, slot) for i, slot in zip(new_order, slots) if current[i] != slot]
+        if not moved:
+            return 0
+        Question.set_orders(self.id, moved, db)
+        QuestionSet.bump_version(self.id, db)
         db.commit()
-
-    def get_questions(self, db):
-        questions = db.query(Question.LOAD_COMPLETE_POLYMORPHIC_RELATION).\
-            join(QuestionSet).\
+        return len(moved)
+
+    #Moves a question to just before or after (if after is true) another question of the set,
+    #by giving it an order number between the target's and the target's neighbour's.  Order
+    #numbers are handed out Question.ORDER_GAP apart so this only writes the moved question,
+    #until moves into the same place use up the gap and the set is rebalanced.  Returns False
+    #if the question is already there, otherwise commits and returns True.
+    def move(self, question_id, target_id, after, db):
+        if question_id == target_id:
+            raise ValueError('A question can\'t be moved next to itself.')
+        #Stops two moves into the same gap taking the same order number.
+        db.query(QuestionSet.id).filter(QuestionSet.id == self.id).with_for_update().one()
+        new_order = self.order_beside(question_id, target_id, after, db)
+        if new_order is None:
+            QuestionSet.rebalance(self.id, db)
+            new_order = self.order_beside(question_id, target_id, after, db)
+        if new_order is False:
+            return False
+        Question.set_orders(self.id, [(question_id, new_order)], db)
+        QuestionSet.bump_version(self.id, db)
+        db.commit()
+        return True
+
+    #The order number that puts the question next to the target, False if it's already there
+    #or None if there's no free order number left between the target and its neighbour.
+    def order_beside(self, question_id, target_id, after, db):
+        orders = dict(
+            db.query(Question.id, Question.question_order).\
+                filter(Question.question_set_id == self.id, Question.id.in_([question_id, target_id])).all()
+        )
+        if len(orders) != 2:
+            raise ValueError('Questions are not all in the set.')
+        target_order = orders[target_id]
+        neighbour = db.query(Question.id, Question.question_order).\
+            filter(Question.question_set_id == self.id)
+        if after:
+            neighbour = neighbour.filter(Question.question_order > target_order).order_by(Question.question_order)
+        else:
+            neighbour = neighbour.filter(Question.question_order < target_order).order_by(Question.question_order.desc())
+        neighbour = neighbour.first()
+        if neighbour is None:
+            if after:
+                return QuestionSet.allocate_question_orders(self.id, 1, db)
+            new_order = target_order - Question.ORDER_GAP
+            return new_order if new_order >= -Question.MAX_ORDER else None
+        if neighbour.id == question_id:
+            return False
+        if abs(neighbour.question_order - target_order) < 2:
+            return None
+        return (neighbour.question_order + target_order) // 2
+
+    #Renumbers the set's questions 0, ORDER_GAP, 2 * ORDER_GAP... in their current order, in one
+    #statement.  Returns the number of questions renumbered.
+    def rebalance(question_set_id, db):
+        renumbered = db.execute(
+            text(
+                'UPDATE questions SET question_order = ranked.question_order '
+                'FROM (SELECT id, (row_number() OVER (ORDER BY question_order) - 1) * :gap AS question_order '
+                'FROM questions WHERE question_set_id = :question_set_id) AS ranked '
+                'WHERE questions.id = ranked.id AND questions.question_order <> ranked.question_order'
+            ),
+            {'question_set_id': question_set_id, 'gap': Question.ORDER_GAP},
+        ).rowcount
+        QuestionSet.reset_next_question_order(question_set_id, db)
+        return renumbered
+
+    #Marks the set's questions as changed.  Call in the same transaction as the change.
+    def bump_version(question_set_id, db):
+        db.query(QuestionSet).\
+            filter(QuestionSet.id == question_set_id).\
+            update({QuestionSet.version: QuestionSet.version + 1}, synchronize_session=False)
+
+    def get_questions(self, db, loading=QuestionLoading.join):
+        questions = Question.polymorphic_query(db, loading).\
             filter(Question.question_set_id == self.id).\
-            order_by(Question.LOAD_COMPLETE_POLYMORPHIC_RELATION.question_order).all()
-        return questions
-
-    def last_question_order(question_set_id, db):
-        return db.query(func.coalesce(func.max(Question.question_order), -1)).filter(Question.question_set_id == question_set_id).scalar()
+            order_by(Question.question_order).all()
+        return Question.loaded(questions, loading)
+
+    #Returns up to limit questions of the set ordered by question_order, starting after
+    #after_order or from the first question if it's None.  Uses the unique_order_per_set
+    #index so the cost doesn't depend on the size of the set.
+    def get_questions_after(question_set_id, after_order, limit, db, loading=QuestionLoading.join):
+        questions = Question.polymorphic_query(db, loading).\
+            filter(Question.question_set_id == question_set_id)
+        if after_order is not None:
+            questions = questions.filter(Question.question_order > after_order)
+        return Question.loaded(questions.order_by(Question.question_order).limit(limit).all(), loading)
+
+    #Reserves count order numbers, ORDER_GAP apart, at the end of the set and returns the first,
+    #with a single UPDATE ... RETURNING of the set's counter instead of reading the last order
+    #number.  The set's row stays locked until the transaction ends, so concurrent appends to
+    #the set queue behind each other rather than taking the same numbers and failing on
+    #unique_order_per_set.  Numbers reserved by a transaction that rolls back are skipped.
+    def allocate_question_orders(question_set_id, count, db):
+        question_sets = QuestionSet.__table__
+        next_order = db.execute(
+            question_sets.update().\
+                where(question_sets.c.id == question_set_id).\
+                values({question_sets.c.next_question_order: question_sets.c.next_question_order + count * Question.ORDER_GAP}).\
+                returning(question_sets.c.next_question_order)
+        ).scalar()
+        if next_order is None:
+            raise ValueError('Question set does not exist.')
+        return next_order - count * Question.ORDER_GAP
+
+    #Sets the counter to ORDER_GAP after the set's last question, for questions that were
+    #written without allocate_question_orders (copied or renumbered).
+    def reset_next_question_order(question_set_id, db):
+        last_order = select([func.max(Question.question_order)]).\
+            where(Question.question_set_id == question_set_id).as_scalar()
+        db.query(QuestionSet).\
+            filter(QuestionSet.id == question_set_id).\
+            update({QuestionSet.next_question_order: func.coalesce(last_order + Question.ORDER_GAP, 0)}, synchronize_session=False)
 
 class QuestionType(enum.Enum):
     question = 1
@@ -202,18 +435,30 @@ class Question(Base):
     description = Column(String, nullable=False)
     question_order = Column(Integer, nullable=False)
     question_set_id = Column(Integer, ForeignKey('question_sets.id', ondelete='cascade'), nullable=False)
+    #Written by the database, see SEARCH_TRIGGERS.  Deferred so loading questions doesn't read it.
+    search_vector = deferred(Column(TSVECTOR))
+    #A copy of the question's row in its type's table as a JSON object, written by the
+    #database once payload storage is turned on (see qa.payloads) and read by
+    #QuestionLoading.payload.  The type tables remain the source of truth.
+    payload = deferred(Column(JSONB))
 
     question_set = relationship('QuestionSet', back_populates='questions')
 
     __table_args__ = (
-        UniqueConstraint('question_set_id', 'description', name='unique_description_per_set'),
-        UniqueConstraint('question_set_id', 'question_order', name='unique_order_per_set', deferrable=True)
+        Index('unique_description_per_set', question_set_id, description_digest(description), unique=True),
+        UniqueConstraint('question_set_id', 'question_order', name='unique_order_per_set', deferrable=True),
+        Index('ix_questions_search_vector', 'search_vector', postgresql_using='gin'),
     )
     __mapper_args__ = {
         'polymorphic_identity': QuestionType.question,
         'polymorphic_on': type,
     }
 
+    #Spacing between the order numbers of questions added to a set, which leaves room to move
+    #questions between them, see QuestionSet.move.
+    ORDER_GAP = 1024
+    MAX_ORDER = 2 ** 31 - 1
+
     REPORT_TEMPLATE = '''
         <h4>{} <i class="glyphicon glyphicon {}"></i></h4>
         <p>Correct Answer: {}</p>
@@ -240,10 +485,12 @@ class Question(Base):
         try:
             q_type = values[cls.type.name]
             Q_class = QuestionType.get_question_class(q_type)
-            order_start = QuestionSet.last_question_order(question_set_id, db) + 1
-            new_questions = [Q_class(question_set_id=question_set_id, question_order=order_start + i, **value)
-                for i, value in enumerate(values[Q_class.__table__.name])]
+            new_values = values[Q_class.__table__.name]
+            order_start = QuestionSet.allocate_question_orders(question_set_id, len(new_values), db)
+            new_questions = [Q_class(question_set_id=question_set_id, question_order=order_start + i * Question.ORDER_GAP, **value)
+                for i, value in enumerate(new_values)]
             db.add_all(new_questions)
+            QuestionSet.bump_version(question_set_id, db)
             db.commit()
         except IntegrityError as e:
             db.rollback()
@@ -251,6 +498,135 @@ class Question(Base):
         except Exception as e:
             raise FormError()
 
+    #Inserts validated questions of this type (dictionaries as for create) in two statements,
+    #a multi row INSERT ... RETURNING into the questions table and one into the type's table,
+    #instead of a pair of statements per question.  The questions are given order numbers
+    #ORDER_GAP apart from first_order on.  Returns the new ids, in the same order as values.
+    @classmethod
+    def insert_many(cls, question_set_id, first_order, values, db):
+        base_table = Question.__table__
+        own_table = cls.__table__
+        base_rows = []
+        own_rows = []
+        for i, value in enumerate(values):
+            base_row = {
+                Question.type.name: cls.__mapper__.polymorphic_identity,
+                Question.question_set_id.name: question_set_id,
+                Question.question_order.name: first_order + i * Question.ORDER_GAP,
+            }
+            own_row = {}
+            for key, column_value in value.items():
+                if key in base_table.c:
+                    base_row[key] = column_value
+                else:
+                    own_row[key] = column_value
+            base_rows.append(base_row)
+            own_rows.append(own_row)
+
+        returned = db.execute(
+            base_table.insert().values(base_rows).returning(base_table.c.id, base_table.c.question_order)
+        )
+        #Matched up by order number, RETURNING doesn't promise to keep the VALUES order.
+        ids_by_order = {question_order: question_id for question_id, question_order in returned}
+        ids = [ids_by_order[first_order + i * Question.ORDER_GAP] for i in range(len(values))]
+        if own_table is not base_table:
+            for question_id, own_row in zip(ids, own_rows):
+                own_row[own_table.c.id.name] = question_id
+            db.execute(own_table.insert().values(own_rows))
+        return ids
+
+    #Copies every question of a set, and its question type's row, into another set with one
+    #INSERT ... SELECT per table, so the copy is done by the database however large the set is.
+    #New ids are drawn from the questions id sequence, in question order, into a temporary
+    #old id to new id map that the inserts join against.  Returns the number of questions copied.
+    def copy_set(from_question_set_id, to_question_set_id, db):
+        db.execute('CREATE TEMPORARY TABLE question_id_map (old_id integer PRIMARY KEY, new_id integer NOT NULL) ON COMMIT DROP')
+        id_map = table('question_id_map', column('old_id'), column('new_id'))
+        base_table = Question.__table__
+        old_ids = select([base_table.c.id]).\
+            where(base_table.c.question_set_id == from_question_set_id).\
+            order_by(base_table.c.question_order).alias()
+        copied = db.execute(id_map.insert().from_select(
+            ['old_id', 'new_id'],
+            select([old_ids.c.id, func.nextval(func.pg_get_serial_sequence(base_table.name, base_table.c.id.name))]),
+        )).rowcount
+
+        columns = [c for c in base_table.c if c.name not in (base_table.c.id.name, base_table.c.question_set_id.name)]
+        db.execute(base_table.insert().from_select(
+            [base_table.c.id.name, base_table.c.question_set_id.name] + [c.name for c in columns],
+            select([id_map.c.new_id, literal(to_question_set_id)] + columns).\
+                select_from(base_table.join(id_map, id_map.c.old_id == base_table.c.id)),
+        ))
+        for _, own_table in Question.type_tables():
+            columns = [c for c in own_table.c if c.name != own_table.c.id.name]
+            db.execute(own_table.insert().from_select(
+                [own_table.c.id.name] + [c.name for c in columns],
+                select([id_map.c.new_id] + columns).\
+                    select_from(own_table.join(id_map, id_map.c.old_id == own_table.c.id)),
+            ))
+        return copied
+
+    #Returns (QuestionType, table) for each question type with a table of its own, in
+    #QuestionType order.
+    def type_tables():
+        mappers = sorted(Question.__mapper__.polymorphic_map.values(), key=lambda mapper: mapper.polymorphic_identity.value)
+        return [(mapper.polymorphic_identity, mapper.local_table) for mapper in mappers if mapper.local_table is not Question.__table__]
+
+    #Full text search of the descriptions, and multiple choice questions' choices, of the
+    #questions in the user's topics.  terms are read with websearch_to_tsquery, so they can
+    #be quoted phrases, OR and -word.  Returns up to limit rows of (id, description, type,
+    #question_set_id, question_set, topic, rank), best match first, ties by id, starting
+    #after the (rank, id) key after or from the best match if it's None.  The match is found
+    #with the GIN index on search_vector and rank is a float8 so it can be given back exactly
+    #as the key of the next page.
+    def search(user_id, terms, after, limit, db):
+        query = func.websearch_to_tsquery(SEARCH_CONFIG, terms)
+        rank = cast(func.ts_rank(Question.search_vector, query), Float)
+        results = db.query(
+                Question.id, Question.description, Question.type, Question.question_set_id,
+                QuestionSet.description.label('question_set'), Topic.title.label('topic'), rank.label('rank'),
+            ).\
+            join(QuestionSet, QuestionSet.id == Question.question_set_id).\
+            join(Topic, Topic.id == QuestionSet.topic_id).\
+            filter(Topic.user_id == user_id, Question.search_vector.op('@@')(query))
+        if after is not None:
+            after_rank, after_id = after
+            results = results.filter(tuple_(-rank, Question.id) > tuple_(-cast(after_rank, Float), after_id))
+        return results.order_by(rank.desc(), Question.id).limit(limit).all()
+
+    #Sets the order numbers of questions in the set from (id, question_order) pairs with a
+    #single UPDATE ... FROM (VALUES ...).  unique_order_per_set is deferrable, so it is checked
+    #at the end of the statement and questions can swap order numbers.
+    def set_orders(question_set_id, orders, db):
+        params = {'question_set_id': question_set_id}
+        rows = []
+        for i, (question_id, question_order) in enumerate(orders):
+            params['id_{}'.format(i)] = question_id
+            params['order_{}'.format(i)] = question_order
+            rows.append('(:id_{0}, :order_{0})'.format(i))
+        db.execute(
+            text(
+                'UPDATE questions SET question_order = new_orders.question_order '
+                'FROM (VALUES {}) AS new_orders (id, question_order) '
+                'WHERE questions.id = new_orders.id AND questions.question_set_id = :question_set_id'.format(', '.join(rows))
+            ),
+            params,
+        )
+
+    #Returns which of the descriptions are already used by questions in the set, compared
+    #as unique_description_per_set compares them.
+    def existing_descriptions(question_set_id, descriptions, db):
+        if not descriptions:
+            return set()
+        given = column('given')
+        rows = db.query(given).\
+            select_from(func.unnest(literal(list(descriptions), ARRAY(String))).alias('given')).\
+            filter(exists().where(and_(
+                Question.question_set_id == question_set_id,
+                description_digest(Question.description) == description_digest(given),
+            )))
+        return {description for description, in rows}
+
     #Should be an appropriate method for editing all question types, even multipart questions that are yet to be implemented.
     #However, it accesses variables in the child class, though not directly because of the setattr use, which seems like
     #a violation of inheritance.  On the other hand, I would just be writing methods in the child class that will end up
@@ -263,6 +639,7 @@ class Question(Base):
             for key, value in new_values.items():
                 if hasattr(self, key):
                     setattr(self, key, value)
+            QuestionSet.bump_version(self.question_set_id, db)
             db.commit()
         except IntegrityError as e:
             db.rollback()
@@ -270,6 +647,69 @@ class Question(Base):
         except Exception as _:
             raise FormError()
 
+    def get_question(question_set_id, question_id, db, question_type=None, loading=QuestionLoading.join):
+        Q_class = QuestionType.get_question_class(question_type) if question_type else None
+        query = db.query(Q_class) if Q_class else Question.polymorphic_query(db, loading)
+        question = query.filter(Question.id == question_id, Question.question_set_id == question_set_id).one_or_none()
+        if question is not None and not Q_class:
+            Question.loaded([question], loading)
+        return question
+
+    def get_questions_by_id(question_ids, db, loading=QuestionLoading.join):
+        questions = Question.polymorphic_query(db, loading).\
+            filter(Question.id.in_(question_ids)).all()
+        return Question.loaded(questions, loading)
+
+    #A query for questions of any type, loaded as loading (a QuestionLoading) says.  Filter
+    #and order it by Question's columns.
+    def polymorphic_query(db, loading=QuestionLoading.join):
+        if loading == QuestionLoading.join:
+            return db.query(Question.LOAD_COMPLETE_POLYMORPHIC_RELATION)
+        query = db.query(Question)
+        if loading == QuestionLoading.selectin:
+            query = query.options(selectin_polymorphic(Question, Question.TYPE_CLASSES))
+        elif loading == QuestionLoading.payload:
+            query = query.options(undefer(Question.payload))
+        return query
+
+    #Finishes loading questions read with polymorphic_query and returns them.  With
+    #QuestionLoading.payload the type's columns are set from the payload as though they had
+    #been read from the type's table, so they can be used and edited as usual.  Questions
+    #that don't have a payload yet have their type's columns read from the type tables, with
+    #one query per type, so they are complete too and can be detached.
+    def loaded(questions, loading):
+        if loading != QuestionLoading.payload:
+            return questions
+        missing = {}
+        for question in questions:
+            payload = question.payload
+            own_table = type(question).__table__
+            if own_table is Question.__table__:
+                continue
+            if payload is None:
+                missing.setdefault(type(question), []).append(question.id)
+                continue
+            for column in own_table.c:
+                if column.name == own_table.c.id.name:
+                    continue
+                value = payload.get(column.name)
+                if value is not None and isinstance(column.type, Enum):
+                    value = column.type.enum_class[value]
+                elif value is not None and isinstance(column.type, Float):
+                    value = float(value)
+                set_committed_value(question, column.key, value)
+        for Q_class, question_ids in missing.items():
+            object_session(questions[0]).query(Q_class).filter(Q_class.id.in_(question_ids)).all()
+        return questions
+
+    #Returns what is_correct needs to grade an answer to this question.  Computed once per
+    #question when a set is cached (qa.cache) instead of once per answer.
+    def answer_key(self):
+        return None
+
+    def is_correct(self, answer_key, answer):
+        return False
+
     def edit_schema(self):
         from .forms import CSRFSchema, get_question_edit_schema, merge_schemas
 
@@ -278,13 +718,17 @@ class Question(Base):
         merge_schemas(csrf_schema, edit_schema)
         return csrf_schema
 
-    def user_is_contributor(user_id, question_set_id, question_id, db):
+    #Returns the question if the user owns it, loaded with all of its fields in the same
+    #query.  If the question's type (a QuestionType name) is known only that subtype's table
+    #is joined instead of every subtype table.
+    def user_is_contributor(user_id, question_set_id, question_id, db, question_type=None):
+        Q_class = QuestionType.get_question_class(question_type) if question_type else None
+        entity = Q_class or Question.LOAD_COMPLETE_POLYMORPHIC_RELATION
         try:
-            question = db.query(Question.LOAD_COMPLETE_POLYMORPHIC_RELATION).\
-                join(QuestionSet).\
-                join(Topic).\
-                join(User).\
-                filter(Question.id == question_id, QuestionSet.id == question_set_id, User.id == user_id).one()
+            question = db.query(entity).\
+                join(QuestionSet, Question.question_set_id == QuestionSet.id).\
+                join(Topic, QuestionSet.topic_id == Topic.id).\
+                filter(Question.id == question_id, Question.question_set_id == question_set_id, Topic.user_id == user_id).one()
             return question
         except NoResultFound as _:
             return False
@@ -292,6 +736,8 @@ class Question(Base):
     def handle_db_exception(e, Q_class):
         if e.orig.pgcode == errorcodes.NOT_NULL_VIOLATION:
             raise ValueError('A required value is missing.')
+        elif e.orig.pgcode == errorcodes.STRING_DATA_RIGHT_TRUNCATION:
+            raise ValueError('A value is too long.')
         elif e.orig.diag.constraint_name == 'unique_description_per_set':
             raise ValueError('Questions must be unique per set.')
         elif e.orig.diag.constraint_name == 'unique_order_per_set':
@@ -340,24 +786,35 @@ class MathQuestion(Question):
         schema = MathAnswer().bind(request=request, question=self)
         return schema
 
-    def _compare_to_answer_for_report(self, answer):
-        a = answer['answer']
+    #The range of accepted answers and the units in lower case, if any.
+    def answer_key(self):
         if self.accuracy == Accuracy.exact:
-            numerically_correct = self.correct_answer == a
+            low = high = self.correct_answer
         elif self.accuracy == Accuracy.uncertainty:
-            numerically_correct = a >= self.correct_answer - self.accuracy_degree and \
-                a <= self.correct_answer + self.accuracy_degree
+            low = self.correct_answer - self.accuracy_degree
+            high = self.correct_answer + self.accuracy_degree
         elif self.accuracy == Accuracy.percentage:
-            numerically_correct = a >= self.correct_answer * (1 - self.accuracy_degree / 100.0) and \
-                a <= self.correct_answer * (1 + self.accuracy_degree / 100.0)
+            low = self.correct_answer * (1 - self.accuracy_degree / 100.0)
+            high = self.correct_answer * (1 + self.accuracy_degree / 100.0)
+        return (min(low, high), max(low, high), self.units.lower() if self.units else None)
+
+    def is_correct(self, answer_key, answer):
+        low, high, units = answer_key
+        numerically_correct = low <= answer['answer'] <= high
+        if 'units' in answer:
+            return numerically_correct and units == answer['units'].lower()
+        return numerically_correct
+
+    def _compare_to_answer_for_report(self, answer):
+        a = answer['answer']
         if 'units' in answer:
             return (
-                self.units.lower() == answer['units'].lower() and numerically_correct,
+                self.is_correct(self.answer_key(), answer),
                 str(self.correct_answer) + ' ' + self.units,
                 str(a) + ' ' + answer['units'],
             )
         else:
-            return (numerically_correct, self.correct_answer, a)
+            return (self.is_correct(self.answer_key(), answer), self.correct_answer, a)
 
     def report(self, answer):
         answer_is_correct = self._compare_to_answer_for_report(answer)
@@ -406,6 +863,12 @@ class MultipleChoiceQuestion(Question):
         schema = MultipleChoiceAnswer().bind(request=request, choices=answer_choices, question=self)
         return schema
 
+    def answer_key(self):
+        return self.correct_answer
+
+    def is_correct(self, answer_key, answer):
+        return answer['answer'] == answer_key
+
     def report(self, answer):
         choices = [self.choice_one, self.choice_two, self.choice_three, self.choice_four]
         return Question.report(self.description, choices[self.correct_answer], choices[answer['answer']])
@@ -416,6 +879,63 @@ class MultipleChoiceQuestion(Question):
         elif e.orig.diag.constraint_name == 'answer_in_range':
             raise ValueError('')
 
+#questions.search_vector is kept up to date by triggers instead of by the models, so that
+#bulk imports, clones and edits all keep it right.  A question's description is weighted
+#above its choices.  A new question's row is inserted before its choices so the questions
+#trigger only reads the choices on update, and the choices trigger runs once per statement
+#over the inserted or updated rows, which keeps bulk inserts to one extra UPDATE.  Run
+#after multiple_choice_questions is created and by the add_question_search_vector migration.
+#While payload storage is on, qa.payloads replaces the choices trigger with one that sets
+#the payload in the same UPDATE.
+SEARCH_CONFIG = 'english'
+#The search vector of the questions updated from the multiple_choice_questions rows new_rows.
+CHOICES_SEARCH_VECTOR = '''
+    setweight(to_tsvector('{config}', questions.description), 'A') ||
+    setweight(to_tsvector('{config}', concat_ws(' ', new_rows.choice_one, new_rows.choice_two, new_rows.choice_three, new_rows.choice_four)), 'B')
+'''.format(config=SEARCH_CONFIG)
+SEARCH_TRIGGERS = [statement.format(config=SEARCH_CONFIG, search_vector=CHOICES_SEARCH_VECTOR) for statement in [
+    '''
+    CREATE OR REPLACE FUNCTION questions_search_vector() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.search_vector := setweight(to_tsvector('{config}', NEW.description), 'A');
+        IF TG_OP = 'UPDATE' THEN
+            NEW.search_vector := NEW.search_vector || coalesce((
+                SELECT setweight(to_tsvector('{config}', concat_ws(' ', choice_one, choice_two, choice_three, choice_four)), 'B')
+                FROM multiple_choice_questions WHERE id = NEW.id
+            ), ''::tsvector);
+        END IF;
+        RETURN NEW;
+    END
+    $$
+    ''',
+    'DROP TRIGGER IF EXISTS questions_search_vector ON questions',
+    '''
+    CREATE TRIGGER questions_search_vector BEFORE INSERT OR UPDATE OF description ON questions
+    FOR EACH ROW EXECUTE FUNCTION questions_search_vector()
+    ''',
+    '''
+    CREATE OR REPLACE FUNCTION multiple_choice_questions_search_vector() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE questions SET search_vector = {search_vector}
+        FROM new_rows WHERE questions.id = new_rows.id;
+        RETURN NULL;
+    END
+    $$
+    ''',
+    'DROP TRIGGER IF EXISTS multiple_choice_questions_search_vector_insert ON multiple_choice_questions',
+    '''
+    CREATE TRIGGER multiple_choice_questions_search_vector_insert AFTER INSERT ON multiple_choice_questions
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION multiple_choice_questions_search_vector()
+    ''',
+    'DROP TRIGGER IF EXISTS multiple_choice_questions_search_vector_update ON multiple_choice_questions',
+    '''
+    CREATE TRIGGER multiple_choice_questions_search_vector_update AFTER UPDATE ON multiple_choice_questions
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION multiple_choice_questions_search_vector()
+    ''',
+]]
+for statement in SEARCH_TRIGGERS:
+    event.listen(MultipleChoiceQuestion.__table__, 'after_create', DDL(statement))
+
 class TrueFalseQuestion(Question):
     __tablename__ = 'true_false_questions'
 
@@ -431,6 +951,12 @@ class TrueFalseQuestion(Question):
 
         return TrueFalseAnswer().bind(request=request, question=self)
 
+    def answer_key(self):
+        return bool(self.correct_answer)
+
+    def is_correct(self, answer_key, answer):
+        return bool(answer['answer']) == answer_key
+
     def report(self, answer):
         return Question.report(self.description, bool(self.correct_answer), bool(answer['answer']))
 
@@ -439,4 +965,83 @@ class TrueFalseQuestion(Question):
     def handle_db_exception(e):
         raise ValueError('Unknown Error.')
 
-Question.LOAD_COMPLETE_POLYMORPHIC_RELATION = with_polymorphic(Question, [MultipleChoiceQuestion, TrueFalseQuestion, MathQuestion])
+#A finished run through a question set, written by qa.attempts.AttemptWriter.
+class Attempt(Base):
+    __tablename__ = 'attempts'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='cascade'), nullable=False)
+    question_set_id = Column(Integer, ForeignKey('question_sets.id', ondelete='cascade'), nullable=False, index=True)
+    #The set's version when the attempt was started, None if it isn't known.
+    question_set_version = Column(Integer, nullable=True)
+    score = Column(Integer, nullable=False)
+    question_count = Column(Integer, nullable=False)
+    finished = Column(DateTime(timezone=True), nullable=False)
+
+    answers = relationship('AttemptAnswer', passive_deletes='all', order_by='AttemptAnswer.question_index')
+
+    __table_args__ = (
+        Index('ix_attempts_user_id_finished', 'user_id', 'finished'),
+    )
+
+#One answer of an attempt, packed as in QuestionSetState: the chosen index for multiple
+#choice, 0 or 1 for true/false and the number and units for math.
+class AttemptAnswer(Base):
+    __tablename__ = 'attempt_answers'
+
+    attempt_id = Column(Integer, ForeignKey('attempts.id', ondelete='cascade'), primary_key=True)
+    question_index = Column(Integer, primary_key=True)
+    #Kept when the question is deleted, the answer still counts towards the attempt.
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete='set null'), nullable=True, index=True)
+    answer = Column(Float, nullable=False)
+    units = Column(String(10), nullable=True)
+    correct = Column(Boolean, nullable=False)
+
+#Running totals of a question's answers, kept up to date as attempts are saved (see
+#qa.stats) so they're read without going over attempt_answers.
+class QuestionStats(Base):
+    __tablename__ = 'question_stats'
+
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete='cascade'), primary_key=True)
+    answers = Column(Integer, nullable=False, default=0, server_default='0')
+    correct = Column(Integer, nullable=False, default=0, server_default='0')
+
+#How many times each choice of a multiple choice question was picked.
+class QuestionChoiceStats(Base):
+    __tablename__ = 'question_choice_stats'
+
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete='cascade'), primary_key=True)
+    choice = Column(Integer, primary_key=True)
+    answers = Column(Integer, nullable=False, default=0, server_default='0')
+
+#The question types with tables of their own, see QuestionLoading.
+Question.TYPE_CLASSES = [MultipleChoiceQuestion, TrueFalseQuestion, MathQuestion]
+Question.LOAD_COMPLETE_POLYMORPHIC_RELATION = with_polymorphic(Question, Question.TYPE_CLASSES)
+
+#The JSON types a column's values take in a payload, see payload_matches_type.
+def payload_value_types(column):
+    if isinstance(column.type, Boolean):
+        value_types = ['boolean']
+    elif isinstance(column.type, (Integer, Float)):
+        value_types = ['number']
+    else:
+        #Enums are strings too.
+        value_types = ['string']
+    return value_types + ['null'] if column.nullable else value_types
+
+#A payload has to be an object with every column of the question's type, each holding a
+#value of the column's type.
+Question.__table__.append_constraint(CheckConstraint(
+    "payload IS NULL OR (jsonb_typeof(payload) = 'object' AND CASE type {} ELSE false END)".format(' '.join(
+        "WHEN '{}' THEN payload ?& ARRAY[{}] AND {}".format(
+            Q_class.__mapper__.polymorphic_identity.name,
+            ', '.join("'{}'".format(c.name) for c in Q_class.__table__.c if c.name != 'id'),
+            ' AND '.join(
+                "jsonb_typeof(payload -> '{}') IN ({})".format(c.name, ', '.join("'{}'".format(t) for t in payload_value_types(c)))
+                for c in Q_class.__table__.c if c.name != 'id'
+            ),
+        )
+        for Q_class in Question.TYPE_CLASSES
+    )),
+    name='payload_matches_type',
+))
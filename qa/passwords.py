@@ -0,0 +1,140 @@
+import atexit
+import concurrent.futures
+import multiprocessing
+import threading
+import time
+
+from passlib.hash import pbkdf2_sha256
+
+#Password hashing takes tens of milliseconds of CPU and holds the GIL throughout, so done
+#in a request's thread it stalls every other request of the worker process.  Hashes are
+#computed by a small pool of processes instead and the request's thread only waits.  At
+#most max_pending hashes are queued or running at once; a request that can't get a place
+#within timeout seconds, or whose hash doesn't finish in time, fails with a ValueError
+#rather than adding to the backlog.  Hashes are made with the configured number of
+#rounds, and hashes made with other parameters are replaced when their user logs in.
+
+DEFAULT_ROUNDS = pbkdf2_sha256.default_rounds
+
+BUSY_ERROR = 'Too many logins at once, try again shortly.'
+
+#Run in the pool's processes.
+def _hasher(rounds):
+    return pbkdf2_sha256.using(rounds=rounds, min_desired_rounds=rounds, max_desired_rounds=rounds)
+
+def _hash(password, rounds):
+    return _hasher(rounds).hash(password)
+
+#Returns whether the password matches and, if it does but the hash was made with other
+#parameters, a new hash of it.
+def _verify(password, password_hash, rounds):
+    hasher = _hasher(rounds)
+    if not hasher.verify(password, password_hash):
+        return False, None
+    return True, hasher.hash(password) if hasher.needs_update(password_hash) else None
+
+class PasswordHasher:
+    #processes of 0 hashes in the calling thread, for tests and scripts.
+    def __init__(self, rounds=DEFAULT_ROUNDS, processes=2, max_pending=32, timeout=5.0):
+        self.rounds = rounds
+        self.processes = processes
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self.pending = 0
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        #Calls that found max_pending hashes waiting, and calls that took longer than timeout.
+        self.rejected = 0
+        self.timeouts = 0
+
+    #The pool is started by the first call, after the settings have been applied.
+    def _start(self):
+        with self._lock:
+            if self._executor is None:
+                if self._slots is None:
+                    atexit.register(self.close)
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    self.processes, mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor, self._slots
+
+    def _run(self, fn, *args):
+        start = time.perf_counter()
+        if self.processes == 0:
+            result = fn(*args)
+        else:
+            result = self._run_in_pool(start, fn, *args)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.calls += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+        return result
+
+    def _run_in_pool(self, start, fn, *args):
+        executor, slots = self._start()
+        if not slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise ValueError(BUSY_ERROR)
+        with self._lock:
+            self.pending += 1
+        try:
+            future = executor.submit(fn, *args)
+        except Exception as _:
+            self._done(slots)
+            raise
+        #The place is given back when the hash finishes, not when the caller stops waiting,
+        #so hashes that timed out still count against max_pending while they run.
+        future.add_done_callback(lambda _: self._done(slots))
+        try:
+            return future.result(timeout=max(0, self.timeout - (time.perf_counter() - start)))
+        except concurrent.futures.TimeoutError as _:
+            with self._lock:
+                self.timeouts += 1
+            raise ValueError(BUSY_ERROR)
+
+    def _done(self, slots):
+        with self._lock:
+            self.pending -= 1
+        slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    #Returns (whether the password matches, a replacement hash or None), see _verify.
+    def verify(self, password, password_hash):
+        return self._run(_verify, password, password_hash, self.rounds)
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'calls': self.calls,
+                'mean_ms': self.total_seconds / self.calls * 1000 if self.calls else 0.0,
+                'max_ms': self.max_seconds * 1000,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+            }
+
+password_hasher = PasswordHasher()
+
+#Applies the settings qa.passwords.rounds, qa.passwords.processes, qa.passwords.max_pending
+#and qa.passwords.timeout to the hasher.  Call before it is first used.
+def configure_from_settings(settings, hasher=password_hasher):
+    hasher.rounds = int(settings.get('qa.passwords.rounds', hasher.rounds))
+    hasher.processes = int(settings.get('qa.passwords.processes', hasher.processes))
+    hasher.max_pending = int(settings.get('qa.passwords.max_pending', hasher.max_pending))
+    hasher.timeout = float(settings.get('qa.passwords.timeout', hasher.timeout))
@@ -0,0 +1,152 @@
+import argparse
+import sys
+
+from pyramid.paster import get_appsettings, setup_logging
+from sqlalchemy import text
+
+from .db import engine_from_settings
+from .models import CHOICES_SEARCH_VECTOR, SEARCH_TRIGGERS, MultipleChoiceQuestion, Question
+
+#Payload storage, the optional copy of each question's type fields in questions.payload
+#that QuestionLoading.payload reads instead of the type tables.  It's off unless turned on
+#with "qa_payloads <ini file> enable", so deployments that don't read payloads don't pay
+#for writing them.
+#
+#While it's on, the copy is kept by a trigger on each type's table, run once per statement
+#over the rows it inserted or updated, so the models, bulk imports and clones all keep it
+#in step.  Writes to the type tables then also update their questions rows, which made
+#inserting 2000 questions with insert_many take 15-20% longer (see
+#benchmarks/question_loading.py), in exchange for reading a set's questions from one
+#table.  multiple_choice_questions already updates its questions rows for the search
+#vector, so its trigger sets both in the same UPDATE instead of adding a second one.  The
+#copy is the type's row as to_jsonb gives it, without the id.  A question's row is inserted
+#before its type's, so the payload is null until then.
+#
+#Turning it on installs the triggers and then backfills the questions written before, see
+#backfill; turning it off drops the triggers and clears the payloads in one transaction.
+
+BATCH_SIZE = 5000
+
+PAYLOAD_FUNCTION = '''
+CREATE OR REPLACE FUNCTION question_payload() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE questions SET payload = to_jsonb(new_rows) - 'id' FROM new_rows WHERE questions.id = new_rows.id;
+    RETURN NULL;
+END
+$$
+'''
+MULTIPLE_CHOICE_PAYLOAD_FUNCTION = '''
+CREATE OR REPLACE FUNCTION multiple_choice_questions_payload() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE questions SET payload = to_jsonb(new_rows) - 'id', search_vector = {search_vector}
+    FROM new_rows WHERE questions.id = new_rows.id;
+    RETURN NULL;
+END
+$$
+'''.format(search_vector=CHOICES_SEARCH_VECTOR)
+
+OPERATIONS = ('insert', 'update')
+
+def trigger_name(table, operation):
+    return '{}_payload_{}'.format(table, operation)
+
+#Statements installing the triggers, by type table.
+PAYLOAD_TRIGGERS = {}
+for Q_class in Question.TYPE_CLASSES:
+    table = Q_class.__tablename__
+    if Q_class is MultipleChoiceQuestion:
+        statements = [MULTIPLE_CHOICE_PAYLOAD_FUNCTION] + [
+            'DROP TRIGGER IF EXISTS {table}_search_vector_{operation} ON {table}'.format(table=table, operation=operation)
+            for operation in OPERATIONS
+        ]
+        function = 'multiple_choice_questions_payload'
+    else:
+        statements = [PAYLOAD_FUNCTION]
+        function = 'question_payload'
+    for operation in OPERATIONS:
+        statements += [
+            'DROP TRIGGER IF EXISTS {} ON {}'.format(trigger_name(table, operation), table),
+            'CREATE TRIGGER {} AFTER {} ON {} REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {}()'.format(
+                trigger_name(table, operation), operation, table, function,
+            ),
+        ]
+    PAYLOAD_TRIGGERS[table] = statements
+
+TRIGGER_NAMES = [trigger_name(table, operation) for table in PAYLOAD_TRIGGERS for operation in OPERATIONS]
+
+def is_enabled(connection):
+    count = connection.execute(
+        text('SELECT count(*) FROM pg_trigger WHERE tgname = ANY(:names) AND NOT tgisinternal'),
+        {'names': TRIGGER_NAMES},
+    ).scalar()
+    return count == len(TRIGGER_NAMES)
+
+def install_triggers(connection):
+    for statements in PAYLOAD_TRIGGERS.values():
+        for statement in statements:
+            connection.execute(statement)
+
+#Puts back the search vector trigger the multiple choice payload trigger replaced.
+def drop_triggers(connection):
+    for table in PAYLOAD_TRIGGERS:
+        for operation in OPERATIONS:
+            connection.execute('DROP TRIGGER IF EXISTS {} ON {}'.format(trigger_name(table, operation), table))
+    for statement in SEARCH_TRIGGERS:
+        connection.execute(statement)
+
+#Installs the triggers and fills in the existing questions.  Returns the number of
+#questions given a payload.
+def enable(engine, batch_size=BATCH_SIZE):
+    with engine.begin() as connection:
+        install_triggers(connection)
+    return backfill(engine, batch_size)
+
+def disable(engine):
+    with engine.begin() as connection:
+        drop_triggers(connection)
+        connection.execute('UPDATE questions SET payload = NULL WHERE payload IS NOT NULL')
+
+#Fills in questions.payload for questions written before the triggers were installed.
+#Each type's table is walked in id order a batch at a time, every batch in its own
+#transaction, so it can run against a live database, holds few locks at once and picks up
+#where it left off if it's stopped.  Questions that already have a payload are left alone.
+BACKFILL_BATCH = '''
+    WITH batch AS (
+        SELECT * FROM {table} WHERE id > :after ORDER BY id LIMIT :limit
+    ), filled AS (
+        UPDATE questions SET payload = to_jsonb(batch) - 'id'
+        FROM batch
+        WHERE questions.id = batch.id AND questions.payload IS NULL
+        RETURNING questions.id
+    )
+    SELECT (SELECT max(id) FROM batch), (SELECT count(*) FROM filled)
+'''
+
+#Returns the number of questions given a payload.
+def backfill(engine, batch_size=BATCH_SIZE):
+    filled = 0
+    for Q_class in Question.TYPE_CLASSES:
+        statement = text(BACKFILL_BATCH.format(table=Q_class.__tablename__))
+        after = 0
+        while True:
+            with engine.begin() as connection:
+                last_id, count = connection.execute(statement, {'after': after, 'limit': batch_size}).first()
+            if last_id is None:
+                break
+            after = last_id
+            filled += count
+    return filled
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description='Turn payload storage (questions.payload) on or off.')
+    parser.add_argument('config_uri')
+    parser.add_argument('action', choices=['enable', 'disable'])
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv[1:])
+    setup_logging(args.config_uri)
+    engine = engine_from_settings(get_appsettings(args.config_uri))
+    if args.action == 'enable':
+        print('Payload storage is on, {} questions filled in.'.format(enable(engine, args.batch_size)))
+    else:
+        disable(engine)
+        print('Payload storage is off.')
@@ -0,0 +1,146 @@
+import hashlib
+import sys
+
+from pyramid.paster import get_appsettings, setup_logging
+from sqlalchemy import Column, Enum, Integer, MetaData, String, Table, func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from . import payloads
+from .db import engine_from_settings
+from .models import SEARCH_TRIGGERS, Base, Question, QuestionSet
+
+#The schema is created and upgraded once, by running qa_migrate, instead of every worker
+#calling create_all on boot.  Workers only compare the fingerprint of the models they were
+#started with against the one stored by the last migration.
+
+#Kept out of Base.metadata so the fingerprint doesn't depend on its own table.
+schema_metadata = MetaData()
+schema_version = Table(
+    'schema_version', schema_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('fingerprint', String(64), nullable=False),
+)
+SCHEMA_VERSION_ID = 1
+
+#Arbitrary key for the advisory lock which stops two migrations running at once.
+MIGRATION_LOCK_ID = 7316
+
+#Changes create_all can't make to tables that already exist (new columns, replaced
+#constraints, triggers).  Each step takes a connection inside the migration's
+#transaction and must be safe to run against an up to date database.
+MIGRATIONS = []
+
+def add_question_set_version(connection):
+    connection.execute('ALTER TABLE question_sets ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 0')
+MIGRATIONS.append(add_question_set_version)
+
+def add_topic_page_index(connection):
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_topics_user_id_title_id ON topics (user_id, title, id)')
+MIGRATIONS.append(add_topic_page_index)
+
+#Sets the counter of sets that existed before it was added past their last question.
+def add_question_set_next_question_order(connection):
+    exists = connection.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = 'question_sets' AND column_name = 'next_question_order'"
+    ).first()
+    if exists:
+        return
+    connection.execute('ALTER TABLE question_sets ADD COLUMN next_question_order integer NOT NULL DEFAULT 0')
+    connection.execute(
+        'UPDATE question_sets SET next_question_order = coalesce('
+        '(SELECT max(question_order) + %(gap)s FROM questions WHERE questions.question_set_id = question_sets.id), 0)',
+        {'gap': Question.ORDER_GAP},
+    )
+MIGRATIONS.append(add_question_set_next_question_order)
+
+#Fills in the vectors of questions that existed before the column was added.  Setting the
+#description runs the questions trigger, which also reads the choices.
+def add_question_search_vector(connection):
+    connection.execute('ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector tsvector')
+    for statement in SEARCH_TRIGGERS:
+        connection.execute(statement)
+    connection.execute('UPDATE questions SET description = description WHERE search_vector IS NULL')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_questions_search_vector ON questions USING gin (search_vector)')
+MIGRATIONS.append(add_question_search_vector)
+
+#Replaces the unique constraints on the descriptions themselves with the unique indexes on
+#their digests.  Fails, leaving the constraints in place, if a set or topic has descriptions
+#that differ only in case or surrounding spaces; the error names them.
+def hash_description_uniqueness(connection):
+    for table, name in ((QuestionSet.__table__, 'unique_description_per_topic'), (Question.__table__, 'unique_description_per_set')):
+        connection.execute('ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}'.format(table.name, name))
+        if not connection.execute('SELECT 1 FROM pg_indexes WHERE indexname = %(name)s', {'name': name}).first():
+            index, = [index for index in table.indexes if index.name == name]
+            connection.execute(CreateIndex(index))
+MIGRATIONS.append(hash_description_uniqueness)
+
+#Payload storage stays off until it's turned on with qa_payloads, see qa.payloads.  If it's
+#on, its triggers are installed again since add_question_search_vector puts back the search
+#vector trigger the multiple choice one replaces.
+def add_question_payload(connection):
+    connection.execute('ALTER TABLE questions ADD COLUMN IF NOT EXISTS payload jsonb')
+    constraint, = [c for c in Question.__table__.constraints if c.name == 'payload_matches_type']
+    if not connection.execute('SELECT 1 FROM pg_constraint WHERE conname = %(name)s', {'name': constraint.name}).first():
+        #Not AddConstraint, which would leave the constraint out of later create_all calls.
+        connection.execute('ALTER TABLE questions ADD CONSTRAINT {} CHECK ({})'.format(constraint.name, constraint.sqltext))
+    if payloads.is_enabled(connection):
+        payloads.install_triggers(connection)
+MIGRATIONS.append(add_question_payload)
+
+class SchemaMismatch(RuntimeError):
+    def __init__(self, expected, found):
+        super().__init__(
+            'Database schema {} does not match the application schema {}.  Run qa_migrate with the app ini file.'.format(found, expected)
+        )
+        self.expected = expected
+        self.found = found
+
+def fingerprint(metadata=Base.metadata, migrations=MIGRATIONS):
+    dialect = postgresql.dialect()
+    ddl = []
+    for table in sorted(metadata.tables.values(), key=lambda t: t.name):
+        ddl.append(str(CreateTable(table).compile(dialect=dialect)))
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            ddl.append(str(CreateIndex(index).compile(dialect=dialect)))
+        #CREATE TABLE only names enum types so their values are added separately.
+        for column in table.columns:
+            if isinstance(column.type, Enum):
+                ddl.append('{}.{}: {}'.format(table.name, column.name, ','.join(column.type.enums)))
+    ddl.extend(step.__name__ for step in migrations)
+    return hashlib.sha256('\n'.join(ddl).encode('utf-8')).hexdigest()
+
+def migrate(engine):
+    current = fingerprint()
+    with engine.begin() as connection:
+        connection.execute(select([func.pg_advisory_xact_lock(MIGRATION_LOCK_ID)]))
+        Base.metadata.create_all(connection)
+        schema_metadata.create_all(connection)
+        for step in MIGRATIONS:
+            step(connection)
+        connection.execute(schema_version.delete())
+        connection.execute(schema_version.insert().values(id=SCHEMA_VERSION_ID, fingerprint=current))
+    return current
+
+#The only schema work done at application startup, a single primary key lookup.
+#Raises SchemaMismatch if the database hasn't been migrated to the current models.
+def check(engine):
+    expected = fingerprint()
+    try:
+        found = engine.execute(
+            select([schema_version.c.fingerprint]).where(schema_version.c.id == SCHEMA_VERSION_ID)
+        ).scalar()
+    except ProgrammingError as _:
+        found = None
+    if found != expected:
+        raise SchemaMismatch(expected, found)
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        print('usage: {} <config_uri>'.format(argv[0]))
+        sys.exit(1)
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    engine = engine_from_settings(get_appsettings(config_uri))
+    print('Schema migrated to {}'.format(migrate(engine)))
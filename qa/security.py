@@ -1,6 +1,11 @@
+import collections
+import threading
+import time
+
 from pyramid.httpexceptions import HTTPFound, HTTPForbidden, HTTPUnauthorized
 
-from .models import Topic, QuestionSet, Question
+from .models import Topic, QuestionSet, Question, QuestionType
+from .sessions import SESSION_ID_KEY
 
 class Session:
     #Authentication
@@ -19,7 +24,11 @@ class Session:
     def logged_in(session):
         return Session.__LOGGED_IN in session
 
-    def logout(session):
+    #With server side sessions the stored session is deleted too, so its cookie can't be
+    #replayed, and clearing the session makes the next save issue a new session id.
+    def logout(session, store=None):
+        if store is not None and SESSION_ID_KEY in session:
+            store.delete(session[SESSION_ID_KEY])
         session.clear()
 
     def username(session):
@@ -28,6 +37,74 @@ class Session:
     def user_id(session):
         return session[Session.__USER_DB_ID]
 
+#Remembers for a short time that a user owns a resource so repeated requests on it, like
+#every step of answering a set, skip the ownership query.  Only decisions granting access
+#are cached since a resource created after a refusal would otherwise stay forbidden.
+#Deleting a user's resources or changing their ownership must call invalidate_user.
+class AuthorizationCache:
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        #Invalidating a user bumps their generation, which makes their older entries miss.
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def is_allowed(self, user_id, resource):
+        key = (user_id, resource)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, generation = entry
+                if expires > time.monotonic() and generation == self._generations.get(user_id, 0):
+                    self.hits += 1
+                    return True
+                del self._entries[key]
+            self.misses += 1
+            return False
+
+    def allow(self, user_id, resource):
+        key = (user_id, resource)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, self._generations.get(user_id, 0))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+authorization_cache = AuthorizationCache()
+
+#On a cache hit the resource is only loaded if the view uses it.  A resource deleted since
+#the decision was cached is forbidden like any other.
+def _set_lazy_resource(request, name, user_id, load):
+    def loader(request):
+        value = load(request.db)
+        if value is None:
+            authorization_cache.invalidate_user(user_id)
+            raise HTTPForbidden()
+        return value
+    request.set_property(loader, name, reify=True)
+
 def requires_logged_in(wrapped):
     def wrapper(context,request):
         if Session.logged_in(request.session):
@@ -58,8 +135,14 @@ def requires_topic_owner(wrapped):
         except KeyError as _:
             return HTTPForbidden()
 
+        resource = ('topic', str(topic_id))
+        if authorization_cache.is_allowed(user_id, resource):
+            _set_lazy_resource(request, 'topic', user_id, lambda db: db.query(Topic).get(topic_id))
+            return wrapped(context, request)
+
         topic = Topic.user_is_owner(user_id, topic_id, request.db)
         if topic:
+            authorization_cache.allow(user_id, resource)
             request.topic = topic
             return wrapped(context, request)
         else:
@@ -71,8 +154,14 @@ def requires_question_set_contributor(wrapped):
         user_id = Session.user_id(request.session)
         set_id = request.matchdict['question_set_id']
 
+        resource = ('question_set', str(set_id))
+        if authorization_cache.is_allowed(user_id, resource):
+            _set_lazy_resource(request, 'question_set', user_id, lambda db: db.query(QuestionSet).get(set_id))
+            return wrapped(context, request)
+
         question_set = QuestionSet.user_is_contributor(user_id, set_id, request.db)
         if question_set:
+            authorization_cache.allow(user_id, resource)
             request.question_set = question_set
             return wrapped(context, request)
         else:
@@ -88,8 +177,19 @@ def requires_question_contributor(wrapped):
         except KeyError as _:
             raise HTTPForbidden()
 
-        question = Question.user_is_contributor(user_id, set_id, q_id, request.db)
+        #Links to question routes may say the question's type so only its table is joined.
+        question_type = request.matchdict.get('type', request.GET.get('type'))
+        if question_type not in [t.name for t in QuestionType]:
+            question_type = None
+
+        resource = ('question', str(set_id), str(q_id))
+        if authorization_cache.is_allowed(user_id, resource):
+            _set_lazy_resource(request, 'question', user_id, lambda db: Question.get_question(set_id, q_id, db, question_type))
+            return wrapped(context, request)
+
+        question = Question.user_is_contributor(user_id, set_id, q_id, request.db, question_type)
         if question:
+            authorization_cache.allow(user_id, resource)
             request.question = question
             return wrapped(context, request)
         else:
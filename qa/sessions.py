@@ -0,0 +1,217 @@
+import binascii
+import collections
+import datetime
+import os
+import pickle
+import threading
+import time
+
+from pyramid.session import BaseCookieSessionFactory, UnencryptedCookieSessionFactoryConfig
+from pyramid.settings import asbool
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from webob.cookies import SignedSerializer
+
+from .models import SessionRecord
+
+#Server side sessions.  The cookie only carries a signed, random session id and the
+#session dictionary lives in a store, so it no longer has to be pickled into every
+#response or fit in a cookie.  The pyramid cookie session does all of the session
+#bookkeeping (flash, csrf, timeouts), only its serializer is replaced.
+
+#Key the session id is kept under while a request has the session loaded.  Clearing the
+#session (logging out) drops it, so the next save starts a new session id.
+SESSION_ID_KEY = '_sid_'
+
+def new_session_id():
+    return binascii.hexlify(os.urandom(32)).decode('ascii')
+
+class StoreSerializer:
+    def __init__(self, store):
+        self.store = store
+
+    def dumps(self, appstruct):
+        accessed, created, state = appstruct
+        state = dict(state)
+        session_id = state.pop(SESSION_ID_KEY, None) or new_session_id()
+        self.store.set(session_id, pickle.dumps((accessed, created, state), pickle.HIGHEST_PROTOCOL))
+        return session_id.encode('ascii')
+
+    #Raising ValueError makes the session factory start a new, empty session.
+    def loads(self, bstruct):
+        session_id = bstruct.decode('ascii')
+        data = self.store.get(session_id)
+        if data is None:
+            raise ValueError('Session has expired.')
+        accessed, created, state = pickle.loads(data)
+        state[SESSION_ID_KEY] = session_id
+        return accessed, created, state
+
+#An in process store for single node deployments.  Sessions are kept in least recently
+#used order so expired and evicted sessions are always at the front.
+class MemorySessionStore:
+    def __init__(self, max_entries=10000, timeout=1200):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, expires, now):
+        return self.timeout is not None and expires < now
+
+    def _remove(self, session_id):
+        _, data = self._sessions.pop(session_id)
+        self.bytes -= len(data)
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if self._expired(entry[0], now):
+                self._remove(session_id)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, session_id, data):
+        now = time.monotonic()
+        expires = now + self.timeout if self.timeout is not None else None
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+            self._sessions[session_id] = (expires, data)
+            self.bytes += len(data)
+            while self._sessions:
+                oldest_id, (oldest_expires, _) = next(iter(self._sessions.items()))
+                if self._expired(oldest_expires, now):
+                    self.expirations += 1
+                elif len(self._sessions) > self.max_entries:
+                    self.evictions += 1
+                else:
+                    break
+                self._remove(oldest_id)
+
+    def delete(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._sessions),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+#A store in the sessions table for deployments with several application nodes.  Uses
+#its own connections since sessions are saved after the request's session has closed.
+class PostgresSessionStore:
+    #Expired rows are deleted on every PURGE_INTERVAL'th save.
+    PURGE_INTERVAL = 1000
+
+    def __init__(self, engine, timeout=1200):
+        self.engine = engine
+        self.timeout = timeout if timeout is not None else 60 * 60 * 24 * 365
+        self._lock = threading.Lock()
+        self._saves = 0
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+
+    def get(self, session_id):
+        table = SessionRecord.__table__
+        data = self.engine.execute(
+            table.select().with_only_columns([table.c.data]).\
+                where(table.c.id == session_id).\
+                where(table.c.expires > func.now())
+        ).scalar()
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def set(self, session_id, data):
+        table = SessionRecord.__table__
+        expires = func.now() + datetime.timedelta(seconds=self.timeout)
+        statement = insert(table).values(id=session_id, data=data, expires=expires)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={'data': statement.excluded.data, 'expires': statement.excluded.expires},
+        )
+        with self.engine.begin() as connection:
+            connection.execute(statement)
+            with self._lock:
+                self._saves += 1
+                purge = self._saves % self.PURGE_INTERVAL == 0
+            if purge:
+                self.purge(connection)
+
+    def purge(self, connection):
+        table = SessionRecord.__table__
+        result = connection.execute(table.delete().where(table.c.expires <= func.now()))
+        with self._lock:
+            self.expirations += result.rowcount
+
+    def delete(self, session_id):
+        table = SessionRecord.__table__
+        self.engine.execute(table.delete().where(table.c.id == session_id))
+
+    def stats(self):
+        table = SessionRecord.__table__
+        entries, size = self.engine.execute(
+            table.select().with_only_columns([func.count(), func.coalesce(func.sum(func.length(table.c.data)), 0)])
+        ).first()
+        with self._lock:
+            return {
+                'entries': entries,
+                'bytes': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': 0,
+                'expirations': self.expirations,
+            }
+
+def ServerSideSessionFactory(store, secret, cookie_name='session', timeout=1200, secure=False, httponly=True):
+    serializer = SignedSerializer(secret, 'qa.session', serializer=StoreSerializer(store))
+    return BaseCookieSessionFactory(
+        serializer,
+        cookie_name=cookie_name,
+        timeout=timeout,
+        secure=secure,
+        httponly=httponly,
+    )
+
+#Returns the session factory and its store (None for cookie sessions) from the settings:
+#qa.session.backend (cookie, memory or postgres), qa.session.secret, qa.session.timeout,
+#qa.session.max_entries (memory only) and qa.session.secure.
+def session_factory_from_settings(settings, engine):
+    backend = settings.get('qa.session.backend', 'cookie')
+    secret = settings.get('qa.session.secret', 'secret')
+    timeout = int(settings.get('qa.session.timeout', 1200))
+    secure = asbool(settings.get('qa.session.secure', False))
+    if backend == 'cookie':
+        return UnencryptedCookieSessionFactoryConfig(secret, timeout=timeout, cookie_secure=secure), None
+    elif backend == 'memory':
+        store = MemorySessionStore(int(settings.get('qa.session.max_entries', 10000)), timeout)
+    elif backend == 'postgres':
+        store = PostgresSessionStore(engine, timeout)
+    else:
+        raise ValueError('Unknown session backend {}.'.format(backend))
+    return ServerSideSessionFactory(store, secret, timeout=timeout, secure=secure), store
@@ -0,0 +1,103 @@
+import argparse
+import sys
+
+from pyramid.paster import get_appsettings, setup_logging
+from sqlalchemy import text
+
+from .db import engine_from_settings
+from .models import Question, QuestionChoiceStats, QuestionStats, QuestionType
+
+#Per question and per choice answer counts for instructors.  The counters in question_stats
+#and question_choice_stats are added to in the same transaction that saves a batch of
+#attempts (qa.attempts), from a GROUP BY over only that batch's answers, so reading a set's
+#statistics costs a row per question however many attempts there have been.  rebuild
+#recomputes them from attempt_answers, for example after they were added to a database
+#that already had attempts.
+
+#Number of choices a multiple choice question has.
+CHOICES = 4
+
+#Statements are ordered by question id so concurrent batches lock counter rows in the same
+#order and can't deadlock.
+ADD_QUESTION_STATS = '''
+    INSERT INTO question_stats (question_id, answers, correct)
+    SELECT question_id, count(*), count(*) FILTER (WHERE correct)
+    FROM attempt_answers
+    WHERE {where} AND question_id IS NOT NULL
+    GROUP BY question_id
+    ORDER BY question_id
+    ON CONFLICT (question_id) DO UPDATE SET
+        answers = question_stats.answers + excluded.answers,
+        correct = question_stats.correct + excluded.correct
+'''
+
+ADD_CHOICE_STATS = '''
+    INSERT INTO question_choice_stats (question_id, choice, answers)
+    SELECT attempt_answers.question_id, attempt_answers.answer::integer, count(*)
+    FROM attempt_answers
+    JOIN multiple_choice_questions ON multiple_choice_questions.id = attempt_answers.question_id
+    WHERE {where}
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (question_id, choice) DO UPDATE SET
+        answers = question_choice_stats.answers + excluded.answers
+'''
+
+#Adds the answers of the given attempts to the counters.  Call in the transaction that
+#inserted the attempts.
+def add_attempts(connection, attempt_ids):
+    where = 'attempt_answers.attempt_id = ANY(:attempt_ids)'
+    for statement in (ADD_QUESTION_STATS, ADD_CHOICE_STATS):
+        connection.execute(text(statement.format(where=where)), {'attempt_ids': list(attempt_ids)})
+
+#Recomputes the counters of every question, or of one set's, from attempt_answers.  The
+#counter tables are locked first, which waits for batches being saved to commit and holds
+#off new ones until the rebuild commits, so no answers are counted twice or missed.
+def rebuild(engine, question_set_id=None):
+    tables = (QuestionStats.__tablename__, QuestionChoiceStats.__tablename__)
+    with engine.begin() as connection:
+        connection.execute('LOCK TABLE {}, {} IN EXCLUSIVE MODE'.format(*tables))
+        if question_set_id is None:
+            in_set = 'TRUE'
+        else:
+            in_set = '{}.question_id IN (SELECT id FROM questions WHERE question_set_id = :question_set_id)'
+        params = {'question_set_id': question_set_id}
+        for table in tables:
+            connection.execute(text('DELETE FROM {} WHERE {}'.format(table, in_set.format(table))), params)
+        for statement in (ADD_QUESTION_STATS, ADD_CHOICE_STATS):
+            connection.execute(text(statement.format(where=in_set.format('attempt_answers'))), params)
+
+#Returns a set's questions in order, each with its number of answers, correct answers
+#and, for multiple choice questions, a list of how many times each choice was picked.
+def get_set_stats(question_set_id, db):
+    rows = db.query(Question.id, Question.description, Question.type, QuestionStats.answers, QuestionStats.correct).\
+        outerjoin(QuestionStats, QuestionStats.question_id == Question.id).\
+        filter(Question.question_set_id == question_set_id).\
+        order_by(Question.question_order).all()
+    choices = db.query(QuestionChoiceStats.question_id, QuestionChoiceStats.choice, QuestionChoiceStats.answers).\
+        join(Question, Question.id == QuestionChoiceStats.question_id).\
+        filter(Question.question_set_id == question_set_id)
+    choice_counts = {question_id: [0] * CHOICES for question_id, _, question_type, _, _ in rows if question_type == QuestionType.mcq}
+    for question_id, choice, answers in choices:
+        if question_id in choice_counts and 0 <= choice < CHOICES:
+            choice_counts[question_id][choice] = answers
+    return [
+        {
+            'question_id': question_id,
+            'description': description,
+            'type': question_type.name,
+            'answers': answers or 0,
+            'correct': correct or 0,
+            'choices': choice_counts.get(question_id),
+        }
+        for question_id, description, question_type, answers, correct in rows
+    ]
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description='Recompute the per question answer counters.')
+    parser.add_argument('config_uri')
+    parser.add_argument('--set', type=int, dest='question_set_id', help='only this question set')
+    args = parser.parse_args(argv[1:])
+    setup_logging(args.config_uri)
+    engine = engine_from_settings(get_appsettings(args.config_uri))
+    rebuild(engine, args.question_set_id)
@@ -0,0 +1,134 @@
+from unittest import mock
+
+from base import QuestionTestCase
+
+class AttemptWriterTests(QuestionTestCase):
+    def setUp(self):
+        from qa.models import Question, QuestionType
+
+        super().setUp()
+        Question.create(self.question_set.id, {'type': QuestionType.tf.name, 'true_false_questions': [self.tf]}, self.db)
+        self.question_id = self.question_set.get_questions(self.db)[0].id
+
+    def writer(self, **kw):
+        from qa.attempts import AttemptWriter
+
+        writer = AttemptWriter(self.sqlalchemy_engine, **kw)
+        self.addCleanup(writer.close)
+        return writer
+
+    def record(self, question_set_id=None, correct=True):
+        from qa.attempts import AttemptRecord
+
+        return AttemptRecord(self.user.id, question_set_id or self.question_set.id, 1, [(self.question_id, 1.0, None, correct)])
+
+    def attempts(self):
+        from qa.models import Attempt
+
+        self.db.expire_all()
+        return self.db.query(Attempt).order_by(Attempt.id).all()
+
+    def test_submitted_attempts_are_written(self):
+        writer = self.writer(batch_size=10)
+        for i in range(25):
+            writer.submit(self.record(correct=i % 2 == 0))
+        writer.flush()
+
+        attempts = self.attempts()
+        self.assertEqual(len(attempts), 25)
+        self.assertEqual([attempt.score for attempt in attempts[:3]], [1, 0, 1])
+        answer = attempts[0].answers[0]
+        self.assertEqual((answer.question_id, answer.answer, answer.correct), (self.question_id, 1.0, True))
+        stats = writer.stats()
+        self.assertEqual((stats['written'], stats['queued'], stats['failures']), (25, 0, 0))
+        self.assertLessEqual(stats['batches'], 25)
+
+    #With the queue full, the attempt is written by the caller instead of being dropped.
+    def test_full_queue_writes_in_caller(self):
+        writer = self.writer(max_queued=1, put_timeout=0)
+        with mock.patch.object(writer, '_start'):
+            writer.submit(self.record())
+            writer.submit(self.record())
+        self.assertEqual(len(self.attempts()), 1)
+        self.assertEqual(writer.stats()['overflows'], 1)
+
+        #The queued one is written once the thread runs.
+        writer.submit(self.record())
+        writer.flush()
+        self.assertEqual(len(self.attempts()), 3)
+
+    #Only the attempt the database rejects is lost from its batch.
+    def test_failed_batch_is_written_one_at_a_time(self):
+        writer = self.writer()
+        writer.write([self.record(), self.record(question_set_id=1000), self.record()])
+        self.assertEqual(len(self.attempts()), 2)
+        self.assertEqual((writer.stats()['written'], writer.stats()['failures']), (2, 1))
+
+    #A question deleted while its attempt waits in the queue doesn't lose the attempt.
+    def test_question_deleted_before_write(self):
+        from qa.models import Question
+
+        record = self.record()
+        self.db.query(Question).filter(Question.id == self.question_id).delete()
+        self.db.commit()
+        writer = self.writer()
+        writer.write([record, self.record()])
+        attempts = self.attempts()
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual([answer.question_id for answer in attempts[0].answers], [None])
+        self.assertEqual((attempts[0].score, writer.stats()['failures']), (1, 0))
+
+    def test_close_writes_queued_attempts(self):
+        writer = self.writer()
+        for _ in range(5):
+            writer.submit(self.record())
+        writer.close()
+        self.assertFalse(writer._thread.is_alive())
+        self.assertEqual(len(self.attempts()), 5)
+        writer.submit(self.record())
+        self.assertEqual(len(self.attempts()), 6, 'Written straight away once closed.')
+
+    #An attempt submitted while the writer closes is still written.
+    def test_close_waits_for_submit(self):
+        import threading
+
+        writer = self.writer()
+        writer.submit(self.record())
+        writer.flush()
+        queuing = threading.Event()
+        put = writer._queue.put
+
+        def slow_put(record, **kw):
+            if record is not None:
+                queuing.set()
+                threading.Event().wait(0.2)
+            put(record, **kw)
+
+        with mock.patch.object(writer._queue, 'put', slow_put):
+            thread = threading.Thread(target=writer.submit, args=(self.record(),))
+            thread.start()
+            queuing.wait()
+            writer.close()
+            thread.join()
+        self.assertEqual(len(self.attempts()), 2)
+        self.assertEqual(writer.stats()['queued'], 0)
+
+    def test_report_saves_attempt(self):
+        from pyramid import testing
+        from qa.views import QuestionSetState, QuestionViews, Session
+
+        request = testing.DummyRequest()
+        request.db = self.db
+        request.username = 'user'
+        request.registry.attempt_writer = self.writer()
+        Session.login(request.session, self.user)
+        state = QuestionSetState(self.question_set.get_questions(self.db), self.question_set.id, 'Desc', question_set_version=1)
+        state.record_answer({'answer': False})
+        state.get_next_question(self.db)
+        request.session[Session.QUESTION_STATE] = state
+
+        template_vars = QuestionViews(request).report()
+        self.assertEqual(template_vars['score'], 1)
+        request.registry.attempt_writer.flush()
+        attempt, = self.attempts()
+        self.assertEqual((attempt.user_id, attempt.question_set_id, attempt.score, attempt.question_count), (self.user.id, self.question_set.id, 1, 1))
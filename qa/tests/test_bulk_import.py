@@ -0,0 +1,190 @@
+import io
+import json
+import unittest
+from unittest import mock
+
+from base import QuestionTestCase
+
+def jsonl(*rows):
+    return io.StringIO(''.join(row if isinstance(row, str) else json.dumps(row) + '\n' for row in rows))
+
+class ReaderTests(unittest.TestCase):
+    def test_read_jsonl(self):
+        import colander
+        from qa.bulk_import import read_jsonl
+
+        rows = list(read_jsonl(jsonl({'description': 'a', 'units': None}, '\n', 'not json\n', '[1]\n')))
+        self.assertEqual(rows[0], (1, {'description': 'a', 'units': colander.null}))
+        self.assertEqual([line_number for line_number, _ in rows], [1, 3, 4], 'Blank lines are skipped.')
+        self.assertIsInstance(rows[1][1], ValueError)
+        self.assertIsInstance(rows[2][1], ValueError)
+
+    def test_read_csv(self):
+        import colander
+        from qa.bulk_import import read_csv
+
+        rows = list(read_csv(io.StringIO('description,units\r\na,\r\n"b, c",m\r\n')))
+        self.assertEqual(rows, [
+            (2, {'description': 'a', 'units': colander.null}),
+            (3, {'description': 'b, c', 'units': 'm'}),
+        ])
+
+    def test_read_upload_format(self):
+        from qa.bulk_import import read_upload
+
+        self.assertEqual(len(list(read_upload(io.BytesIO(b'{"a": 1}\n'), 'questions.JSONL'))), 1)
+        self.assertEqual(len(list(read_upload(io.BytesIO(b'a\n1\n'), 'questions.txt', 'csv'))), 1)
+        self.assertRaises(ValueError, read_upload, io.BytesIO(b''), 'questions.txt')
+
+class ImportTests(QuestionTestCase):
+    def import_questions(self, question_type, rows, **kw):
+        from qa.bulk_import import import_questions
+
+        return import_questions(self.question_set.id, question_type, rows, self.db, **kw)
+
+    def mcq_row(self, description, **values):
+        row = dict(self.mcq, description=description)
+        row.update(values)
+        return row
+
+    #Bad lines are reported and the rest of the file is still imported, in file order.
+    def test_errors_are_reported_by_line(self):
+        from qa.bulk_import import read_jsonl
+        from qa.models import Question, QuestionSet
+
+        self.db.add(Question(question_set_id=self.question_set.id, description='existing', question_order=0))
+        self.db.flush()
+        QuestionSet.reset_next_question_order(self.question_set.id, self.db)
+        self.db.commit()
+        rows = jsonl(
+            self.mcq_row('a'),
+            self.mcq_row('2', correct_answer=7),
+            self.mcq_row('3', choice_two='One'),
+            self.mcq_row(' A '),
+            self.mcq_row('existing'),
+            'bad\n',
+            self.mcq_row('4'),
+        )
+        result = self.import_questions('mcq', read_jsonl(rows), chunk_size=2)
+
+        self.assertEqual(result.imported, 2)
+        self.assertEqual([line_number for line_number, _ in sorted(result.errors)], [2, 3, 4, 5, 6])
+        self.assertIn('correct_answer', dict(result.errors)[2])
+        self.assertEqual(dict(result.errors)[3], 'All answer choices must be unique.')
+        questions = self.question_set.get_questions(self.db)
+        self.assertEqual([(q.description, q.question_order) for q in questions], [('existing', 0), ('a', Question.ORDER_GAP), ('4', 2 * Question.ORDER_GAP)])
+        self.assertEqual(questions[1].choice_one, 'One')
+        self.assertEqual(self.question_set.version, 1)
+
+    #Descriptions are compared as the database compares them, so only surrounding spaces are ignored.
+    def test_duplicates_within_file(self):
+        from qa.bulk_import import read_jsonl
+
+        rows = jsonl(self.mcq_row('a'), self.mcq_row('A '), self.mcq_row('a\n'), self.mcq_row('\ta'))
+        result = self.import_questions('mcq', read_jsonl(rows))
+        self.assertEqual(result.imported, 3)
+        self.assertEqual([line_number for line_number, _ in result.errors], [2])
+
+    def test_csv_math_import(self):
+        from qa.bulk_import import read_csv
+        from qa.models import Accuracy, MathQuestion
+
+        rows = read_csv(io.StringIO(
+            'description,correct_answer,units,units_given,accuracy,accuracy_degree\n'
+            'a,1.5,m,1,uncertainty,0.1\n'
+            'b,2,,,exact,\n'
+            'c,2,m,,exact,\n'
+            'd,x,,,exact,\n'
+        ))
+        result = self.import_questions('math', rows)
+
+        self.assertEqual(result.imported, 2)
+        self.assertEqual([line_number for line_number, _ in result.errors], [4, 5])
+        a, b = self.db.query(MathQuestion).order_by(MathQuestion.question_order).all()
+        self.assertEqual((a.correct_answer, a.units, a.units_given, a.accuracy, a.accuracy_degree), (1.5, 'm', True, Accuracy.uncertainty, 0.1))
+        self.assertEqual((b.units, b.accuracy, b.accuracy_degree), (None, Accuracy.exact, None))
+
+    #A chunk costs a description check, a savepoint, reserving its order numbers and one
+    #insert per table, however many rows it has.
+    def test_statements_per_chunk(self):
+        from qa.bulk_import import import_questions, read_jsonl
+        from qa.db import count_queries
+        from qa.models import TrueFalseQuestion
+
+        question_set_id = self.question_set.id
+        rows = read_jsonl(jsonl(*[{'description': str(i), 'correct_answer': i % 2 == 0} for i in range(250)]))
+        with count_queries(self.db) as counter:
+            result = import_questions(question_set_id, 'tf', rows, self.db, chunk_size=100)
+        self.assertEqual(result.imported, 250)
+        #3 chunks of 6 and the version bump.
+        self.assertEqual(counter.count, 19)
+        self.assertEqual(self.db.query(TrueFalseQuestion).filter(TrueFalseQuestion.correct_answer == True).count(), 125)
+
+    #Rows the checks let through but the database rejects only fail their own line.
+    def test_failed_chunk_is_retried_row_by_row(self):
+        from qa.bulk_import import read_jsonl
+        from qa.models import Question, QuestionSet
+
+        self.db.add(Question(question_set_id=self.question_set.id, description='2', question_order=0))
+        self.db.flush()
+        QuestionSet.reset_next_question_order(self.question_set.id, self.db)
+        self.db.commit()
+        rows = read_jsonl(jsonl(self.mcq_row('1'), self.mcq_row('2'), self.mcq_row('3')))
+        with mock.patch('qa.models.Question.existing_descriptions', return_value=set()):
+            result = self.import_questions('mcq', rows)
+
+        self.assertEqual(result.imported, 2)
+        self.assertEqual(result.errors, [(2, 'Questions must be unique per set.')])
+        self.assertEqual(len(self.question_set.get_questions(self.db)), 3)
+
+    #Values too long for their column are reported by validation and, should one get past it,
+    #by the database.
+    def test_units_too_long(self):
+        from qa.bulk_import import ImportResult, insert_chunk, read_jsonl
+        from qa.models import Accuracy, MathQuestion
+
+        row = {'description': 'a', 'correct_answer': 1, 'units': 'u' * 11, 'units_given': 1, 'accuracy': 'exact'}
+        result = self.import_questions('math', read_jsonl(jsonl(row, dict(row, description='b', units='m'))))
+        self.assertEqual(result.imported, 1)
+        self.assertEqual([line_number for line_number, _ in result.errors], [1])
+
+        appstruct = {'description': 'c', 'correct_answer': 1.0, 'units': 'u' * 11, 'units_given': True, 'accuracy': Accuracy.exact, 'accuracy_degree': None}
+        result = ImportResult()
+        insert_chunk(MathQuestion, self.question_set.id, [(1, appstruct)], result, self.db)
+        self.assertEqual(result.errors, [(1, 'A value is too long.')])
+        self.assertEqual(self.db.query(MathQuestion).count(), 1)
+
+    def test_unknown_question_type(self):
+        self.assertRaises(ValueError, self.import_questions, 'question', [])
+        self.assertRaises(ValueError, self.import_questions, 'nonsense', [])
+
+class StubUpload:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.file = io.BytesIO(data)
+
+class ImportViewTests(QuestionTestCase):
+    def request(self, **post):
+        from pyramid import testing
+
+        request = testing.DummyRequest(post=post)
+        request.db = self.db
+        request.question_set = self.question_set
+        return request
+
+    def test_import_view(self):
+        from pyramid.httpexceptions import HTTPClientError
+        from qa.views import QuestionSetViews
+
+        data = 'description,correct_answer\na,true\nb,maybe\n'.encode('utf-8')
+        request = self.request(type='tf', file=StubUpload('tf.csv', data))
+        request.POST['csrf_token'] = request.session.get_csrf_token()
+        response = QuestionSetViews(request).import_questions()
+        self.assertEqual(response['imported'], 1)
+        self.assertEqual([error['line'] for error in response['errors']], [3])
+
+        request = self.request(type='tf', file=StubUpload('tf.csv', data), csrf_token='wrong')
+        self.assertIsInstance(QuestionSetViews(request).import_questions(), HTTPClientError)
+        request = self.request(type='tf', file=StubUpload('tf.xml', data))
+        request.POST['csrf_token'] = request.session.get_csrf_token()
+        self.assertIsInstance(QuestionSetViews(request).import_questions(), HTTPClientError)
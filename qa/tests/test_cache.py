@@ -0,0 +1,110 @@
+import unittest
+
+from base import QuestionTestCase
+
+class StubSnapshot:
+    def __init__(self, question_set_id, version, size):
+        self.question_set_id = question_set_id
+        self.version = version
+        self.size = size
+
+class SnapshotCacheTests(unittest.TestCase):
+    def test_versions(self):
+        from qa.cache import SnapshotCache
+
+        cache = SnapshotCache()
+        cache.put(StubSnapshot(1, 1, 10))
+        self.assertTrue(cache.get(1, 1))
+        self.assertIsNone(cache.get(1, 0), 'Older version should miss.')
+        self.assertTrue(cache.get(1, 1), 'An older request should not evict the newer version.')
+        cache.put(StubSnapshot(1, 0, 10))
+        self.assertTrue(cache.get(1, 1), 'An older version should not replace a newer one.')
+        self.assertIsNone(cache.get(1, 2))
+        self.assertEqual(cache.stats()['entries'], 0, 'A newer version should drop the old snapshot.')
+        self.assertEqual(cache.stats()['hits'], 3)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_size_limit(self):
+        from qa.cache import SnapshotCache
+
+        cache = SnapshotCache(max_bytes=25)
+        cache.put(StubSnapshot(1, 0, 10))
+        cache.put(StubSnapshot(2, 0, 10))
+        cache.get(1, 0)
+        cache.put(StubSnapshot(3, 0, 10))
+        self.assertTrue(cache.get(1, 0))
+        self.assertIsNone(cache.get(2, 0), 'Least recently used snapshot should be evicted.')
+        self.assertTrue(cache.get(3, 0))
+        self.assertEqual(cache.stats()['bytes'], 20)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        cache.put(StubSnapshot(4, 0, 30))
+        self.assertIsNone(cache.get(4, 0), 'Snapshots bigger than the cache are not kept.')
+
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1, 0))
+
+class SnapshotTests(QuestionTestCase):
+    def test_get_snapshot(self):
+        from qa.cache import SnapshotCache, get_snapshot
+        from qa.models import Question, QuestionType
+
+        Question.create(self.question_set.id, {'type': QuestionType.mcq.name, 'multiple_choice_questions': [self.mcq]}, self.db)
+        cache = SnapshotCache()
+        snapshot = get_snapshot(self.question_set, self.db, cache)
+        self.assertEqual([q.description for q in snapshot.questions], ['Sample'])
+        self.assertTrue(snapshot.is_correct(0, {'answer': 1}))
+        self.assertFalse(snapshot.is_correct(0, {'answer': 2}))
+        self.assertIs(get_snapshot(self.question_set, self.db, cache), snapshot)
+
+    #Questions without a payload, here because payload storage is off, are still complete in
+    #a snapshot read with payload loading.
+    def test_payload_snapshot_without_payloads(self):
+        from qa.cache import SnapshotCache, get_snapshot
+        from qa.models import Question, QuestionLoading, QuestionType
+
+        Question.create(self.question_set.id, {'type': QuestionType.mcq.name, 'multiple_choice_questions': [self.mcq]}, self.db)
+        math_question = {'description': 'Math', 'correct_answer': 10, 'accuracy': self.mq['accuracy']}
+        Question.create(self.question_set.id, {'type': QuestionType.math.name, 'math_questions': [math_question]}, self.db)
+        self.assertEqual(self.db.query(Question).filter(Question.payload != None).count(), 0)
+        self.db.expire_all()
+        snapshot = get_snapshot(self.question_set, self.db, SnapshotCache(loading=QuestionLoading.payload))
+        self.assertTrue(snapshot.is_correct(0, {'answer': 1}))
+        self.assertTrue(snapshot.is_correct(1, {'answer': 10}))
+        self.assertEqual(snapshot.questions[1].correct_answer, 10)
+
+    def test_changes_bump_version(self):
+        from qa.models import Question, QuestionType
+
+        def version():
+            self.db.refresh(self.question_set)
+            return self.question_set.version
+
+        Question.create(self.question_set.id, {'type': QuestionType.tf.name, 'true_false_questions': [self.tf, dict(self.tf, description='Other')]}, self.db)
+        self.assertEqual(version(), 1)
+        question, other = self.question_set.get_questions(self.db)
+        question.edit({'description': 'Edited'}, self.db)
+        self.assertEqual(version(), 2)
+        question_ids = [question.id, other.id]
+        self.question_set.reorder(question_ids, self.db)
+        self.assertEqual(version(), 2, 'Nothing moved.')
+        self.question_set.reorder(question_ids[::-1], self.db)
+        self.assertEqual(version(), 3)
+
+class AnswerKeyTests(unittest.TestCase):
+    def test_math_answer_key(self):
+        from qa.models import Accuracy, MathQuestion
+
+        question = MathQuestion(correct_answer=-10, accuracy=Accuracy.percentage, accuracy_degree=10, units='M', units_given=False)
+        key = question.answer_key()
+        self.assertEqual(key[2], 'm')
+        self.assertTrue(question.is_correct(key, {'answer': -10.5, 'units': 'm'}))
+        self.assertFalse(question.is_correct(key, {'answer': -10.5, 'units': 's'}))
+        self.assertFalse(question.is_correct(key, {'answer': -12, 'units': 'm'}))
+
+    def test_true_false_answer_key(self):
+        from qa.models import TrueFalseQuestion
+
+        question = TrueFalseQuestion(correct_answer=False)
+        self.assertTrue(question.is_correct(question.answer_key(), {'answer': 0}))
+        self.assertFalse(question.is_correct(question.answer_key(), {'answer': 1}))
@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+from unittest import mock
+
+from base import QuestionTestCase
+
+class ExportTests(QuestionTestCase):
+    def setUp(self):
+        from qa.models import Accuracy, MathQuestion, MultipleChoiceQuestion, QuestionSet, TrueFalseQuestion
+
+        super().setUp()
+        self.other_set = QuestionSet(description='Other', topic_id=self.topic.id)
+        self.db.add(self.other_set)
+        self.db.flush()
+        self.db.add_all([
+            MultipleChoiceQuestion(question_set_id=self.question_set.id, question_order=0, **self.mcq),
+            TrueFalseQuestion(question_set_id=self.question_set.id, question_order=1, description='tf', correct_answer=True),
+            MathQuestion(
+                question_set_id=self.other_set.id, question_order=0, description='math', correct_answer=2.5,
+                units='m', units_given=False, accuracy=Accuracy.percentage, accuracy_degree=5,
+            ),
+        ])
+        self.db.flush()
+        QuestionSet.reset_next_question_order(self.question_set.id, self.db)
+        self.db.commit()
+
+    def export(self, file_format, **filters):
+        from qa.export import export
+
+        return b''.join(export(self.Session, file_format, **filters)).decode('utf-8')
+
+    def test_jsonl(self):
+        lines = [json.loads(line) for line in self.export('jsonl', topic_id=self.topic.id).splitlines()]
+        self.assertEqual([line['description'] for line in lines], ['Sample', 'tf', 'math'])
+        self.assertEqual(lines[0], dict(self.mcq, topic='Name', question_set='Desc', type='mcq', question_order=0))
+        self.assertEqual(lines[1]['correct_answer'], True)
+        self.assertEqual(lines[2]['accuracy'], 'percentage')
+        self.assertNotIn('choice_one', lines[2], 'Only the question type\'s own fields are exported.')
+
+        lines = self.export('jsonl', question_set_id=self.other_set.id).splitlines()
+        self.assertEqual([json.loads(line)['description'] for line in lines], ['math'])
+
+    def test_csv(self):
+        from qa.export import export_fields
+
+        rows = list(csv.DictReader(io.StringIO(self.export('csv', topic_id=self.topic.id))))
+        self.assertEqual(list(rows[0]), export_fields())
+        self.assertEqual(export_fields().count('correct_answer'), 1)
+        self.assertEqual((rows[0]['choice_two'], rows[0]['correct_answer'], rows[0]['units']), ('Two', '1', ''))
+        self.assertEqual((rows[2]['correct_answer'], rows[2]['units_given']), ('2.5', 'False'))
+
+    #An exported set can be imported into another set.
+    def test_round_trip(self):
+        from qa.bulk_import import import_questions, read_csv
+        from qa.models import MathQuestion
+
+        data = self.export('csv', question_set_id=self.other_set.id)
+        result = import_questions(self.question_set.id, 'math', read_csv(io.StringIO(data)), self.db)
+        self.assertEqual((result.imported, result.errors), (1, []))
+        copy = self.db.query(MathQuestion).filter(MathQuestion.question_set_id == self.question_set.id).one()
+        self.assertEqual((copy.correct_answer, copy.units, copy.accuracy_degree), (2.5, 'm', 5))
+
+    #Rows come from a server side cursor and are sent a batch at a time.
+    def test_streams_in_batches(self):
+        from qa.export import export, export_query
+
+        self.assertTrue(export_query(self.db, topic_id=self.topic.id)._execution_options.get('stream_results'))
+        with mock.patch('qa.export.BATCH_SIZE', 2):
+            chunks = list(export(self.Session, 'jsonl', topic_id=self.topic.id))
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [2, 1])
+
+    def test_unknown_format(self):
+        from qa.export import export
+
+        self.assertRaises(ValueError, export, self.Session, 'xml', topic_id=self.topic.id)
+
+    def test_export_view(self):
+        from pyramid import testing
+        from qa.views import TopicViews
+
+        self.config.registry.db_sessionmaker = self.Session
+        request = testing.DummyRequest(params={'format': 'csv'})
+        request.topic = self.topic
+        response = TopicViews(request).export_topic()
+        self.assertEqual(response.content_type, 'text/csv')
+        self.assertIn('attachment', response.content_disposition)
+        self.assertEqual(len(list(csv.DictReader(io.StringIO(response.body.decode('utf-8'))))), 3)
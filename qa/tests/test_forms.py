@@ -46,3 +46,17 @@ class ReorderResourceFormTests(unittest.TestCase):
         del(post_data[inputs[1]])
         del(post_data[inputs[2]])
         self.assertRaises(ValueError, self.form.validate, post_data)
+
+    #Without ids any non empty order without duplicates is accepted.
+    def test_validate_without_ids(self):
+        from qa.forms import ReorderResourceForm
+
+        request = testing.DummyRequest()
+        form = ReorderResourceForm(request, None)
+        inputs = [ReorderResourceForm.name_template.format(i) for i in range(0,2)]
+        post_data = {ReorderResourceForm.csrf_token: form.csrf_token}
+        self.assertRaises(ValueError, form.validate, post_data)
+        post_data.update({inputs[0]: 7, inputs[1]: 3})
+        self.assertEqual(form.validate(post_data), [7, 3])
+        post_data[inputs[1]] = 7
+        self.assertRaises(ValueError, form.validate, post_data)
@@ -0,0 +1,69 @@
+import random
+import unittest
+
+def questions():
+    from qa.models import Accuracy, MathQuestion, MultipleChoiceQuestion, TrueFalseQuestion
+
+    return [
+        MultipleChoiceQuestion(id=1, correct_answer=2),
+        TrueFalseQuestion(id=2, correct_answer=True),
+        TrueFalseQuestion(id=3, correct_answer=False),
+        MathQuestion(id=4, correct_answer=10, accuracy=Accuracy.exact),
+        MathQuestion(id=5, correct_answer=-10, accuracy=Accuracy.percentage, accuracy_degree=10, units='m', units_given=False),
+        MathQuestion(id=6, correct_answer=3, accuracy=Accuracy.uncertainty, accuracy_degree=0.5, units='kg', units_given=True),
+    ]
+
+class AnswerKeyTests(unittest.TestCase):
+    def test_grade(self):
+        from qa.grading import AnswerKey
+
+        key = AnswerKey(questions())
+        self.assertEqual(key.unit_names, ['kg', 'm'])
+        grades = key.grade(
+            [
+                [2, 1, 0, 10, -9, 3.5],
+                [1, 0, 1, 10.1, -11.5, 2],
+                [float('nan')] * 6,
+            ],
+            key.encode_units([
+                [None, None, None, None, 'M', None],
+                [None, None, None, None, 'm', None],
+                [None] * 6,
+            ]),
+        )
+        self.assertEqual(grades.correct.tolist(), [[True] * 6, [False] * 6, [False] * 6])
+        self.assertEqual(grades.scores.tolist(), [6, 0, 0])
+        self.assertEqual(grades.question_scores.tolist(), [1] * 6)
+        self.assertEqual(grades.question_rates().tolist(), [1 / 3] * 6)
+        self.assertEqual(key.grade([[2, 1, 0, 10, -9, 3]], key.encode_units([[None, None, None, None, 's', None]])).scores.tolist(), [5])
+        self.assertEqual(key.grade([[2, 1, 0, 10, -9, 3]], key.encode_units([[None, None, None, 'm', 'kg', None]])).scores.tolist(), [4])
+        self.assertRaises(ValueError, key.grade, [[1, 2]])
+
+    #Batch grading agrees with grading each answer with is_correct.
+    def test_matches_is_correct(self):
+        from qa.grading import AnswerKey
+
+        rng = random.Random(3)
+        set_questions = questions()
+        submissions = []
+        for _ in range(200):
+            submissions.append([
+                {'answer': rng.randrange(4)},
+                {'answer': rng.randrange(2)},
+                {'answer': rng.randrange(2)},
+                {'answer': rng.choice([10, 10.0001, 9])},
+                {'answer': rng.uniform(-12, -8), 'units': rng.choice(['m', 'M', 'cm'])},
+                None if rng.random() < 0.1 else {'answer': rng.uniform(2, 4)},
+            ])
+        key = AnswerKey(set_questions)
+        grades = key.grade(*key.answer_matrix(submissions))
+        expected = [
+            [answer is not None and question.is_correct(question.answer_key(), answer) for question, answer in zip(set_questions, answers)]
+            for answers in submissions
+        ]
+        self.assertEqual(grades.correct.tolist(), expected)
+
+    def test_answer_matrix_checks_length(self):
+        from qa.grading import AnswerKey
+
+        self.assertRaises(ValueError, AnswerKey(questions()).answer_matrix, [[{'answer': 1}]])
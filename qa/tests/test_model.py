@@ -254,25 +254,108 @@ class QuestionSetTests(DbTestCase):
             self.fail('Unique constraint unique_order_per_set was not deferred.')
         self.assertTrue(question1.question_order == 1 and question2.question_order == 0)
 
-    #Test that the order of the last question in the set is properly obtained. This
-    #number is used in question creation.  When no questions are in the set, it should
-    #return -1.
-    def test_last_question_order(self):
+    #Only the questions that moved are written, in one statement, and an unchanged order
+    #writes nothing.
+    def test_reorder_writes_only_moved_questions(self):
+        from qa.db import count_queries
         from qa.models import QuestionSet
         from qa.models import Question
-        from qa.models import QuestionType
 
-        values = {'topic_id':self.topic.id, 'description':'Question Set'}
-        question_set = QuestionSet(**values)
+        question_set = QuestionSet(topic_id=self.topic.id, description='Question Set')
         self.db.add(question_set)
+        self.db.flush()
+        questions = [Question(question_set_id=question_set.id, description=str(i), question_order=i) for i in range(6)]
+        self.db.add_all(questions)
         self.db.commit()
-        #test default value if no quetsions in set
-        self.assertEqual(-1, QuestionSet.last_question_order(question_set.id, self.db))
+        question_set_id = question_set.id
+        ids = [q.id for q in questions]
+
+        with count_queries(self.db) as counter:
+            self.assertEqual(question_set.reorder(ids, self.db), 0)
+        #Only the locking read.
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(question_set.version, 0)
+
+        #Move the last question up to second, which shifts the four after it.
+        new_order = ids[:1] + ids[-1:] + ids[1:-1]
+        with count_queries(self.db) as counter:
+            self.assertEqual(question_set.reorder(new_order, self.db), 5)
+        #The locking read, the update and the version bump.
+        self.assertEqual(counter.count, 3)
+        orders = dict(self.db.query(Question.id, Question.question_order).filter(Question.question_set_id == question_set_id))
+        self.assertEqual([orders[i] for i in new_order], list(range(6)))
+
+    #Moves write only the moved question until a gap runs out, when the set is rebalanced.
+    def test_move(self):
+        from qa.db import count_queries
+        from qa.models import QuestionSet
+        from qa.models import Question
 
-        question1 = Question(id=1, question_set_id=question_set.id, description='test1', question_order=0)
-        self.db.add(question1)
+        question_set = QuestionSet(topic_id=self.topic.id, description='Question Set')
+        self.db.add(question_set)
+        self.db.flush()
+        questions = [Question(question_set_id=question_set.id, description=str(i), question_order=i * Question.ORDER_GAP) for i in range(4)]
+        self.db.add_all(questions)
+        self.db.flush()
+        QuestionSet.reset_next_question_order(question_set.id, self.db)
         self.db.commit()
-        self.assertEqual(0, QuestionSet.last_question_order(question_set.id, self.db))
+        question_set_id = question_set.id
+        a, b, c, d = [q.id for q in questions]
+        def order():
+            return [question_id for question_id, in self.db.query(Question.id).filter(Question.question_set_id == question_set_id).order_by(Question.question_order)]
+
+        with count_queries(self.db) as counter:
+            self.assertTrue(question_set.move(d, b, False, self.db))
+        #The set lock, both questions' orders, the neighbour, the update and the version bump.
+        self.assertEqual(counter.count, 5)
+        self.assertEqual(order(), [a, d, b, c])
+        self.assertEqual(question_set.version, 1)
+        self.assertFalse(question_set.move(d, a, True, self.db), 'Already after a.')
+        self.assertEqual(question_set.version, 1)
+        self.assertTrue(question_set.move(a, c, True, self.db))
+        self.assertTrue(question_set.move(c, d, False, self.db))
+        self.assertEqual(order(), [c, d, b, a])
+
+        #Moving questions back and forth into the same place halves the gap each time.
+        from unittest import mock
+        with mock.patch.object(QuestionSet, 'rebalance', wraps=QuestionSet.rebalance) as rebalance:
+            for i in range(12):
+                self.assertTrue(question_set.move(*((a, b, False) if i % 2 == 0 else (b, a, False)), db=self.db))
+        self.assertEqual(rebalance.call_count, 1)
+        self.assertEqual(order(), [c, d, b, a])
+
+        self.assertRaises(ValueError, question_set.move, a, a, True, self.db)
+        self.assertRaises(ValueError, question_set.move, a, -1, True, self.db)
+
+    def test_reorder_rejects_questions_from_other_sets(self):
+        from qa.models import QuestionSet
+        from qa.models import Question
+
+        question_sets = [QuestionSet(topic_id=self.topic.id, description=str(i)) for i in range(2)]
+        self.db.add_all(question_sets)
+        self.db.flush()
+        questions = [Question(question_set_id=question_set.id, description='test', question_order=0) for question_set in question_sets]
+        self.db.add_all(questions)
+        self.db.commit()
+        self.assertRaises(ValueError, question_sets[0].reorder, [questions[0].id, questions[1].id], self.db)
+        self.assertRaises(ValueError, question_sets[0].reorder, [questions[0].id, questions[0].id], self.db)
+
+    #The first sets of several topics are loaded together, ordered by (description, id).
+    def test_get_first_sets(self):
+        from qa.models import QuestionSet, Topic
+
+        topic = Topic(user_id=self.user.id, title='Other')
+        self.db.add(topic)
+        self.db.flush()
+        question_sets = [QuestionSet(topic_id=self.topic.id, description=d) for d in 'dcba']
+        self.db.add_all(question_sets)
+        self.db.commit()
+
+        first_sets = QuestionSet.get_first_sets([self.topic.id, topic.id], 3, self.db)
+        self.assertEqual([s.description for s in first_sets[self.topic.id]], ['a', 'b', 'c'])
+        self.assertEqual(first_sets[topic.id], [])
+        after = ('b', question_sets[2].id)
+        self.assertEqual([s.description for s in QuestionSet.get_sets_after(self.topic.id, after, 5, self.db)], ['c', 'd'])
 
 class QuestionTests(DbTestCase):
     def setUp(self):
@@ -305,7 +388,7 @@ class QuestionTests(DbTestCase):
         Question.create(self.question_set.id, values, self.db)
         questions = self.db.query(Question).all()
         self.assertTrue(questions[0].description == 'a' and questions[0].question_order == 0)
-        self.assertTrue(questions[1].description == 'b' and questions[1].question_order == 1)
+        self.assertTrue(questions[1].description == 'b' and questions[1].question_order == Question.ORDER_GAP)
 
     def test_edit(self):
         from qa.models import Question
@@ -337,6 +420,27 @@ class QuestionTests(DbTestCase):
         self.assertFalse(Question.user_is_contributor(self.user.id, self.question_set.id, bad_set_id, self.db), 'User should not have permission because set does not exist!')
         self.assertFalse(Question.user_is_contributor(bad_user_id, self.question_set.id, question_id, self.db), 'User should not have permission because user does not exist!')
 
+    def test_user_is_contributor_with_type(self):
+        from qa.models import MultipleChoiceQuestion, Question, QuestionType
+
+        mcq = {
+            'description':'Sample',
+            'choice_one':'One',
+            'choice_two':'Two',
+            'choice_three':'Three',
+            'choice_four':'Four',
+            'correct_answer':1,
+        }
+        Question.create(self.question_set.id, {'type': QuestionType.mcq.name, 'multiple_choice_questions': [mcq]}, self.db)
+        question_id = self.question_set.get_questions(self.db)[0].id
+        user_id, set_id = self.user.id, self.question_set.id
+        self.db.expunge_all()
+
+        question = Question.user_is_contributor(user_id, set_id, question_id, self.db, QuestionType.mcq.name)
+        self.assertIsInstance(question, MultipleChoiceQuestion)
+        self.assertEqual(question.choice_one, mcq['choice_one'])
+        self.assertFalse(Question.user_is_contributor(user_id, set_id, question_id, self.db, QuestionType.tf.name), 'Question is not a true/false question.')
+
     #Tests that questions must have a unique description per set by attempting
     #to create two questions with the same description.
     def test_unique_description_per_set_constraint(self):
@@ -353,6 +457,22 @@ class QuestionTests(DbTestCase):
         except IntegrityError as e:
             self.assertEqual(e.orig.diag.constraint_name, 'unique_description_per_set')
 
+    #Descriptions are compared by digest, trimmed and ignoring case, so ones longer than a
+    #btree entry can hold are still checked.
+    def test_long_and_normalized_descriptions(self):
+        from qa.models import Question, QuestionType
+
+        long_description = ''.join(str(i) for i in range(10000))
+        Question.create(self.question_set.id, {'type': QuestionType.question.name, 'questions': [{'description': long_description}]}, self.db)
+        self.assertRaises(ValueError, Question.create, self.question_set.id, {
+            'type': QuestionType.question.name, 'questions': [{'description': ' ' + long_description.upper() + ' '}],
+        }, self.db)
+        self.assertEqual(
+            Question.existing_descriptions(self.question_set.id, [long_description + ' ', 'other'], self.db),
+            {long_description + ' '},
+        )
+        self.assertEqual(Question.existing_descriptions(self.question_set.id, [], self.db), set())
+
     #Tests that no two (or more I suppose) questions belonging to one set can have
     #the same order value.
     def test_unique_order_per_set_constraint(self):
@@ -390,6 +510,253 @@ class QuestionTests(DbTestCase):
         self.db.commit()
         self.assertFalse(self.db.query(Question).filter(Question.question_set_id == self.question_set.id).one_or_none())
 
+class QuestionSetCloneTests(QuestionTestCase):
+    def setUp(self):
+        from qa.models import Accuracy, MathQuestion, MultipleChoiceQuestion, Topic, TrueFalseQuestion
+
+        super().setUp()
+        self.other_topic = Topic(title='Other', user_id=self.user.id)
+        self.db.add(self.other_topic)
+        self.db.add_all([
+            TrueFalseQuestion(question_set_id=self.question_set.id, question_order=4, description='tf', correct_answer=True),
+            MultipleChoiceQuestion(question_set_id=self.question_set.id, question_order=2, **self.mcq),
+            MathQuestion(
+                question_set_id=self.question_set.id, question_order=7, description='math', correct_answer=2.5,
+                units='m', units_given=True, accuracy=Accuracy.uncertainty, accuracy_degree=0.5,
+            ),
+        ])
+        self.db.commit()
+
+    def fields(self, question):
+        return {
+            key: value for key, value in question.__dict__.items()
+            if not key.startswith('_') and key not in ('id', 'question_set_id', 'question_set')
+        }
+
+    def test_clone(self):
+        from qa.db import count_queries
+        from qa.models import Question
+
+        original = self.question_set.get_questions(self.db)
+        original_fields = [self.fields(q) for q in original]
+        original_ids = [q.id for q in original]
+        other_topic_id = self.other_topic.id
+        with count_queries(self.db) as counter:
+            copy = self.question_set.clone(other_topic_id, 'Copy', self.db)
+        #The new set, creating and filling the id map, one insert per question table and
+        #setting the new set's order counter.
+        self.assertEqual(counter.count, 8)
+
+        self.assertEqual((copy.topic_id, copy.description), (other_topic_id, 'Copy'))
+        copied = copy.get_questions(self.db)
+        self.assertEqual([type(q) for q in copied], [type(q) for q in original])
+        self.assertEqual(len(original_fields[2]), 8, 'Every math field should be compared.')
+        self.assertEqual([self.fields(q) for q in copied], original_fields)
+        self.assertTrue(set(q.id for q in copied).isdisjoint(original_ids))
+        self.assertEqual([q.id for q in copied], sorted(q.id for q in copied), 'New ids follow question order.')
+        self.assertEqual(len(self.question_set.get_questions(self.db)), 3)
+        self.assertEqual(copy.next_question_order, copied[-1].question_order + Question.ORDER_GAP)
+
+    def test_clone_into_same_topic_needs_new_description(self):
+        self.assertRaises(ValueError, self.question_set.clone, self.topic.id, self.question_set.description, self.db)
+        copy = self.question_set.clone(self.topic.id, 'Copy', self.db)
+        self.assertEqual(len(copy.get_questions(self.db)), 3)
+
+    def test_clone_empty_set(self):
+        from qa.models import QuestionSet
+
+        empty = QuestionSet(topic_id=self.topic.id, description='Empty')
+        self.db.add(empty)
+        self.db.commit()
+        self.assertEqual(empty.clone(self.other_topic.id, 'Empty', self.db).get_questions(self.db), [])
+
+class QuestionLoadingTests(QuestionTestCase):
+    def setUp(self):
+        from qa.models import Accuracy, MathQuestion, MultipleChoiceQuestion, TrueFalseQuestion
+        from qa.payloads import enable
+
+        super().setUp()
+        enable(self.sqlalchemy_engine)
+        self.db.add_all([
+            TrueFalseQuestion(question_set_id=self.question_set.id, question_order=0, description='tf', correct_answer=True),
+            MultipleChoiceQuestion(question_set_id=self.question_set.id, question_order=1, **self.mcq),
+            TrueFalseQuestion(question_set_id=self.question_set.id, question_order=2, description='tf2', correct_answer=False),
+            MathQuestion(question_set_id=self.question_set.id, question_order=3, description='math', correct_answer=2.5, accuracy=Accuracy.exact),
+        ])
+        self.db.commit()
+
+    #Every strategy gives the same questions, in the same number of queries as there are
+    #question types to read.
+    def test_strategies(self):
+        from qa.db import count_queries
+        from qa.models import Accuracy, QuestionLoading
+
+        question_set = self.question_set
+        self.db.refresh(question_set)
+        expected = [(type(q), q.description, q.answer_key()) for q in question_set.get_questions(self.db)]
+        for loading, queries in [(QuestionLoading.join, 1), (QuestionLoading.selectin, 4), (QuestionLoading.base, 1), (QuestionLoading.payload, 1)]:
+            self.db.expunge_all()
+            with count_queries(self.db) as counter:
+                questions = question_set.get_questions(self.db, loading)
+            self.assertEqual(counter.count, queries, loading.name)
+            self.assertEqual([(type(q), q.description, q.answer_key()) for q in questions], expected, loading.name)
+
+        self.db.expunge_all()
+        questions = question_set.get_questions(self.db, QuestionLoading.base)
+        with count_queries(self.db) as counter:
+            [q.answer_key() for q in questions]
+        self.assertEqual(counter.count, 4, 'Base loading reads the type columns per question.')
+
+        self.db.expunge_all()
+        questions = question_set.get_questions(self.db, QuestionLoading.payload)
+        with count_queries(self.db) as counter:
+            [q.answer_key() for q in questions]
+            math = questions[3]
+            self.assertEqual((math.accuracy, math.correct_answer, math.units), (Accuracy.exact, 2.5, None))
+        self.assertEqual(counter.count, 0, 'Payload loading has every field already.')
+
+    #The payload follows edits to the type's table and questions loaded from it can be edited.
+    def test_payload_kept_up_to_date(self):
+        from qa.models import MultipleChoiceQuestion, Question, QuestionLoading
+
+        mcq = self.db.query(MultipleChoiceQuestion).one()
+        question_set_id, mcq_id = self.question_set.id, mcq.id
+        mcq.choice_four = 'Five'
+        self.db.commit()
+        self.db.expunge_all()
+        loaded = Question.get_question(question_set_id, mcq_id, self.db, loading=QuestionLoading.payload)
+        self.assertEqual((loaded.choice_four, loaded.correct_answer), ('Five', 1))
+        loaded.correct_answer = 3
+        self.db.commit()
+        self.assertEqual(self.db.query(Question.payload).filter(Question.id == mcq_id).scalar()['correct_answer'], 3)
+
+    def test_payload_must_match_type(self):
+        from qa.models import Question, TrueFalseQuestion
+        from sqlalchemy.exc import IntegrityError
+
+        tf_id = self.db.query(TrueFalseQuestion.id).filter(TrueFalseQuestion.description == 'tf').scalar()
+        for payload in [{'choice_one': 'a'}, {'correct_answer': 'yes'}, {'correct_answer': None}]:
+            try:
+                self.db.query(Question).filter(Question.id == tf_id).update({Question.payload: payload}, synchronize_session=False)
+                self.fail('Expected IntegrityError to be thrown for {}'.format(payload))
+            except IntegrityError as e:
+                self.assertEqual(e.orig.diag.constraint_name, 'payload_matches_type')
+                self.db.rollback()
+        self.db.query(Question).filter(Question.id == tf_id).update({Question.payload: {'correct_answer': False}}, synchronize_session=False)
+        self.db.commit()
+
+class QuestionSearchTests(QuestionTestCase):
+    def setUp(self):
+        from qa.models import Question, QuestionSet, QuestionType, Topic, User
+
+        super().setUp()
+        Question.create(self.question_set.id, {'type': QuestionType.mcq.name, 'multiple_choice_questions': [
+            dict(self.mcq, description='Which planet is largest?', choice_one='Jupiter', choice_two='Mars', choice_three='Venus', choice_four='Earth'),
+        ]}, self.db)
+        Question.create(self.question_set.id, {'type': QuestionType.tf.name, 'true_false_questions': [
+            dict(self.tf, description='Jupiter is a gas giant.'),
+            dict(self.tf, description='Planets orbit the sun.'),
+        ]}, self.db)
+        other_user = User(username='other', password='password')
+        self.db.add(other_user)
+        self.db.flush()
+        other_topic = Topic(title='Other', user_id=other_user.id)
+        self.db.add(other_topic)
+        self.db.flush()
+        self.other_set = QuestionSet(description='Other', topic_id=other_topic.id)
+        self.db.add(self.other_set)
+        self.db.commit()
+        Question.create(self.other_set.id, {'type': QuestionType.tf.name, 'true_false_questions': [
+            dict(self.tf, description='Jupiter has moons.'),
+        ]}, self.db)
+
+    def search(self, terms, after=None, limit=10):
+        from qa.models import Question
+
+        return Question.search(self.user.id, terms, after, limit, self.db)
+
+    def test_search(self):
+        results = self.search('jupiter')
+        #The description match ranks above the choice match and the other user's question isn't found.
+        self.assertEqual([result.description for result in results], ['Jupiter is a gas giant.', 'Which planet is largest?'])
+        self.assertEqual((results[0].question_set, results[0].topic), ('Desc', 'Name'))
+        self.assertGreater(results[0].rank, results[1].rank)
+        self.assertEqual([result.description for result in self.search('planets -jupiter')], ['Planets orbit the sun.'])
+        self.assertEqual(self.search('saturn'), [])
+
+    def test_pages(self):
+        results = self.search('planet OR jupiter')
+        self.assertEqual(len(results), 3)
+        first = self.search('planet OR jupiter', limit=2)
+        rest = self.search('planet OR jupiter', after=(first[-1].rank, first[-1].id))
+        self.assertEqual(first + rest, results)
+
+    #The vector follows edits to the description and choices, and clones get their own.
+    def test_vector_kept_up_to_date(self):
+        from qa.models import MultipleChoiceQuestion
+
+        mcq = self.db.query(MultipleChoiceQuestion).one()
+        mcq.choice_four = 'Saturn'
+        self.db.commit()
+        self.assertEqual([result.id for result in self.search('saturn')], [mcq.id])
+        mcq.description = 'Which is the largest?'
+        self.db.commit()
+        self.assertEqual([result.id for result in self.search('saturn')], [mcq.id])
+        self.assertEqual(len(self.search('planet')), 1)
+
+        copy = self.question_set.clone(self.topic.id, 'Copy', self.db)
+        self.assertEqual(set(result.question_set_id for result in self.search('saturn')), {self.question_set.id, copy.id})
+
+#Appends from many sessions at once to the same set, as question creation and bulk imports.
+#Every append should succeed without retrying and no order number be given out twice.
+class ConcurrentAppendTests(QuestionTestCase):
+    THREADS = 8
+    APPENDS = 5
+
+    def append(self, thread, barrier):
+        from qa.bulk_import import import_questions
+        from qa.models import Question, QuestionType
+
+        db = self.Session()
+        try:
+            barrier.wait()
+            for i in range(self.APPENDS):
+                values = {
+                    'type': QuestionType.tf.name,
+                    'true_false_questions': [dict(self.tf, description='{}-{}-{}'.format(thread, i, j)) for j in range(3)],
+                }
+                Question.create(self.question_set.id, values, db)
+                rows = [(j, {'description': '{}-{}-import-{}'.format(thread, i, j), 'correct_answer': 'true'}) for j in range(4)]
+                result = import_questions(self.question_set.id, QuestionType.tf.name, rows, db, chunk_size=2)
+                if result.errors:
+                    raise ValueError(result.errors)
+        finally:
+            db.close()
+
+    def test_concurrent_appends(self):
+        import threading
+        from qa.models import Question
+
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+        def run(thread):
+            try:
+                self.append(thread, barrier)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(thread,)) for thread in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        orders = [question_order for question_order, in self.db.query(Question.question_order).filter(Question.question_set_id == self.question_set.id)]
+        self.assertEqual(len(orders), self.THREADS * self.APPENDS * 7)
+        self.assertEqual(sorted(orders), [i * Question.ORDER_GAP for i in range(len(orders))], 'No numbers are skipped or reused.')
+        self.db.refresh(self.question_set)
+        self.assertEqual(self.question_set.next_question_order, len(orders) * Question.ORDER_GAP)
+
 class MultipleChoiceQuestionTests(QuestionTestCase):
     #Test the valid answer range a multiple choice question can have.
     def test_answer_in_range_constraint(self):
@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+
+from base import DbTestCase
+
+#Run in the pool, so it has to be importable there.
+def slow(seconds):
+    time.sleep(seconds)
+    return seconds
+
+class PasswordHasherTests(unittest.TestCase):
+    def hasher(self, **kw):
+        from qa.passwords import PasswordHasher
+
+        hasher = PasswordHasher(**kw)
+        self.addCleanup(hasher.close)
+        return hasher
+
+    def test_hash_and_verify_in_pool(self):
+        hasher = self.hasher(rounds=1000, processes=1)
+        password_hash = hasher.hash('secret')
+        self.assertEqual(hasher.verify('secret', password_hash), (True, None))
+        self.assertEqual(hasher.verify('wrong', password_hash), (False, None))
+        stats = hasher.stats()
+        self.assertEqual((stats['calls'], stats['pending'], stats['rejected'], stats['timeouts']), (3, 0, 0, 0))
+        self.assertGreater(stats['max_ms'], 0)
+
+    #A hash made with other rounds is accepted and a replacement made with the current ones.
+    def test_verify_rehashes_other_rounds(self):
+        from passlib.hash import pbkdf2_sha256
+
+        hasher = self.hasher(rounds=1000, processes=0)
+        matches, new_hash = hasher.verify('secret', pbkdf2_sha256.using(rounds=2000).hash('secret'))
+        self.assertTrue(matches)
+        self.assertEqual(pbkdf2_sha256.from_string(new_hash).rounds, 1000)
+        self.assertEqual(hasher.verify('secret', new_hash), (True, None))
+
+    def test_timeout_and_full_queue(self):
+        import test_passwords
+
+        hasher = self.hasher(processes=1, max_pending=1)
+        self.assertEqual(hasher._run(test_passwords.slow, 0), 0, 'Start the pool before timing.')
+        hasher.timeout = 0.5
+        self.assertRaises(ValueError, hasher._run, test_passwords.slow, 3)
+        #The timed out call still holds the only place until it finishes.
+        self.assertEqual(hasher.stats()['pending'], 1)
+        self.assertRaises(ValueError, hasher._run, test_passwords.slow, 0)
+        stats = hasher.stats()
+        self.assertEqual((stats['timeouts'], stats['rejected']), (1, 1))
+        deadline = time.time() + 5
+        while hasher.stats()['pending'] and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(hasher._run(test_passwords.slow, 0), 0)
+
+    #Hashing in the pool leaves the calling process free to run other threads.
+    def test_pool_does_not_block_threads(self):
+        hasher = self.hasher(rounds=200000, processes=1)
+        hasher.hash('warm up')
+        ticks = []
+        stop = threading.Event()
+
+        def tick():
+            while not stop.is_set():
+                ticks.append(None)
+                time.sleep(0.001)
+
+        thread = threading.Thread(target=tick)
+        thread.start()
+        try:
+            hasher.hash('secret')
+        finally:
+            stop.set()
+            thread.join()
+        self.assertGreater(len(ticks), 10)
+
+class UserLoginTests(DbTestCase):
+    def test_login_rehashes(self):
+        from passlib.hash import pbkdf2_sha256
+        from qa.models import User
+        from qa.passwords import PasswordHasher
+
+        self.db.add(User(username='user', password=pbkdf2_sha256.using(rounds=2000).hash('secret')))
+        self.db.commit()
+        hasher = PasswordHasher(rounds=1000, processes=0)
+        self.assertIsNone(User.login({'username': 'user', 'password': 'wrong'}, self.db, hasher))
+        user = User.login({'username': 'user', 'password': 'secret'}, self.db, hasher)
+        self.assertEqual(pbkdf2_sha256.from_string(user.password).rounds, 1000)
+        self.db.expire_all()
+        self.assertEqual(User.login({'username': 'user', 'password': 'secret'}, self.db, hasher).password, user.password)
@@ -0,0 +1,120 @@
+from base import QuestionTestCase
+
+class PayloadStorageTests(QuestionTestCase):
+    def payloads(self):
+        from qa.models import Question
+
+        self.db.expire_all()
+        return [payload for payload, in self.db.query(Question.payload).order_by(Question.id)]
+
+    def search(self, terms):
+        from qa.models import Question
+
+        return [result.description for result in Question.search(self.user.id, terms, None, 10, self.db)]
+
+    def triggers(self, table):
+        return sorted(name for name, in self.sqlalchemy_engine.execute(
+            "SELECT tgname FROM pg_trigger WHERE tgrelid = '{}'::regclass AND NOT tgisinternal".format(table)
+        ))
+
+    #Off by default, so writes leave the payload alone, and turned on and off again.
+    def test_enable_and_disable(self):
+        from qa.models import MultipleChoiceQuestion, Question, QuestionType
+        from qa.payloads import disable, enable, is_enabled
+
+        engine = self.sqlalchemy_engine
+        Question.create(self.question_set.id, {'type': QuestionType.mcq.name, 'multiple_choice_questions': [
+            dict(self.mcq, description='Planets', choice_one='Jupiter'),
+        ]}, self.db)
+        self.assertFalse(is_enabled(engine))
+        self.assertEqual(self.payloads(), [None])
+        self.assertEqual(self.search('jupiter'), ['Planets'])
+
+        self.assertEqual(enable(engine), 1)
+        self.assertTrue(is_enabled(engine))
+        self.assertEqual(self.payloads()[0]['choice_one'], 'Jupiter')
+        #One trigger per statement sets both the payload and the search vector.
+        self.assertEqual(self.triggers('multiple_choice_questions'), [
+            'multiple_choice_questions_payload_insert', 'multiple_choice_questions_payload_update',
+        ])
+        Question.create(self.question_set.id, {'type': QuestionType.mcq.name, 'multiple_choice_questions': [
+            dict(self.mcq, description='Moons', choice_one='Titan'),
+        ]}, self.db)
+        planets_id = self.db.query(Question.id).filter(Question.description == 'Planets').scalar()
+        self.db.query(MultipleChoiceQuestion).filter(MultipleChoiceQuestion.id == planets_id).\
+            update({MultipleChoiceQuestion.choice_one: 'Saturn'}, synchronize_session=False)
+        self.db.commit()
+        self.assertEqual([payload['choice_one'] for payload in self.payloads()], ['Saturn', 'Titan'])
+        self.assertEqual(self.search('titan'), ['Moons'])
+        self.assertEqual(self.search('saturn'), ['Planets'])
+
+        #Turning storage off replaces the triggers on questions, which waits for open transactions.
+        self.db.commit()
+        disable(engine)
+        self.assertFalse(is_enabled(engine))
+        self.assertEqual(self.payloads(), [None, None])
+        self.assertEqual(self.triggers('multiple_choice_questions'), [
+            'multiple_choice_questions_search_vector_insert', 'multiple_choice_questions_search_vector_update',
+        ])
+        Question.create(self.question_set.id, {'type': QuestionType.mcq.name, 'multiple_choice_questions': [
+            dict(self.mcq, description='Stars', choice_one='Sirius'),
+        ]}, self.db)
+        self.assertEqual(self.payloads(), [None, None, None])
+        self.assertEqual(self.search('sirius'), ['Stars'])
+
+    #Migrating keeps payload storage as it was, even though the search migration puts back
+    #the multiple choice search trigger.
+    def test_migration_keeps_storage(self):
+        from qa.payloads import enable, is_enabled
+        from qa.schema import add_question_payload, add_question_search_vector
+
+        engine = self.sqlalchemy_engine
+        for expected in [False, True]:
+            with engine.begin() as connection:
+                add_question_search_vector(connection)
+                add_question_payload(connection)
+            self.assertEqual(is_enabled(engine), expected)
+            if expected:
+                self.assertEqual(len(self.triggers('multiple_choice_questions')), 2)
+            enable(engine)
+
+class BackfillTests(QuestionTestCase):
+    #Questions written before the payload column existed get theirs when storage is turned on.
+    def test_migrate_and_backfill(self):
+        from qa.models import MathQuestion, MultipleChoiceQuestion, Question, QuestionLoading, QuestionSet
+        from qa.payloads import backfill, enable
+        from qa.schema import add_question_payload
+
+        engine = self.sqlalchemy_engine
+        engine.execute('ALTER TABLE questions DROP COLUMN payload')
+        question_set_id = self.question_set.id
+        engine.execute(
+            "INSERT INTO questions (id, type, description, question_order, question_set_id) "
+            "SELECT i, CASE WHEN mod(i, 2) = 0 THEN 'mcq' ELSE 'math' END::questiontype, 'q' || i, i, {} FROM generate_series(1, 25) i".format(question_set_id)
+        )
+        engine.execute(
+            "INSERT INTO multiple_choice_questions (id, choice_one, choice_two, choice_three, choice_four, correct_answer) "
+            "SELECT i, 'a', 'b', 'c', 'd', 2 FROM generate_series(2, 24, 2) i"
+        )
+        engine.execute(
+            "INSERT INTO math_questions (id, correct_answer, accuracy, accuracy_degree) "
+            "SELECT i, i / 2.0, 'percentage', 5 FROM generate_series(1, 25, 2) i"
+        )
+        with engine.begin() as connection:
+            add_question_payload(connection)
+        with engine.begin() as connection:
+            add_question_payload(connection)
+
+        self.assertEqual(enable(engine, batch_size=4), 25)
+        self.assertEqual(backfill(engine, batch_size=4), 0, 'Filled in questions are skipped.')
+        question_set = self.db.query(QuestionSet).one()
+        expected = [(type(q), q.answer_key()) for q in question_set.get_questions(self.db)]
+        self.db.expunge_all()
+        question_set = self.db.query(QuestionSet).one()
+        self.assertEqual([(type(q), q.answer_key()) for q in question_set.get_questions(self.db, QuestionLoading.payload)], expected)
+        self.assertEqual(expected[0], (MathQuestion, (0.475, 0.525, None)))
+        self.assertEqual(expected[1], (MultipleChoiceQuestion, 2))
+
+        self.db.query(MultipleChoiceQuestion).filter(MultipleChoiceQuestion.id == 2).update({MultipleChoiceQuestion.correct_answer: 0})
+        self.db.commit()
+        self.assertEqual(self.db.query(Question.payload).filter(Question.id == 2).scalar()['correct_answer'], 0)
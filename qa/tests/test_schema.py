@@ -0,0 +1,110 @@
+from base import DbTestCase
+
+class SchemaVersionTests(DbTestCase):
+    def tearDown(self):
+        from qa.schema import schema_metadata
+
+        schema_metadata.drop_all(self.sqlalchemy_engine)
+        super().tearDown()
+
+    def test_check_without_migration_raises(self):
+        from qa.schema import SchemaMismatch, check
+
+        self.assertRaises(SchemaMismatch, check, self.sqlalchemy_engine)
+
+    def test_check_after_migration(self):
+        from qa.schema import SchemaMismatch, check, migrate
+
+        migrate(self.sqlalchemy_engine)
+        try:
+            check(self.sqlalchemy_engine)
+        except SchemaMismatch as _:
+            self.fail('Migrated schema should match.')
+
+        #Running it again should be harmless.
+        migrate(self.sqlalchemy_engine)
+        check(self.sqlalchemy_engine)
+
+    def test_check_stale_fingerprint_raises(self):
+        from qa.schema import SchemaMismatch, check, migrate, schema_version
+
+        migrate(self.sqlalchemy_engine)
+        self.sqlalchemy_engine.execute(schema_version.update().values(fingerprint='stale'))
+        self.assertRaises(SchemaMismatch, check, self.sqlalchemy_engine)
+
+    def test_fingerprint_changes_with_models(self):
+        from qa.schema import fingerprint
+        from sqlalchemy import Column, Integer, MetaData, Table
+
+        metadata = MetaData()
+        Table('a', metadata, Column('id', Integer, primary_key=True))
+        before = fingerprint(metadata, [])
+        self.assertEqual(before, fingerprint(metadata, []))
+        Table('b', metadata, Column('id', Integer, primary_key=True))
+        self.assertNotEqual(before, fingerprint(metadata, []))
+
+    #Sets created before the counter existed get one past their last question.
+    def test_next_question_order_migration(self):
+        from qa.schema import add_question_set_next_question_order
+        from qa.models import Question
+
+        engine = self.sqlalchemy_engine
+        engine.execute('ALTER TABLE question_sets DROP COLUMN next_question_order')
+        engine.execute("INSERT INTO users (id, username, password) VALUES (1, 'user', 'password')")
+        engine.execute("INSERT INTO topics (id, title, user_id) VALUES (1, 'Topic', 1)")
+        engine.execute("INSERT INTO question_sets (id, description, topic_id) VALUES (1, 'a', 1), (2, 'b', 1)")
+        engine.execute("INSERT INTO questions (type, description, question_order, question_set_id) VALUES ('question', 'q', 5, 1)")
+        with engine.begin() as connection:
+            add_question_set_next_question_order(connection)
+        with engine.begin() as connection:
+            add_question_set_next_question_order(connection)
+        counters = dict(engine.execute('SELECT id, next_question_order FROM question_sets').fetchall())
+        self.assertEqual(counters, {1: 5 + Question.ORDER_GAP, 2: 0})
+
+    #Questions added before the search vector existed are searchable once migrated.
+    def test_question_search_vector_migration(self):
+        from qa.schema import add_question_search_vector
+
+        engine = self.sqlalchemy_engine
+        engine.execute('DROP TRIGGER questions_search_vector ON questions')
+        engine.execute('DROP TRIGGER multiple_choice_questions_search_vector_insert ON multiple_choice_questions')
+        engine.execute('ALTER TABLE questions DROP COLUMN search_vector')
+        engine.execute("INSERT INTO users (id, username, password) VALUES (1, 'user', 'password')")
+        engine.execute("INSERT INTO topics (id, title, user_id) VALUES (1, 'Topic', 1)")
+        engine.execute("INSERT INTO question_sets (id, description, topic_id) VALUES (1, 'a', 1)")
+        engine.execute("INSERT INTO questions (id, type, description, question_order, question_set_id) VALUES (1, 'mcq', 'Pick a colour', 0, 1)")
+        engine.execute(
+            "INSERT INTO multiple_choice_questions (id, choice_one, choice_two, choice_three, choice_four, correct_answer) "
+            "VALUES (1, 'red', 'green', 'blue', 'yellow', 0)"
+        )
+        with engine.begin() as connection:
+            add_question_search_vector(connection)
+        with engine.begin() as connection:
+            add_question_search_vector(connection)
+        found = engine.execute(
+            "SELECT id FROM questions WHERE search_vector @@ to_tsquery('english', 'colour & green')"
+        ).fetchall()
+        self.assertEqual(found, [(1,)])
+
+    #The description constraints are replaced by the digest indexes, which still reject
+    #duplicates under the same name.
+    def test_description_uniqueness_migration(self):
+        from qa.schema import hash_description_uniqueness
+        from sqlalchemy.exc import IntegrityError
+
+        engine = self.sqlalchemy_engine
+        engine.execute('DROP INDEX unique_description_per_set')
+        engine.execute('ALTER TABLE questions ADD CONSTRAINT unique_description_per_set UNIQUE (question_set_id, description)')
+        with engine.begin() as connection:
+            hash_description_uniqueness(connection)
+        with engine.begin() as connection:
+            hash_description_uniqueness(connection)
+        engine.execute("INSERT INTO users (id, username, password) VALUES (1, 'user', 'password')")
+        engine.execute("INSERT INTO topics (id, title, user_id) VALUES (1, 'Topic', 1)")
+        engine.execute("INSERT INTO question_sets (id, description, topic_id) VALUES (1, 'a', 1)")
+        engine.execute("INSERT INTO questions (type, description, question_order, question_set_id) VALUES ('question', 'q', 0, 1)")
+        try:
+            engine.execute("INSERT INTO questions (type, description, question_order, question_set_id) VALUES ('question', ' Q', 1, 1)")
+            self.fail('Expected IntegrityError to be thrown')
+        except IntegrityError as e:
+            self.assertEqual(e.orig.diag.constraint_name, 'unique_description_per_set')
@@ -137,3 +137,74 @@ class AuthorizationTests(DbTestCase):
 
         Session.login(request.session, self.user2)
         self.assertRaises(HTTPForbidden, decorated_view, None, request)
+
+    #Test that a repeated request on the same resource is authorized without a query and
+    #that the resource is then only loaded if the view uses it.
+    def test_cached_authorization(self):
+        from qa.security import Session, authorization_cache, requires_question_set_contributor
+
+        request = testing.DummyRequest()
+        request.db = self.db
+        Session.login(request.session, self.user)
+        request.matchdict = {'question_set_id':self.question_set.id}
+        decorated_view = requires_question_set_contributor(self.dummy_view)
+        self.assertTrue(decorated_view(None,request))
+        hits = authorization_cache.stats()['hits']
+
+        request = testing.DummyRequest()
+        request.db = None #Any query would fail.
+        Session.login(request.session, self.user)
+        request.matchdict = {'question_set_id':self.question_set.id}
+        self.assertTrue(decorated_view(None,request), "Should be authorized from the cache.")
+        self.assertEqual(authorization_cache.stats()['hits'] - hits, 1)
+
+        request.db = self.db
+        self.assertEqual(request.question_set.description, self.question_set.description)
+
+    def test_cached_resource_deleted(self):
+        from qa.security import Session, authorization_cache, requires_topic_owner
+        from pyramid.httpexceptions import HTTPForbidden
+
+        def request():
+            request = testing.DummyRequest()
+            request.db = self.db
+            Session.login(request.session, self.user)
+            request.matchdict = {'topic_id':self.topic.id}
+            return request
+
+        decorated_view = requires_topic_owner(lambda context, request: request.topic)
+        decorated_view(None, request())
+        hits = authorization_cache.stats()['hits']
+
+        self.db.delete(self.topic)
+        self.db.commit()
+        self.assertRaises(HTTPForbidden, decorated_view, None, request())
+        self.assertRaises(HTTPForbidden, decorated_view, None, request())
+        self.assertEqual(authorization_cache.stats()['hits'] - hits, 1, 'The stale decision should be dropped.')
+
+class AuthorizationCacheTests(unittest.TestCase):
+    def test_invalidate_user(self):
+        from qa.security import AuthorizationCache
+
+        cache = AuthorizationCache()
+        cache.allow(1, ('topic', '1'))
+        cache.allow(2, ('topic', '2'))
+        self.assertTrue(cache.is_allowed(1, ('topic', '1')))
+        self.assertFalse(cache.is_allowed(1, ('topic', '2')))
+        cache.invalidate_user(1)
+        self.assertFalse(cache.is_allowed(1, ('topic', '1')))
+        self.assertTrue(cache.is_allowed(2, ('topic', '2')))
+        self.assertEqual(cache.stats()['hit_rate'], 0.5)
+
+    def test_expiry_and_size(self):
+        from qa.security import AuthorizationCache
+
+        cache = AuthorizationCache(ttl=-1)
+        cache.allow(1, ('topic', '1'))
+        self.assertFalse(cache.is_allowed(1, ('topic', '1')))
+
+        cache = AuthorizationCache(max_entries=1)
+        cache.allow(1, ('topic', '1'))
+        cache.allow(1, ('topic', '2'))
+        self.assertFalse(cache.is_allowed(1, ('topic', '1')))
+        self.assertTrue(cache.is_allowed(1, ('topic', '2')))
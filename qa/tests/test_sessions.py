@@ -0,0 +1,136 @@
+import unittest
+
+from base import DbTestCase
+from pyramid import testing
+from pyramid.response import Response
+
+#Runs a request through a session factory and returns the session cookie it set.
+def save_session(factory, cookie=None, **values):
+    request = testing.DummyRequest()
+    if cookie:
+        request.cookies['session'] = cookie
+    session = factory(request)
+    session.update(values)
+    response = Response()
+    request._process_response_callbacks(response)
+    return session, response.headers['Set-Cookie'].split(';')[0].split('=', 1)[1]
+
+def load_session(factory, cookie):
+    request = testing.DummyRequest()
+    request.cookies['session'] = cookie
+    return factory(request)
+
+class MemorySessionStoreTests(unittest.TestCase):
+    def test_lru_eviction(self):
+        from qa.sessions import MemorySessionStore
+
+        store = MemorySessionStore(max_entries=2)
+        store.set('a', b'1')
+        store.set('b', b'22')
+        store.get('a')
+        store.set('c', b'333')
+
+        self.assertEqual(store.get('a'), b'1')
+        self.assertIsNone(store.get('b'), 'Least recently used session should be evicted.')
+        self.assertEqual(store.get('c'), b'333')
+        stats = store.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['bytes'], 4)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_expiry(self):
+        from qa.sessions import MemorySessionStore
+
+        store = MemorySessionStore(timeout=-1)
+        store.set('a', b'1')
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(store.stats()['expirations'], 1)
+        self.assertEqual(store.stats()['bytes'], 0)
+
+class ServerSideSessionTests(unittest.TestCase):
+    def setUp(self):
+        from qa.sessions import MemorySessionStore, ServerSideSessionFactory
+
+        self.store = MemorySessionStore()
+        self.factory = ServerSideSessionFactory(self.store, 'secret')
+
+    def test_cookie_only_holds_id(self):
+        session, cookie = save_session(self.factory, state=list(range(5000)))
+        self.assertLess(len(cookie), 200)
+        self.assertEqual(load_session(self.factory, cookie)['state'], list(range(5000)))
+
+    def test_session_id_is_kept(self):
+        _, cookie = save_session(self.factory, a=1)
+        session, second_cookie = save_session(self.factory, cookie, b=2)
+        self.assertEqual(cookie, second_cookie)
+        self.assertEqual(self.store.stats()['entries'], 1)
+        session = load_session(self.factory, cookie)
+        self.assertEqual((session['a'], session['b']), (1, 2))
+
+    def test_tampered_or_unknown_cookie_starts_new_session(self):
+        from qa.sessions import ServerSideSessionFactory, MemorySessionStore
+
+        _, cookie = save_session(self.factory, a=1)
+        self.assertNotIn('a', load_session(self.factory, cookie[:-2] + 'xx'))
+        other_factory = ServerSideSessionFactory(MemorySessionStore(), 'secret')
+        self.assertNotIn('a', load_session(other_factory, cookie))
+
+    def test_clear_starts_new_session_id(self):
+        _, cookie = save_session(self.factory, a=1)
+        request = testing.DummyRequest()
+        request.cookies['session'] = cookie
+        session = self.factory(request)
+        session.clear()
+        response = Response()
+        request._process_response_callbacks(response)
+        self.assertNotEqual(response.headers['Set-Cookie'].split(';')[0].split('=', 1)[1], cookie)
+
+    #The cookie from before logging out no longer loads the logged in session.
+    def test_logout_deletes_session(self):
+        from qa.models import User
+        from qa.security import Session
+
+        request = testing.DummyRequest()
+        session = self.factory(request)
+        Session.login(session, User(id=1, username='user'))
+        response = Response()
+        request._process_response_callbacks(response)
+        cookie = response.headers['Set-Cookie'].split(';')[0].split('=', 1)[1]
+
+        request = testing.DummyRequest()
+        request.cookies['session'] = cookie
+        session = self.factory(request)
+        self.assertTrue(Session.logged_in(session))
+        Session.logout(session, self.store)
+        response = Response()
+        request._process_response_callbacks(response)
+        self.assertNotEqual(response.headers['Set-Cookie'].split(';')[0].split('=', 1)[1], cookie)
+        self.assertFalse(Session.logged_in(load_session(self.factory, cookie)))
+        self.assertEqual(self.store.stats()['entries'], 1)
+
+class PostgresSessionStoreTests(DbTestCase):
+    def test_store(self):
+        from qa.sessions import PostgresSessionStore, ServerSideSessionFactory
+
+        store = PostgresSessionStore(self.sqlalchemy_engine)
+        factory = ServerSideSessionFactory(store, 'secret')
+        _, cookie = save_session(factory, a=1)
+        save_session(factory, cookie, a=2)
+        self.assertEqual(load_session(factory, cookie)['a'], 2)
+        self.assertEqual(store.stats()['entries'], 1)
+
+        self.assertIsNone(store.get('missing'))
+        self.assertEqual(store.stats()['misses'], 1)
+
+    def test_purge_expired(self):
+        from qa.sessions import PostgresSessionStore
+
+        store = PostgresSessionStore(self.sqlalchemy_engine, timeout=-1)
+        store.set('a', b'1')
+        self.assertIsNone(store.get('a'))
+        with self.sqlalchemy_engine.begin() as connection:
+            store.purge(connection)
+        self.assertEqual(store.stats()['entries'], 0)
+        self.assertEqual(store.stats()['expirations'], 1)
@@ -0,0 +1,57 @@
+from base import QuestionTestCase
+
+class QuestionStatsTests(QuestionTestCase):
+    def setUp(self):
+        from qa.models import Question, QuestionType
+
+        super().setUp()
+        Question.create(self.question_set.id, {'type': QuestionType.mcq.name, 'multiple_choice_questions': [self.mcq]}, self.db)
+        Question.create(self.question_set.id, {'type': QuestionType.tf.name, 'true_false_questions': [dict(self.tf, description='True or false')]}, self.db)
+        self.mcq_id, self.tf_id = [q.id for q in self.question_set.get_questions(self.db)]
+
+    def save(self, *answers):
+        from qa.attempts import AttemptRecord, AttemptWriter
+
+        #mcq choice and tf answer of each attempt.
+        records = [
+            AttemptRecord(self.user.id, self.question_set.id, 1, [
+                (self.mcq_id, float(choice), None, choice == self.mcq['correct_answer']),
+                (self.tf_id, float(tf), None, tf == self.tf['correct_answer']),
+            ])
+            for choice, tf in answers
+        ]
+        AttemptWriter(self.sqlalchemy_engine).write(records)
+
+    def get_stats(self):
+        from qa.stats import get_set_stats
+
+        self.db.expire_all()
+        return [(q['answers'], q['correct'], q['choices']) for q in get_set_stats(self.question_set.id, self.db)]
+
+    def test_counters_follow_saved_attempts(self):
+        from qa.db import count_queries
+        from qa.stats import get_set_stats
+
+        self.assertEqual(self.get_stats(), [(0, 0, [0, 0, 0, 0]), (0, 0, None)])
+        self.save((1, False), (2, True), (1, True))
+        self.save((3, False))
+        self.assertEqual(self.get_stats(), [(4, 2, [0, 2, 1, 1]), (4, 2, None)])
+
+        question_set_id = self.question_set.id
+        with count_queries(self.db) as counter:
+            get_set_stats(question_set_id, self.db)
+        self.assertEqual(counter.count, 2)
+
+    def test_rebuild(self):
+        from qa.models import QuestionStats
+        from qa.stats import rebuild
+
+        self.save((1, False), (0, True))
+        expected = self.get_stats()
+        self.db.query(QuestionStats).update({QuestionStats.answers: 100})
+        self.db.commit()
+        self.assertNotEqual(self.get_stats(), expected)
+        rebuild(self.sqlalchemy_engine, self.question_set.id)
+        self.assertEqual(self.get_stats(), expected)
+        rebuild(self.sqlalchemy_engine)
+        self.assertEqual(self.get_stats(), expected)
@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 
 from base import DbTestCase, StubUser, StubQuestion
 from pyramid import testing
@@ -196,6 +197,22 @@ class QuestionViewTests(DbTestCase):
         response = view.answer()
         self.assertTrue(self.question2.description in response['question_form'])
 
+    #Test that questions are reloaded from the database once the state has been
+    #pickled into the session and no longer holds the question instances.
+    def test_answer_after_session_round_trip(self):
+        import pickle
+        from qa.views import QuestionViews, Session
+
+        self.request.method='GET'
+        view = QuestionViews(self.request)
+        view.setup()
+        state = self.request.session[Session.QUESTION_STATE]
+        self.request.session[Session.QUESTION_STATE] = pickle.loads(pickle.dumps(state))
+        self.request.method = 'POST'
+        self.request.POST = {'answer':{'answer':'0'}, 'submit':None,'csrf_token':self.request.session.get_csrf_token()}
+        response = view.answer()
+        self.assertTrue(self.question2.description in response['question_form'])
+
     #Test that, when a question set is exhausted (by answering it), that the user
     #is on the report page.
     def test_redirects_to_report_on_empty_question_list(self):
@@ -211,6 +228,218 @@ class QuestionViewTests(DbTestCase):
         response = view.answer() #should be at report page now
         self.assertEqual(response.location,"http://example.com/report", "Question Set Exhausted")
 
+    #Test the whole answer flow with questions loaded as they are reached, pickling the
+    #state between requests as a real session would.
+    def test_lazy_answer_mode(self):
+        import pickle
+        from qa.views import QuestionSetState, QuestionViews, Session
+
+        self.request.registry.settings = {'qa.answer_mode': 'lazy'}
+        self.request.method='GET'
+        view = QuestionViews(self.request)
+        response = view.setup()
+        self.assertTrue(self.question.description in response['question_form'])
+        self.assertFalse(self.request.session[Session.QUESTION_STATE].complete)
+
+        self.request.method = 'POST'
+        self.request.POST = {'answer':{'answer':'0'}, 'submit':None,'csrf_token':self.request.session.get_csrf_token()}
+        for description in [self.question2.description, None]:
+            state = self.request.session[Session.QUESTION_STATE]
+            self.request.session[Session.QUESTION_STATE] = pickle.loads(pickle.dumps(state))
+            response = view.answer()
+            if description:
+                self.assertTrue(description in response['question_form'])
+        self.assertEqual(response.location, "http://example.com/report")
+
+        state = self.request.session[Session.QUESTION_STATE]
+        self.assertTrue(state.ready_for_report())
+        self.assertEqual(len(state.get_report(self.db)), 2)
+
+    #Test that a question deleted while the set is being answered ends the attempt with a
+    #message instead of an error.
+    def test_question_deleted_mid_attempt(self):
+        import pickle
+        from qa.cache import snapshot_cache
+        from qa.views import QuestionViews, Session
+
+        self.config.add_route('profile', '/profile')
+        self.request.method='GET'
+        view = QuestionViews(self.request)
+        view.setup()
+        state = self.request.session[Session.QUESTION_STATE]
+        self.request.session[Session.QUESTION_STATE] = pickle.loads(pickle.dumps(state))
+        self.db.delete(self.question2)
+        self.db.commit()
+        snapshot_cache.clear()
+
+        self.request.method = 'POST'
+        self.request.POST = {'answer':{'answer':'0'}, 'submit':None,'csrf_token':self.request.session.get_csrf_token()}
+        response = view.answer()
+        self.assertEqual(response.location, "http://example.com/profile")
+        self.assertNotIn(Session.QUESTION_STATE, self.request.session)
+        self.assertEqual(len(self.request.session.pop_flash()), 1)
+
+class PaginationViewTests(DbTestCase):
+    def setUp(self):
+        from qa.models import User, Topic, QuestionSet, Question
+        from qa.views import Session
+
+        super().setUp()
+        self.config.include('pyramid_chameleon')
+        self.config.add_route('profile_topics', '/profile/topics')
+        self.config.add_route('topic_question_sets', '/topic/{topic_id}/sets')
+        self.config.add_route('question_set_questions', '/set/{question_set_id}/questions')
+        self.config.add_route('question_creation_form', '/question_creation_form')
+
+        self.user = User(id=1, username='user', password='password')
+        self.db.add(self.user)
+        self.db.flush()
+        #Zero padded so title order matches creation order.
+        self.topics = [Topic(user_id=1, title='topic{:02}'.format(i)) for i in range(25)]
+        self.db.add_all(self.topics)
+        self.db.flush()
+        self.question_sets = [QuestionSet(topic_id=self.topics[0].id, description='set{:02}'.format(i)) for i in range(25)]
+        self.db.add_all(self.question_sets)
+        self.db.flush()
+        self.questions = [
+            Question(question_set_id=self.question_sets[0].id, description=str(i), question_order=i * 2)
+            for i in range(60)
+        ]
+        self.db.add_all(self.questions)
+        self.db.commit()
+        Session.login(self.request().session, self.user)
+
+    def request(self, **params):
+        from qa.views import Session
+
+        request = testing.DummyRequest(params=params)
+        request.db = self.db
+        request.username = 'user'
+        Session.login(request.session, self.user)
+        return request
+
+    def next_page_params(self, url):
+        from urllib.parse import parse_qsl, urlsplit
+
+        return dict(parse_qsl(urlsplit(url).query))
+
+    def test_question_pages(self):
+        from qa.views import QuestionSetViews, QUESTIONS_PAGE_SIZE
+
+        request = self.request()
+        request.question_set = self.question_sets[0]
+        template_vars = QuestionSetViews(request).view_set()
+        self.assertEqual(template_vars['questions'], self.questions[:QUESTIONS_PAGE_SIZE])
+
+        request = self.request(**self.next_page_params(template_vars['more_questions']))
+        request.question_set = self.question_sets[0]
+        template_vars = QuestionSetViews(request).question_page()
+        self.assertEqual(template_vars['questions'], self.questions[QUESTIONS_PAGE_SIZE:])
+        self.assertIsNone(template_vars['more_questions'])
+
+    def test_topic_and_question_set_pages(self):
+        from qa.db import count_queries
+        from qa.views import QUESTION_SETS_PAGE_SIZE, TOPICS_PAGE_SIZE, UserViews
+
+        request = self.request()
+        with count_queries(self.db) as counter:
+            template_vars, _, question_set_form = UserViews(request).profile_vars()
+        #The page of topics, their first question sets and the topic choices, however many topics there are.
+        self.assertEqual(counter.count, 3)
+        self.assertEqual(template_vars['topics'], self.topics[:TOPICS_PAGE_SIZE])
+        question_sets, more_question_sets = template_vars['question_set_pages'][self.topics[0].id]
+        self.assertEqual(question_sets, self.question_sets[:QUESTION_SETS_PAGE_SIZE])
+        self.assertEqual(template_vars['question_set_pages'][self.topics[1].id], ([], None))
+        self.assertIsNotNone(question_set_form, 'Every topic is a choice, not only the first page.')
+
+        template_vars = UserViews(self.request(**self.next_page_params(template_vars['more_topics']))).topic_page()
+        self.assertEqual(template_vars['topics'], self.topics[TOPICS_PAGE_SIZE:])
+        self.assertIsNone(template_vars['more_topics'])
+
+        request = self.request(**self.next_page_params(more_question_sets))
+        request.topic = self.topics[0]
+        template_vars = UserViews(request).question_set_page()
+        self.assertEqual(template_vars['question_sets'], self.question_sets[QUESTION_SETS_PAGE_SIZE:])
+        self.assertIsNone(template_vars['more_question_sets'])
+
+    def test_bad_page_key(self):
+        from pyramid.httpexceptions import HTTPClientError
+        from qa.views import UserViews
+
+        self.assertIsInstance(UserViews(self.request(after_title='a')).topic_page(), HTTPClientError)
+        self.assertIsInstance(UserViews(self.request(after_title='a', after_id='b')).topic_page(), HTTPClientError)
+
+    def test_search_pages(self):
+        from qa import views
+
+        self.config.add_route('search', '/search')
+        with mock.patch.object(views, 'SEARCH_PAGE_SIZE', 25):
+            first = views.UserViews(self.request(q='5')).search()
+            self.assertEqual([result['description'] for result in first['results']], ['5'])
+            self.assertIsNone(first['next'])
+
+            #Every question matches the OR of all of them.
+            terms = ' OR '.join(str(i) for i in range(60))
+            first = views.UserViews(self.request(q=terms)).search()
+            self.assertEqual(len(first['results']), 25)
+            self.assertEqual(first['results'][0]['topic'], 'topic00')
+            pages = [first]
+            while pages[-1]['next']:
+                pages.append(views.UserViews(self.request(**self.next_page_params(pages[-1]['next']))).search())
+        found = [result['question_id'] for page in pages for result in page['results']]
+        self.assertEqual(sorted(found), sorted(question.id for question in self.questions))
+        self.assertEqual(views.UserViews(self.request(q=' ')).search(), {'results': [], 'next': None})
+
+    def test_page_fragments_render(self):
+        from pyramid.renderers import render
+        from qa.views import UserViews
+
+        request = self.request()
+        template_vars = UserViews(request).topic_page()
+        html = render('qa:templates/topic_list.pt', template_vars, request)
+        self.assertEqual(html.count('data-type="topic"'), len(template_vars['topics']))
+        self.assertIn('Load More Topics', html)
+        self.assertIn('Load More Question Sets', html)
+
+    #Only the questions on the page are reordered, between the order numbers they already had.
+    def test_reorder_page(self):
+        from pyramid.httpexceptions import HTTPOk
+        from qa.forms import ReorderResourceForm
+        from qa.models import Question
+        from qa.views import QuestionSetViews
+
+        request = self.request()
+        request.method = 'POST'
+        request.question_set = self.question_sets[0]
+        page = [self.questions[1].id, self.questions[0].id, self.questions[2].id]
+        request.POST.update({ReorderResourceForm.name_template.format(i): question_id for i, question_id in enumerate(page)})
+        request.POST['csrf_token'] = request.session.get_csrf_token()
+        self.assertIsInstance(QuestionSetViews(request).view_set(), HTTPOk)
+
+        self.db.expire_all()
+        orders = dict(self.db.query(Question.id, Question.question_order))
+        self.assertEqual([orders[question_id] for question_id in page], [0, 2, 4])
+        self.assertEqual(orders[self.questions[3].id], 6)
+
+    def test_move_question(self):
+        from pyramid.httpexceptions import HTTPClientError, HTTPOk
+        from qa.models import Question
+        from qa.views import QuestionSetViews
+
+        def move(**post):
+            request = self.request()
+            request.method = 'POST'
+            request.question_set = self.question_sets[0]
+            request.POST.update(post, csrf_token=request.session.get_csrf_token())
+            return QuestionSetViews(request).move_question()
+
+        moved, target = self.questions[5].id, self.questions[1].id
+        self.assertIsInstance(move(question_id=moved, target_id=target, position='before'), HTTPOk)
+        self.db.expire_all()
+        self.assertEqual(self.db.query(Question.question_order).filter(Question.id == moved).scalar(), 1)
+        self.assertIsInstance(move(question_id=moved, target_id=target, position='above'), HTTPClientError)
+        self.assertIsInstance(move(question_id=moved, target_id=moved, position='after'), HTTPClientError)
+
 class QuestionSetStateTests(unittest.TestCase):
     def __init__(self, *args, **kwargs):
         unittest.TestCase.__init__(self,*args,**kwargs)
@@ -273,9 +502,54 @@ class QuestionSetStateTests(unittest.TestCase):
         list_type = [].__class__
         questions = [StubQuestion(0)]
         state = QuestionSetState(questions,self.set_id)
-        dummy_answer = 0
+        dummy_answer = {'answer': 0}
         state.record_answer(dummy_answer)
         state.get_next_question()
         report = state.get_report()
 
         self.assertEqual(list_type, report.__class__, 'Report should return a list.')
+
+    def test_answers_are_unpacked_by_question_type(self):
+        from qa.models import QuestionType
+        from qa.views import QuestionSetState
+
+        questions = [StubQuestion(0, QuestionType.mcq), StubQuestion(1, QuestionType.tf), StubQuestion(2, QuestionType.math)]
+        state = QuestionSetState(questions, self.set_id)
+        state.record_answer({'answer': 3})
+        state.record_answer({'answer': 1})
+        state.record_answer({'answer': 2.5, 'units': 'm'})
+
+        self.assertEqual(state.get_answer(0), {'answer': 3})
+        self.assertIsInstance(state.get_answer(0)['answer'], int)
+        self.assertEqual(state.get_answer(1), {'answer': 1})
+        self.assertEqual(state.get_answer(2), {'answer': 2.5, 'units': 'm'})
+
+    def test_pickled_state_is_compact(self):
+        import pickle
+        from qa.views import QuestionSetState
+
+        questions = [StubQuestion(i) for i in range(0, 500)]
+        state = QuestionSetState(questions, self.set_id, 'Set')
+        for i in range(0, 500):
+            state.record_answer({'answer': i % 4})
+            state.get_next_question()
+
+        pickled = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+        self.assertLess(len(pickled), 8 * 1024)
+        restored = pickle.loads(pickled)
+        self.assertTrue(restored.ready_for_report())
+        self.assertEqual(restored.get_answer(499), {'answer': 3})
+
+    def test_state_from_other_version_is_stale(self):
+        import pickle
+        from qa.views import QuestionSetState
+
+        state = QuestionSetState([StubQuestion(0)], self.set_id)
+        pickled = pickle.dumps(state)
+        QuestionSetState.VERSION += 1
+        try:
+            restored = pickle.loads(pickled)
+        finally:
+            QuestionSetState.VERSION -= 1
+        self.assertTrue(restored.is_stale())
+        self.assertFalse(restored.ready_for_report())
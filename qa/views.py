@@ -5,18 +5,25 @@ from pyramid.view import(
     view_defaults
 )
 
+from array import array
+
 import colander
 from deform.form import Form, Button
 from deform.exception import ValidationFailure
-from . import forms
+from . import bulk_import, export, forms, stats
+from .attempts import AttemptRecord
+from .cache import get_snapshot, snapshot_cache
 from .models import(
     Question,
+    QuestionLoading,
     QuestionSet,
+    QuestionType,
     Topic,
     User,
 )
 from .security import(
     Session,
+    authorization_cache,
     requires_logged_in,
     requires_not_logged_in,
     requires_question_set_contributor,
@@ -36,44 +43,265 @@ def delete_resource(request, resource_attr):
     resource = getattr(request, resource_attr)
     request.db.delete(resource)
     request.db.commit()
+    authorization_cache.invalidate_user(Session.user_id(request.session))
     return HTTPNoContent()
 
+#Streams a topic or question set as JSON Lines (the default) or CSV, by the format query
+#parameter.  See qa.export.
+def export_response(request, filename, **filters):
+    file_format = request.GET.get('format', 'jsonl')
+    try:
+        app_iter = export.export(request.registry.db_sessionmaker, file_format, **filters)
+    except ValueError as _:
+        return HTTPClientError()
+    return Response(
+        app_iter=app_iter,
+        content_type=export.CONTENT_TYPES[file_format],
+        charset='utf-8',
+        content_disposition='attachment; filename="{}.{}"'.format(filename, file_format),
+    )
+
+#Long lists (topics, question sets and questions) are shown a page at a time, with a link
+#to load the next page in place.  Pages are keyset paginated: the link carries the sort
+#key of the page's last row and the next page is read from the index after it, so a page
+#costs the same however far into the list it is.
+TOPICS_PAGE_SIZE = 20
+QUESTION_SETS_PAGE_SIZE = 20
+QUESTIONS_PAGE_SIZE = 50
+SEARCH_PAGE_SIZE = 20
+
+#Reads the previous page's last key from the query string as a tuple, converting each value
+#with its converter, or returns None for the first page.  Raises ValueError if the key is
+#incomplete or malformed.
+def get_page_key(request, **converters):
+    if not any(name in request.GET for name in converters):
+        return None
+    try:
+        return tuple(convert(request.GET[name]) for name, convert in converters.items())
+    except KeyError as _:
+        raise ValueError('Incomplete page key.')
+
+#Rows are fetched with one more than the page size to find out whether there is another
+#page.  Returns the page and the url of the next page, or None if this is the last one.
+#key maps a row to the query string of the page after it.
+def page_and_next_url(request, rows, page_size, key, route_name, **route_kw):
+    page = rows[:page_size]
+    if len(rows) > page_size:
+        return page, request.route_url(route_name, _query=key(page[-1]), **route_kw)
+    return page, None
+
+def topic_page_key(topic):
+    return {'after_title': topic.title, 'after_id': topic.id}
+
+def question_set_page_key(question_set):
+    return {'after_description': question_set.description, 'after_id': question_set.id}
+
+def question_page_key(question):
+    return {'after': question.question_order}
+
+#Template variables for a page of topics, each with the first page of its question sets.
+def topic_page_vars(request, topics, question_sets):
+    topics, more_topics = page_and_next_url(request, topics, TOPICS_PAGE_SIZE, topic_page_key, 'profile_topics')
+    return {
+        'csrf_token': request.session.get_csrf_token(),
+        'topics': topics,
+        'more_topics': more_topics,
+        'question_set_pages': {
+            topic.id: page_and_next_url(
+                request, question_sets[topic.id], QUESTION_SETS_PAGE_SIZE, question_set_page_key,
+                'topic_question_sets', topic_id=topic.id,
+            ) for topic in topics
+        },
+    }
+
+#Whether the answer flow loads questions as they are reached (qa.answer_mode = lazy) instead
+#of loading the whole set when it is started (eager, the default).
+def lazy_answer_mode(request):
+    settings = request.registry.settings or {}
+    return settings.get('qa.answer_mode', 'eager') == 'lazy'
+
+#The answer flow's progress, kept in the session between requests.  Only question ids,
+#types and packed answers are stored so the pickled state stays a few KB even for large
+#sets.  Question instances are kept for the current request only and reloaded on demand.
+#
+#A state made with QuestionSetState.lazy doesn't load the whole set up front.  It only
+#knows the questions up to one past the current one and reads the next question ahead by
+#(question_set_id, question_order) as the user moves through the set.
 class QuestionSetState:
-    def __init__(self, questions, question_set_id, set_name = ''):
+    #Bump when the pickled layout changes.  States pickled with another version are treated
+    #as finished so the user is sent back to start the set again.
+    VERSION = 3
+
+    __slots__ = (
+        'set_name',
+        'question_set_id',
+        'question_set_version',
+        'question_ids',
+        'question_types',
+        'question_orders',
+        'complete',
+        'answer_values',
+        'answer_units',
+        'current_question',
+        '_questions',
+    )
+
+    def __init__(self, questions, question_set_id, set_name = '', complete=True, question_set_version=None):
         if questions:
             self.set_name = set_name
             self.question_set_id = question_set_id
-            self.question_list = questions
-            self.answers = []
+            #Used to find the set's cached snapshot when questions have to be reloaded.
+            self.question_set_version = question_set_version
+            self.question_ids = array('i', (question.id for question in questions))
+            self.question_types = array('B', (question.type.value for question in questions))
+            #Only lazy states need the orders to read ahead from.
+            self.question_orders = array('i', () if complete else (question.question_order for question in questions))
+            #False while there may be questions after the ones in question_ids.
+            self.complete = complete
+            self.answer_values = array('d')
+            #Only math answers have units, keyed by question index.
+            self.answer_units = {}
             self.current_question = 0
+            self._questions = {question.id: question for question in questions}
         else:
             raise ValueError('There are no questions in that set.')
 
-    def get_current_question(self):
-        return self.question_list[self.current_question]
+    #Starts a set with only its first question and the one read ahead after it.
+    def lazy(question_set_id, set_name, db, question_set_version=None):
+        questions = QuestionSet.get_questions_after(question_set_id, None, 2, db)
+        return QuestionSetState(questions, question_set_id, set_name, len(questions) < 2, question_set_version)
+
+    def __getstate__(self):
+        return (
+            self.__class__.VERSION,
+            self.set_name,
+            self.question_set_id,
+            self.question_set_version,
+            self.question_ids,
+            self.question_types,
+            self.question_orders,
+            self.complete,
+            self.answer_values,
+            self.answer_units,
+            self.current_question,
+        )
+
+    def __setstate__(self, state):
+        self._questions = {}
+        if state[0] == self.__class__.VERSION:
+            _, self.set_name, self.question_set_id, self.question_set_version, self.question_ids, self.question_types, \
+                self.question_orders, self.complete, self.answer_values, self.answer_units, \
+                self.current_question = state
+        else:
+            self.set_name = ''
+            self.question_set_id = None
+            self.question_set_version = None
+            self.question_ids = array('i')
+            self.question_types = array('B')
+            self.question_orders = array('i')
+            self.complete = True
+            self.answer_values = array('d')
+            self.answer_units = {}
+            self.current_question = 0
 
+    def is_stale(self):
+        return not self.question_ids
 
-    def get_next_question(self):
-        if self.current_question == len(self.question_list) - 1:
-            self.current_question += 1
+    def _snapshot(self):
+        if self.question_set_version is None:
             return None
-        elif self.current_question == len(self.question_list):
-            return None
-        else:
+        return snapshot_cache.get(self.question_set_id, self.question_set_version)
+
+    #Returns the questions with the given ids, loading the ones this request hasn't seen yet
+    #from the set's cached snapshot or the database.  Raises a ValueError if one of them has
+    #been deleted since the set was started.
+    def _load_questions(self, question_ids, db):
+        missing = [i for i in question_ids if i not in self._questions]
+        snapshot = self._snapshot() if missing else None
+        if snapshot:
+            for i in missing:
+                if i in snapshot.questions_by_id:
+                    self._questions[i] = snapshot.questions_by_id[i]
+            missing = [i for i in missing if i not in self._questions]
+        if missing:
+            for question in Question.get_questions_by_id(missing, db):
+                self._questions[question.id] = question
+        if any(i not in self._questions for i in question_ids):
+            raise ValueError('The question set was changed while you were answering it, please start again.')
+        return [self._questions[i] for i in question_ids]
+
+    def get_current_question(self, db=None):
+        return self._load_questions([self.question_ids[self.current_question]], db)[0]
+
+    #Replaces the questions from the current one on with the current question and the one
+    #after it, fetched in one query on the (question_set_id, question_order) index.
+    def _read_ahead(self, db):
+        i = self.current_question
+        after = self.question_orders[i - 1] if i else None
+        questions = QuestionSet.get_questions_after(self.question_set_id, after, 2, db)
+        del self.question_ids[i:]
+        del self.question_types[i:]
+        del self.question_orders[i:]
+        for question in questions:
+            self.question_ids.append(question.id)
+            self.question_types.append(question.type.value)
+            self.question_orders.append(question.question_order)
+            self._questions[question.id] = question
+        self.complete = len(questions) < 2
+
+    def get_next_question(self, db=None):
+        if self.current_question < len(self.question_ids):
             self.current_question += 1
-            return self.question_list[self.current_question]
+        if not self.complete and self.current_question >= len(self.question_ids) - 1:
+            self._read_ahead(db)
+        if self.current_question == len(self.question_ids):
+            return None
+        return self.get_current_question(db)
 
     def record_answer(self, answer):
-        self.answers.append(answer)
+        if 'units' in answer:
+            self.answer_units[len(self.answer_values)] = answer['units']
+        self.answer_values.append(answer['answer'])
+
+    #Unpacks an answer into the dictionary produced by the question's answer schema.
+    def get_answer(self, index):
+        value = self.answer_values[index]
+        if self.question_types[index] != QuestionType.math.value:
+            value = int(value)
+        answer = {'answer': value}
+        if index in self.answer_units:
+            answer['units'] = self.answer_units[index]
+        return answer
 
     def ready_for_report(self):
-        return self.current_question == len(self.question_list)
+        return not self.is_stale() and self.complete and self.current_question == len(self.question_ids)
+
+    #Returns whether each answer is correct, in question order.
+    def get_results(self, db=None):
+        snapshot = self._snapshot()
+        if snapshot and len(snapshot.questions) == len(self.question_ids):
+            return [snapshot.is_correct(i, self.get_answer(i)) for i in range(len(self.question_ids))]
+        questions = self._load_questions(self.question_ids, db)
+        return [question.is_correct(question.answer_key(), self.get_answer(i)) for i, question in enumerate(questions)]
+
+    #Returns the number of correctly answered questions.
+    def get_score(self, db=None):
+        return sum(self.get_results(db))
+
+    #The finished attempt, to be saved with qa.attempts.AttemptWriter.
+    def get_attempt(self, user_id, db=None):
+        answers = [
+            (self.question_ids[i], self.answer_values[i], self.answer_units.get(i), correct)
+            for i, correct in enumerate(self.get_results(db))
+        ]
+        return AttemptRecord(user_id, self.question_set_id, self.question_set_version, answers)
 
     #Returns a list of tuples (description, correct answer, chosen answer, True/False)
-    def get_report(self):
+    def get_report(self, db=None):
+        questions = self._load_questions(self.question_ids, db)
         report = []
-        for i, question in enumerate(self.question_list):
-            report.append(question.report(self.answers[i]))
+        for i, question in enumerate(questions):
+            report.append(question.report(self.get_answer(i)))
         return report
 
 class TopicViews:
@@ -109,41 +337,97 @@ class TopicViews:
     def delete_topic(self):
         return delete_resource(self.request, 'topic')
 
+    @view_config(route_name='export_topic', request_method='GET', decorator=(requires_logged_in, requires_topic_owner))
+    def export_topic(self):
+        return export_response(self.request, 'topic-{}'.format(self.request.topic.id), topic_id=self.request.topic.id)
+
 class QuestionSetViews:
     def __init__(self,request):
         self.request = request
 
+    #Shows the first page of the set's questions.  Questions are reordered by dragging them,
+    #which posts each move to move_question.  A POST here reorders the questions loaded on
+    #the page all at once, see QuestionSet.reorder.
     @view_config(route_name='view_question_set', renderer='templates/question_set.pt', decorator=(requires_logged_in, requires_question_set_contributor))
     def view_set(self):
-        questions = self.request.question_set.questions
-        question_ids = [q.id for q in questions]
-
-        template_vars = {
-            'page_title': 'Viewing Question Set',
-            'username': self.request.username,
-            'question_set_description': self.request.question_set.description,
-            'question_set_id': self.request.question_set.id,
-            'questions': questions,
-            'question_choices': forms.get_question_select_options(self.request.route_url('question_creation_form')),
-            'csrf_token': self.request.session.get_csrf_token(),
-        }
-        if question_ids:
-            reorder_form = forms.ReorderResourceForm(self.request, question_ids, 'Reorder')
         if self.request.method == 'GET':
-            if question_ids:
-                template_vars['reorder_form'] = reorder_form
+            template_vars = self.question_page_vars(None)
+            template_vars.update({
+                'page_title': 'Viewing Question Set',
+                'username': self.request.username,
+                'question_set_description': self.request.question_set.description,
+                'question_choices': forms.get_question_select_options(self.request.route_url('question_creation_form')),
+            })
             return template_vars
-        elif self.request.method == 'POST' and question_ids:
+        elif self.request.method == 'POST':
             try:
+                reorder_form = forms.ReorderResourceForm(self.request, None, 'Reorder')
                 appstruct = reorder_form.validate(self.request.POST)
                 self.request.question_set.reorder(appstruct, self.request.db)
                 return HTTPOk()
             except ValueError as _:
                 return HTTPClientError()
-            return HTTPFound(self.request.route_url('profile'))
         else:
             return HTTPClientError()
 
+    #Moves one question to just before or after another.  Expects the question's id in
+    #'question_id', the other's in 'target_id' and 'position' of 'before' or 'after'.
+    @view_config(route_name='move_question', request_method='POST', decorator=(requires_logged_in, requires_question_set_contributor))
+    def move_question(self):
+        schema = forms.MoveQuestionSchema().bind(request=self.request)
+        try:
+            appstruct = schema.deserialize(self.request.POST)
+            self.request.question_set.move(
+                appstruct['question_id'], appstruct['target_id'], appstruct['position'] == 'after', self.request.db
+            )
+        except (colander.Invalid, ValueError) as _:
+            return HTTPClientError()
+        return HTTPOk()
+
+    #The questions after the given question_order, as list items to add to the set's page.
+    @view_config(route_name='question_set_questions', renderer='templates/question_list.pt', request_method='GET', decorator=(requires_logged_in, requires_question_set_contributor))
+    def question_page(self):
+        try:
+            after = get_page_key(self.request, after=int)
+        except ValueError as _:
+            return HTTPClientError()
+        return self.question_page_vars(after[0] if after else None)
+
+    def question_page_vars(self, after_order):
+        question_set_id = self.request.question_set.id
+        #The list only shows the questions' descriptions, so their type tables aren't read.
+        questions = QuestionSet.get_questions_after(
+            question_set_id, after_order, QUESTIONS_PAGE_SIZE + 1, self.request.db, QuestionLoading.base
+        )
+        questions, more_questions = page_and_next_url(
+            self.request, questions, QUESTIONS_PAGE_SIZE, question_page_key,
+            'question_set_questions', question_set_id=question_set_id,
+        )
+        return {
+            'csrf_token': self.request.session.get_csrf_token(),
+            'question_set_id': question_set_id,
+            'questions': questions,
+            'more_questions': more_questions,
+        }
+
+
+    #Imports questions of one type from an uploaded JSON Lines or CSV file, see qa.bulk_import.
+    #Expects the file in 'file', the question type name in 'type' and optionally 'format' if the
+    #file name doesn't end in .jsonl or .csv.  Responds with the number of questions imported
+    #and the errors of the lines that weren't.
+    @view_config(route_name='import_questions', renderer='json', request_method='POST', decorator=(requires_logged_in, requires_question_set_contributor))
+    def import_questions(self):
+        try:
+            if self.request.POST['csrf_token'] != self.request.session.get_csrf_token():
+                return HTTPClientError()
+            upload = self.request.POST['file']
+            rows = bulk_import.read_upload(upload.file, upload.filename, self.request.POST.get('format'))
+            result = bulk_import.import_questions(
+                self.request.question_set.id, self.request.POST['type'], rows, self.request.db
+            )
+        except (AttributeError, KeyError, ValueError) as _:
+            return HTTPClientError()
+        return result.as_dict()
 
     @view_config(route_name='edit_question_set', renderer='templates/question_set_edit.pt', request_method='GET', decorator=(requires_logged_in, requires_question_set_contributor))
     def edit_set_get(self):
@@ -175,8 +459,55 @@ class QuestionSetViews:
 
     @view_config(route_name='delete_question_set', decorator=(requires_logged_in, requires_question_set_contributor))
     def delete_set(self):
+        snapshot_cache.invalidate(self.request.question_set.id)
         return delete_resource(self.request, 'question_set')
 
+    def clone_form(self):
+        choices = forms.QuestionSetsSchema.prepare_topics(Topic.get_choices(Session.user_id(self.request.session), self.request.db))
+        schema = forms.QuestionSetCloneSchema().bind(request=self.request, choices=choices)
+        return Form(schema, buttons=('copy',))
+
+    @view_config(route_name='clone_question_set', renderer='templates/question_set_clone.pt', request_method='GET', decorator=(requires_logged_in, requires_question_set_contributor))
+    def clone_set_get(self):
+        question_set = self.request.question_set
+        return {
+            'page_title': 'Copy Question Set',
+            'username': self.request.username,
+            'clone_form': self.clone_form().render({
+                QuestionSet.topic_id.name: question_set.topic_id,
+                QuestionSet.description.name: question_set.description + ' (copy)',
+            }),
+        }
+
+    #Copies the set and its questions, see QuestionSet.clone, and shows the copy.
+    @view_config(route_name='clone_question_set', renderer='templates/question_set_clone.pt', request_method='POST', decorator=(requires_logged_in, requires_question_set_contributor))
+    def clone_set_post(self):
+        template_vars = {'page_title': 'Copy Question Set', 'username': self.request.username}
+        clone_form = self.clone_form()
+        try:
+            appstruct = clone_form.validate(self.request.POST.items())
+            new_question_set = self.request.question_set.clone(
+                appstruct[QuestionSet.topic_id.name], appstruct[QuestionSet.description.name], self.request.db
+            )
+            return HTTPFound(self.request.route_url('view_question_set', question_set_id=new_question_set.id))
+        except ValueError as e:
+            exc = colander.Invalid(clone_form.widget, str(e))
+            clone_form.widget.handle_error(clone_form, exc)
+            template_vars['clone_form'] = clone_form.render()
+        except ValidationFailure as e:
+            template_vars['clone_form'] = e.render()
+        return template_vars
+
+    #Answer counts per question and per multiple choice answer, see qa.stats.
+    @view_config(route_name='question_set_stats', renderer='json', request_method='GET', decorator=(requires_logged_in, requires_question_set_contributor))
+    def set_stats(self):
+        return {'questions': stats.get_set_stats(self.request.question_set.id, self.request.db)}
+
+    @view_config(route_name='export_question_set', request_method='GET', decorator=(requires_logged_in, requires_question_set_contributor))
+    def export_set(self):
+        question_set_id = self.request.question_set.id
+        return export_response(self.request, 'set-{}'.format(question_set_id), question_set_id=question_set_id)
+
 class QuestionViews:
     def __init__(self,request):
         self.request = request
@@ -250,6 +581,7 @@ class QuestionViews:
 
     @view_config(route_name='delete_question', decorator=(requires_logged_in, requires_question_contributor))
     def delete_question(self):
+        QuestionSet.bump_version(self.request.question.question_set_id, self.request.db)
         return delete_resource(self.request, 'question')
 
     #Sets up the list of questions for the user to answer and presents the first question.
@@ -258,11 +590,18 @@ class QuestionViews:
     def setup(self):
         question_set_id = self.request.question_set.id
         set_name = self.request.question_set.description
-        question_set = self.request.question_set.get_questions(self.request.db)
+        version = self.request.question_set.version
         try:
             template_vars = {'page_title':'Answer', 'username': self.request.username} #Need better title.
-            self.request.session[Session.QUESTION_STATE] = QuestionSetState(question_set, question_set_id, set_name)
-            question = self.request.session[Session.QUESTION_STATE].get_current_question()
+            snapshot = snapshot_cache.get(question_set_id, version)
+            if lazy_answer_mode(self.request) and not snapshot:
+                state = QuestionSetState.lazy(question_set_id, set_name, self.request.db, version)
+            else:
+                if not snapshot:
+                    snapshot = get_snapshot(self.request.question_set, self.request.db)
+                state = QuestionSetState(snapshot.questions, question_set_id, set_name, question_set_version=version)
+            self.request.session[Session.QUESTION_STATE] = state
+            question = self.request.session[Session.QUESTION_STATE].get_current_question(self.request.db)
             schema = question.answer_schema(self.request)
             question_form = Form(schema, buttons=('submit',))
             template_vars['question_form'] = question_form.render()
@@ -273,18 +612,19 @@ class QuestionViews:
 
     @view_config(route_name='answer_question_set', renderer='templates/answer.pt', request_method='POST', decorator=(requires_logged_in, requires_question_set_contributor))
     def answer(self):
-        if 'submit' in self.request.POST and Session.QUESTION_STATE in self.request.session:
+        if 'submit' in self.request.POST and Session.QUESTION_STATE in self.request.session \
+            and not self.request.session[Session.QUESTION_STATE].is_stale():
             template_vars = {'page_title':'Answer', 'username': self.request.username}
             try:
                 #Store the previous question's answer.
-                question = self.request.session[Session.QUESTION_STATE].get_current_question()
+                question = self.request.session[Session.QUESTION_STATE].get_current_question(self.request.db)
                 schema = question.answer_schema(self.request)
                 question_form = Form(schema)
                 appstruct = question_form.validate(self.request.POST.items())
                 self.request.session[Session.QUESTION_STATE].record_answer(appstruct['answer'])
 
                 #Present the next question.
-                question = self.request.session[Session.QUESTION_STATE].get_next_question()
+                question = self.request.session[Session.QUESTION_STATE].get_next_question(self.request.db)
                 if question:
                     schema = question.answer_schema(self.request)
                     question_form = Form(schema, buttons=('submit',))
@@ -293,18 +633,31 @@ class QuestionViews:
                     return HTTPFound(self.request.route_url('report'))
             except ValidationFailure as e:
                 template_vars['question_form'] = e.render()
+            except ValueError as e:
+                del self.request.session[Session.QUESTION_STATE]
+                self.request.session.flash(str(e))
+                return HTTPFound(self.request.route_url('profile'))
             return template_vars
         else:
             return HTTPFound(self.request.route_url('profile'))
 
-    #Displays the results of the user answering the question set and clears the question
-    #state in the session.
+    #Displays the results of the user answering the question set, queues the attempt to be
+    #saved (see qa.attempts) and clears the question state in the session.
     @view_config(route_name='report', renderer='templates/report.pt',decorator=(requires_logged_in,))
     def report(self):
         template_vars = {'page_title':'Report', 'username': self.request.username}
         if Session.QUESTION_STATE in self.request.session and self.request.session[Session.QUESTION_STATE].ready_for_report():
+            try:
+                attempt = self.request.session[Session.QUESTION_STATE].get_attempt(Session.user_id(self.request.session), self.request.db)
+                template_vars['report'] = self.request.session[Session.QUESTION_STATE].get_report(self.request.db)
+            except ValueError as e:
+                del self.request.session[Session.QUESTION_STATE]
+                self.request.session.flash(str(e))
+                return HTTPFound(self.request.route_url('profile'))
+            self.request.registry.attempt_writer.submit(attempt)
             template_vars['set_name'] = self.request.session[Session.QUESTION_STATE].set_name
-            template_vars['report'] = self.request.session[Session.QUESTION_STATE].get_report()
+            template_vars['score'] = attempt.score()
+            template_vars['question_count'] = len(template_vars['report'])
             del self.request.session[Session.QUESTION_STATE]
             return template_vars
         else:
@@ -318,20 +671,25 @@ class UserViews:
     #Might do some unnecessary work depending on the outcome of the view method but improves readability.
     #Returns a dictionary to be passed to the renderer, and two deform forms, the latter of which can be None
     #if the user has not made any topics.
+    #Only the first page of topics, and of each topic's question sets, is loaded.  The question
+    #set form still needs every topic but only their ids and titles are read for it.
     def profile_vars(self):
-        user = User.get_user(Session.user_id(self.request.session),self.request.db)
-        template_vars = {
-            'csrf_token': self.request.session.get_csrf_token(),
+        user_id = Session.user_id(self.request.session)
+        topics, question_sets, _ = Topic.get_profile_page(
+            user_id, None, TOPICS_PAGE_SIZE + 1, QUESTION_SETS_PAGE_SIZE + 1, self.request.db
+        )
+        template_vars = topic_page_vars(self.request, topics, question_sets)
+        template_vars.update({
             'page_title':'Profile',
             'username': self.request.username,
-            'user':user,
-        }
+        })
         schema = forms.TopicsSchema().bind(request=self.request)
         add_topic_form = Form(schema, buttons=('add topics',))
 
         #TODO: Figure out how to make buttons multiple words without uncapitalizing every word after the first.
-        if user.topics:
-            schema = forms.QuestionSetsSchema().bind(request=self.request,choices=forms.QuestionSetsSchema.prepare_topics(user.topics))
+        if template_vars['topics']:
+            topic_choices = Topic.get_choices(user_id, self.request.db)
+            schema = forms.QuestionSetsSchema().bind(request=self.request,choices=forms.QuestionSetsSchema.prepare_topics(topic_choices))
             add_question_set_form = Form(schema, buttons=('add question sets',))
             return template_vars, add_topic_form, add_question_set_form
         else:
@@ -379,6 +737,10 @@ class UserViews:
                     exc = colander.Invalid(form.widget, 'Username or password is incorrect.')
                     form.widget.handle_error(form, exc)
                     rendered_form = form.render()
+            except ValueError as e:
+                exc = colander.Invalid(form.widget, str(e))
+                form.widget.handle_error(form, exc)
+                rendered_form = form.render()
             except ValidationFailure as e:
                 rendered_form = e.render()
         else:
@@ -387,7 +749,7 @@ class UserViews:
 
     @view_config(route_name='logout',decorator=(requires_logged_in,))
     def logout(self):
-        Session.logout(self.request.session)
+        Session.logout(self.request.session, self.request.registry.session_store)
         return HTTPFound(self.request.route_url('login'))
 
     @view_config(route_name='profile', renderer='templates/profile.pt', request_method='POST', decorator=(requires_logged_in,))
@@ -428,6 +790,70 @@ class UserViews:
 
         return template_vars
 
+    #The topics after the given (title, id), as items to add to the profile page.
+    @view_config(route_name='profile_topics', renderer='templates/topic_list.pt', request_method='GET', decorator=(requires_logged_in,))
+    def topic_page(self):
+        try:
+            after = get_page_key(self.request, after_title=str, after_id=int)
+        except ValueError as _:
+            return HTTPClientError()
+        topics, question_sets, _ = Topic.get_profile_page(
+            Session.user_id(self.request.session), after, TOPICS_PAGE_SIZE + 1, QUESTION_SETS_PAGE_SIZE + 1, self.request.db
+        )
+        return topic_page_vars(self.request, topics, question_sets)
+
+    #Searches the questions in the user's topics for the terms in q, see Question.search.
+    #Responds with a page of matches, best first, and the url of the next page or null.
+    @view_config(route_name='search', renderer='json', request_method='GET', decorator=(requires_logged_in,))
+    def search(self):
+        terms = self.request.GET.get('q', '').strip()
+        try:
+            after = get_page_key(self.request, after_rank=float, after_id=int)
+        except ValueError as _:
+            return HTTPClientError()
+        if not terms:
+            return {'results': [], 'next': None}
+        results = Question.search(Session.user_id(self.request.session), terms, after, SEARCH_PAGE_SIZE + 1, self.request.db)
+        results, next_url = page_and_next_url(
+            self.request, results, SEARCH_PAGE_SIZE,
+            lambda result: {'q': terms, 'after_rank': repr(result.rank), 'after_id': result.id}, 'search',
+        )
+        return {
+            'results': [
+                {
+                    'question_id': result.id,
+                    'description': result.description,
+                    'type': result.type.name,
+                    'question_set_id': result.question_set_id,
+                    'question_set': result.question_set,
+                    'topic': result.topic,
+                    'rank': result.rank,
+                }
+                for result in results
+            ],
+            'next': next_url,
+        }
+
+    #The topic's question sets after the given (description, id), as items to add to the topic.
+    @view_config(route_name='topic_question_sets', renderer='templates/question_set_list.pt', request_method='GET', decorator=(requires_logged_in, requires_topic_owner))
+    def question_set_page(self):
+        try:
+            after = get_page_key(self.request, after_description=str, after_id=int)
+        except ValueError as _:
+            return HTTPClientError()
+        topic_id = self.request.topic.id
+        question_sets = QuestionSet.get_sets_after(topic_id, after, QUESTION_SETS_PAGE_SIZE + 1, self.request.db)
+        question_sets, more_question_sets = page_and_next_url(
+            self.request, question_sets, QUESTION_SETS_PAGE_SIZE, question_set_page_key,
+            'topic_question_sets', topic_id=topic_id,
+        )
+        return {
+            'csrf_token': self.request.session.get_csrf_token(),
+            'topic_id': topic_id,
+            'question_sets': question_sets,
+            'more_question_sets': more_question_sets,
+        }
+
     @view_config(route_name='profile', renderer='templates/profile.pt', request_method='GET', decorator=(requires_logged_in,))
     def profile_get(self):
         template_vars, add_topic_form, add_question_set_form = self.profile_vars()
@@ -2,6 +2,7 @@ from setuptools import setup
 
 requires = [
     'deform',
+    'numpy',
     'passlib',
     'psycopg2',
     'pymongo',
@@ -15,5 +16,10 @@ setup(name='qa',
     entry_points="""\
     [paste.app_factory]
     main = qa:main
+    [console_scripts]
+    qa_migrate = qa.schema:main
+    qa_export = qa.export:main
+    qa_rebuild_stats = qa.stats:main
+    qa_payloads = qa.payloads:main
     """,
 )